@@ -0,0 +1,156 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from therapy_management.cache_versions import VersionStamp
+
+PRINCIPAL_KEY_PREFIX = 'auth_principal'
+PRINCIPAL_VERSION_KEY_PREFIX = 'auth_principal_version'
+
+
+class LocalPrincipalCache:
+    """
+    Bounded, thread-safe LRU of pickled principals with a short TTL. Values
+    are stored pickled so every request gets its own copy of the user.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, payload = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return pickle.loads(payload)
+
+    def set(self, key, value):
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_principals = LocalPrincipalCache(
+    max_size=getattr(settings, 'AUTH_PRINCIPAL_LOCAL_SIZE', 1024),
+    ttl=getattr(settings, 'AUTH_PRINCIPAL_LOCAL_TTL', 5)
+)
+
+
+class PrincipalCache:
+    """
+    Validated token principals: the Token with its user and the user's
+    therapist/client profile already attached, so neither authentication
+    nor request.user.therapist_profile / client_profile touch the database.
+
+    Lookups go to the in-process LRU, then Redis, then one select_related
+    query. Redis keys are a hash of the token, never the token itself.
+    Entries are revoked when the token is deleted (logout) and when the
+    user or one of their profiles is saved (password change, deactivation,
+    profile edits). Revoking bumps a per-token version stamp rather than
+    deleting the entry, and Redis entries carry the version they were
+    loaded under, so a lookup that read the database just before the
+    revoke can't put the old principal back. Other processes may keep
+    serving a revoked principal for at most AUTH_PRINCIPAL_LOCAL_TTL seconds. Effective roles and
+    permissions are not part of the principal; PermissionResolver caches
+    and versions those separately.
+    """
+
+    @staticmethod
+    def timeout():
+        return getattr(settings, 'AUTH_PRINCIPAL_CACHE_TIMEOUT', 5 * 60)
+
+    @staticmethod
+    def key(token_key):
+        return f"{PRINCIPAL_KEY_PREFIX}:{hashlib.sha256(token_key.encode()).hexdigest()}"
+
+    @staticmethod
+    def version_key(token_key):
+        return f"{PRINCIPAL_VERSION_KEY_PREFIX}:{hashlib.sha256(token_key.encode()).hexdigest()}"
+
+    @staticmethod
+    def get(token_key):
+        key = PrincipalCache.key(token_key)
+        token = local_principals.get(key)
+        if token is not None:
+            return token
+
+        version_key = PrincipalCache.version_key(token_key)
+        cached = cache.get_many([key, version_key])
+        version = cached.get(version_key, 1)
+        entry = cached.get(key)
+        if entry is not None and entry[0] == version:
+            token = entry[1]
+        else:
+            token = PrincipalCache._load(token_key)
+            if token is None:
+                return None
+            # Stamped with the version read before the load: a revoke that
+            # lands in between bumps it, and this entry is never served
+            cache.set(key, (version, token), PrincipalCache.timeout())
+
+        local_principals.set(key, token)
+        return token
+
+    @staticmethod
+    def _load(token_key):
+        try:
+            return Token.objects.select_related(
+                'user',
+                'user__therapist_profile',
+                'user__client_profile'
+            ).get(key=token_key)
+        except Token.DoesNotExist:
+            return None
+
+    @staticmethod
+    def revoke(token_key):
+        local_principals.discard(PrincipalCache.key(token_key))
+        VersionStamp.bump(PrincipalCache.version_key(token_key))
+
+    @staticmethod
+    def revoke_user(user_id):
+        for token_key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+            PrincipalCache.revoke(token_key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication served from PrincipalCache
+    """
+
+    def authenticate_credentials(self, key):
+        token = PrincipalCache.get(key)
+        if token is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (token.user, token)
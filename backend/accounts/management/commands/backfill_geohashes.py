@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from accounts.models import User
+from therapy_management import geohash
+
+
+class Command(BaseCommand):
+    help = 'Fill in or repair the geohash spatial index column for located users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        users = User.objects.filter(
+            latitude__isnull=False,
+            longitude__isnull=False
+        ).only('id', 'latitude', 'longitude', 'geohash').order_by('id')
+
+        checked = 0
+        updated = 0
+        batch = []
+        for user in users.iterator(chunk_size=batch_size):
+            checked += 1
+            expected = geohash.encode(float(user.latitude), float(user.longitude))
+            if user.geohash != expected:
+                user.geohash = expected
+                batch.append(user)
+            if len(batch) >= batch_size:
+                User.objects.bulk_update(batch, ['geohash'])
+                updated += len(batch)
+                batch = []
+        if batch:
+            User.objects.bulk_update(batch, ['geohash'])
+            updated += len(batch)
+
+        cleared = User.objects.filter(
+            Q(latitude__isnull=True) | Q(longitude__isnull=True)
+        ).exclude(geohash='').update(geohash='')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Checked {checked} located users, updated {updated}, cleared {cleared}')
+        )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from accounts.models import User
+from accounts.search import SEARCH_VECTOR, TRIGRAM_DOCUMENT
+
+
+class Command(BaseCommand):
+    help = 'Create the Postgres full-text and trigram indexes behind user search'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write(f'Skipping: {connection.vendor} uses the icontains search fallback')
+            return
+
+        table = connection.ops.quote_name(User._meta.db_table)
+        statements = [
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+            # CONCURRENTLY keeps the user table writable while the indexes build
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS accounts_user_search_vector_idx '
+            f'ON {table} USING gin (({SEARCH_VECTOR}))',
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS accounts_user_search_trgm_idx '
+            f'ON {table} USING gin (({TRIGRAM_DOCUMENT}) gin_trgm_ops)',
+        ]
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+                self.stdout.write(statement)
+
+        self.stdout.write(self.style.SUCCESS('User search indexes are in place'))
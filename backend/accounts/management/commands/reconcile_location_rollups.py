@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from therapy_management.location_rollup import LocationRollupManager
+
+
+class Command(BaseCommand):
+    help = 'Recount the per-pincode geographic rollups and correct any drift'
+
+    def handle(self, *args, **options):
+        result = LocationRollupManager.reconcile()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {result['created']}, updated {result['updated']}, deleted {result['deleted']} rollup rows"
+            )
+        )
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.core.validators import RegexValidator
+from therapy_management import geohash
 
 
 class Role(models.Model):
@@ -75,7 +76,7 @@ class User(AbstractUser):
     ]
 
     phone_regex = RegexValidator(
-        regex=r'^\+?1?\d{9,15}$',$',
+        regex=r'^\+?1?\d{9,15}$',
         message="Phone number must be entered in the format: '+999999999'. Up to 15 digits allowed."
     )
 
@@ -88,6 +89,7 @@ class User(AbstractUser):
     # Location for geotagging
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
     
     # Profile
     profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
@@ -111,24 +113,41 @@ class User(AbstractUser):
     def __str__(self):
         return f"{self.username} ({self.get_user_type_display()})"
 
+    class Meta(AbstractUser.Meta):
+        swappable = 'AUTH_USER_MODEL'
+        indexes = [
+            # Keyset pagination of the admin user list
+            models.Index(fields=['-created_at', '-id'], name='accounts_user_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keep the spatial index column in step with the coordinates
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = geohash.encode(float(self.latitude), float(self.longitude))
+        else:
+            self.geohash = ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
+
     def has_role(self, role_name):
         """Check if user has a specific role"""
-        return self.roles.filter(name=role_name, is_active=True).exists()
+        from .utils import PermissionResolver
+        return role_name in PermissionResolver.resolve(self)['roles']
 
     def has_permission(self, permission_codename):
         """Check if user has a specific permission through their roles"""
-        return Permission.objects.filter(
-            codename=permission_codename,
-            is_active=True,
-            permission_roles__role__in=self.roles.filter(is_active=True)
-        ).exists()
+        from .utils import PermissionResolver
+        return permission_codename in PermissionResolver.resolve(self)['permissions']
 
     def get_permissions(self):
         """Get all permissions for this user"""
+        from .utils import PermissionResolver
         return Permission.objects.filter(
             is_active=True,
-            permission_roles__role__in=self.roles.filter(is_active=True)
-        ).distinct()
+            codename__in=PermissionResolver.resolve(self)['permissions']
+        )
 
     def is_super_admin(self):
         """Check if user is a super admin"""
@@ -179,4 +198,58 @@ class UserSession(models.Model):
         return f"{self.user.username} - {self.created_at}"
 
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+
+class GeocodeCache(models.Model):
+    """
+    Persistent cache of geocoding results, keyed by normalized address and pincode.
+    A row without coordinates records that nothing was found for the address.
+    """
+    SOURCES = [
+        ('geocoder', 'Geocoder'),
+        ('pincode_centroid', 'Pincode Centroid'),
+        ('not_found', 'Not Found'),
+    ]
+
+    address_key = models.CharField(max_length=40, unique=True, help_text="SHA-1 of the normalized address and pincode")
+    address = models.TextField()
+    pincode = models.CharField(max_length=10, blank=True, db_index=True)
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    formatted_address = models.TextField(blank=True)
+    source = models.CharField(max_length=20, choices=SOURCES, default='geocoder')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.address}, {self.pincode} ({self.get_source_display()})"
+
+    class Meta:
+        ordering = ['-created_at']
+
+
+class LocationRollup(models.Model):
+    """
+    Per-pincode counts of users, clients, therapists and companies, kept
+    current by the signals in accounts/signals.py and reconciled periodically.
+    """
+    ENTITY_TYPES = [
+        ('user', 'User'),
+        ('client', 'Client'),
+        ('therapist', 'Therapist'),
+        ('company', 'Company'),
+    ]
+
+    entity_type = models.CharField(max_length=20, choices=ENTITY_TYPES)
+    pincode = models.CharField(max_length=10, blank=True)
+    total = models.IntegerField(default=0)
+    with_location = models.IntegerField(default=0, help_text="Rows with latitude and longitude")
+    active = models.IntegerField(default=0, help_text="Active clients/companies/users, approved therapists")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.get_entity_type_display()} {self.pincode or '-'}: {self.total}"
+
+    class Meta:
+        unique_together = ['entity_type', 'pincode']
+        ordering = ['entity_type', '-active']
@@ -0,0 +1,208 @@
+import base64
+import json
+import re
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import BooleanField, Case, FloatField, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# The index DDL in create_user_search_indexes and the queries below must use
+# these exact expressions for Postgres to match them to the indexes.
+SEARCH_DOCUMENT = (
+    "coalesce(username, '') || ' ' || coalesce(first_name, '') || ' ' || "
+    "coalesce(last_name, '') || ' ' || coalesce(email, '')"
+)
+SEARCH_VECTOR = f"to_tsvector('simple', {SEARCH_DOCUMENT})"
+TRIGRAM_DOCUMENT = f"lower({SEARCH_DOCUMENT})"
+
+# Trigram indexes can only serve LIKE patterns of at least three characters
+MIN_SUBSTRING_LENGTH = 3
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class UserSearch:
+    """
+    Ranked user search for admin lookups.
+
+    On Postgres a user matches when every word of the query is a prefix of
+    a word in their username, names or email (tsvector with prefix
+    tsquery, for type-ahead), or when every term appears anywhere in them
+    (trigram LIKE, which also covers partial emails). Both arms are served
+    by GIN indexes created with ``manage.py create_user_search_indexes``,
+    and results are ranked by ts_rank plus trigram similarity (ts_rank
+    alone until that command has installed pg_trgm). Elsewhere
+    (SQLite in tests) the same matching is done with icontains and results
+    are ranked by which field starts with the query.
+
+    Results are annotated with ``search_rank`` and ordered by it, then id,
+    ready for keyset pagination.
+    """
+
+    # Database alias -> whether pg_trgm is installed; a miss is checked again
+    # on the next search, so installing it later needs no restart
+    _trigram = {}
+
+    @staticmethod
+    def search(queryset, query):
+        query = query.strip().lower()
+        if not query:
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).order_by('-search_rank', '-id')
+        if connection.vendor == 'postgresql':
+            return UserSearch._search_postgres(queryset, query)
+        return UserSearch._search_fallback(queryset, query)
+
+    @staticmethod
+    def _search_postgres(queryset, query):
+        words = re.findall(r'\w+', query)
+        tsquery = ' & '.join(f'{word}:*' for word in words)
+        terms = [term for term in query.split() if len(term) >= MIN_SUBSTRING_LENGTH]
+
+        arms = []
+        params = []
+        if tsquery:
+            arms.append(f"{SEARCH_VECTOR} @@ to_tsquery('simple', %s)")
+            params.append(tsquery)
+        if terms:
+            arms.append('(' + ' AND '.join(f"{TRIGRAM_DOCUMENT} LIKE %s" for _ in terms) + ')')
+            params.extend(f'%{_escape_like(term)}%' for term in terms)
+        if not arms:
+            return queryset.none()
+
+        rank_terms = []
+        rank_params = []
+        if tsquery:
+            rank_terms.append(f"ts_rank({SEARCH_VECTOR}, to_tsquery('simple', %s))")
+            rank_params.append(tsquery)
+        if UserSearch._has_trigram(queryset.db):
+            rank_terms.append(f"similarity({TRIGRAM_DOCUMENT}, %s)")
+            rank_params.append(query)
+        # ts_rank and similarity return real; compare as double precision so
+        # the keyset cursor (a Python float) matches the rank it came from
+        rank_sql = f"({' + '.join(rank_terms) or '0'})::double precision"
+
+        return queryset.filter(
+            RawSQL(' OR '.join(arms), params, output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL(rank_sql, rank_params, output_field=FloatField())
+        ).order_by('-search_rank', '-id')
+
+    @staticmethod
+    def _has_trigram(using):
+        if not UserSearch._trigram.get(using):
+            with connections[using].cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                UserSearch._trigram[using] = cursor.fetchone() is not None
+        return UserSearch._trigram[using]
+
+    @staticmethod
+    def _search_fallback(queryset, query):
+        matches = Q()
+        for term in query.split():
+            matches &= (
+                Q(username__icontains=term) |
+                Q(first_name__icontains=term) |
+                Q(last_name__icontains=term) |
+                Q(email__icontains=term)
+            )
+        return queryset.filter(matches).annotate(
+            search_rank=Case(
+                When(username__istartswith=query, then=Value(3)),
+                When(Q(first_name__istartswith=query) | Q(last_name__istartswith=query), then=Value(2)),
+                When(email__istartswith=query, then=Value(1)),
+                default=Value(0),
+                output_field=IntegerField()
+            )
+        ).order_by('-search_rank', '-id')
+
+
+class UserKeysetPagination(BasePagination):
+    """
+    Keyset pagination over a queryset ordered by (``view.keyset_field``, id),
+    both descending. The cursor holds the last row's key, so every page
+    costs one index range scan however deep it is and no COUNT is run.
+
+    This replaced page-number pagination: responses no longer carry
+    ``count`` or ``previous``, and pages past the first are reached by
+    following ``next``. ``?page=1`` is still accepted as the first page;
+    any other ``page`` is rejected with a 400 rather than silently
+    serving page one.
+    """
+    cursor_query_param = 'cursor'
+    page_query_param = 'page'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.field = view.keyset_field
+        self.page_size = self.get_page_size(request)
+
+        self.check_page_param(request)
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            value, last_id = cursor
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__lt': value}) | Q(**{self.field: value, 'id__lt': last_id})
+            )
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def get_page_size(self, request):
+        default = getattr(settings, 'REST_FRAMEWORK', {}).get('PAGE_SIZE') or 20
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, default))
+        except ValueError:
+            size = default
+        return max(1, min(size, self.max_page_size))
+
+    def check_page_param(self, request):
+        page = request.query_params.get(self.page_query_param)
+        if page not in (None, '', '1'):
+            raise ValidationError({
+                self.page_query_param: "Page numbers are no longer supported; follow the 'next' link instead."
+            })
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, last_id = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            if isinstance(value, str):
+                value = parse_datetime(value)
+                if value is None:
+                    raise ValueError
+            return value, int(last_id)
+        except (TypeError, ValueError):
+            raise NotFound('Invalid cursor')
+
+    def encode_cursor(self, row):
+        value = getattr(row, self.field)
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        payload = json.dumps([value, row.id]).encode()
+        return base64.urlsafe_b64encode(payload).decode()
+
+    def get_next_link(self):
+        if not self.has_next or self.last is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
@@ -0,0 +1,166 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from clients.models import ClientProfile
+from therapists.models import TherapistProfile
+from companies.models import Company
+from rest_framework.authtoken.models import Token
+
+from therapy_management.location_rollup import LocationRollupManager
+from .models import User, Role, Permission, RolePermission, UserRole
+from .utils import PermissionResolver
+from .authentication import PrincipalCache
+
+
+# sender -> (fields the rollups depend on, scopes an instance contributes to)
+ROLLUP_TRACKING = {
+    User: (
+        ['pincode', 'latitude', 'longitude', 'is_active'],
+        lambda pk: {'user': {'pk': pk}, 'client': {'user_id': pk}, 'therapist': {'user_id': pk}},
+    ),
+    ClientProfile: (['user_id', 'is_active'], lambda pk: {'client': {'pk': pk}}),
+    TherapistProfile: (['user_id', 'approval_status'], lambda pk: {'therapist': {'pk': pk}}),
+    Company: (
+        ['pincode', 'latitude', 'longitude', 'is_active'],
+        lambda pk: {'company': {'pk': pk}},
+    ),
+}
+
+DELETE_SCOPES = {
+    # Profiles removed by a cascading user delete send their own signals
+    User: 'user',
+    ClientProfile: 'client',
+    TherapistProfile: 'therapist',
+    Company: 'company',
+}
+
+
+# Geographic rollups
+
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=ClientProfile)
+@receiver(pre_save, sender=TherapistProfile)
+@receiver(pre_save, sender=Company)
+def remember_rollup_counts(sender, instance, update_fields=None, **kwargs):
+    fields, scopes = ROLLUP_TRACKING[sender]
+    if update_fields is not None:
+        # Foreign keys may be named either way in update_fields
+        tracked = set(fields) | {field[:-len('_id')] for field in fields if field.endswith('_id')}
+        if tracked.isdisjoint(update_fields):
+            # Activity and login stamps; skip the lookup below
+            instance._rollup_previous = None
+            return
+    if instance.pk is None:
+        instance._rollup_previous = {}
+        return
+    stored = sender.objects.filter(pk=instance.pk).values(*fields).first()
+    if stored is None:
+        instance._rollup_previous = {}
+    elif all(stored[field] == getattr(instance, field) for field in fields):
+        # Nothing the rollups count is changing
+        instance._rollup_previous = None
+    else:
+        instance._rollup_previous = LocationRollupManager.snapshot(scopes(instance.pk))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=ClientProfile)
+@receiver(post_save, sender=TherapistProfile)
+@receiver(post_save, sender=Company)
+def update_rollup_counts(sender, instance, **kwargs):
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous is None:
+        return
+    _, scopes = ROLLUP_TRACKING[sender]
+    LocationRollupManager.apply_change(previous, LocationRollupManager.snapshot(scopes(instance.pk)))
+    instance._rollup_previous = None
+
+
+@receiver(pre_delete, sender=User)
+@receiver(pre_delete, sender=ClientProfile)
+@receiver(pre_delete, sender=TherapistProfile)
+@receiver(pre_delete, sender=Company)
+def remember_deleted_rollup_counts(sender, instance, **kwargs):
+    instance._rollup_previous = LocationRollupManager.snapshot({DELETE_SCOPES[sender]: {'pk': instance.pk}})
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=ClientProfile)
+@receiver(post_delete, sender=TherapistProfile)
+@receiver(post_delete, sender=Company)
+def remove_rollup_counts(sender, instance, **kwargs):
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous:
+        LocationRollupManager.apply_change(previous, {})
+
+
+# Resolved permission cache
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+@receiver(post_save, sender=RolePermission)
+@receiver(post_delete, sender=RolePermission)
+def invalidate_all_permissions(sender, instance, **kwargs):
+    # After commit, so nobody re-caches the old grants under the new version
+    transaction.on_commit(PermissionResolver.invalidate_all)
+
+
+@receiver(post_save, sender=UserRole)
+@receiver(post_delete, sender=UserRole)
+def invalidate_user_permissions(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: PermissionResolver.invalidate_user(user_id))
+
+
+@receiver(m2m_changed, sender=User.roles.through)
+def invalidate_permissions_for_role_changes(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # instance is a Role; pk_set holds the affected users (None on clear)
+        user_ids = list(pk_set) if pk_set else None
+    else:
+        user_ids = [instance.pk]
+        PermissionResolver.forget(instance)
+
+    def invalidate():
+        if user_ids is None:
+            PermissionResolver.invalidate_all()
+        else:
+            for user_id in user_ids:
+                PermissionResolver.invalidate_user(user_id)
+    transaction.on_commit(invalidate)
+
+
+# Cached token principals
+
+# Saves that only stamp activity leave the cached principal usable
+ACTIVITY_FIELDS = {'last_login', 'last_activity'}
+
+
+@receiver(post_delete, sender=Token)
+def revoke_deleted_token(sender, instance, **kwargs):
+    token_key = instance.key
+    transaction.on_commit(lambda: PrincipalCache.revoke(token_key))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def revoke_user_principals(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields and set(update_fields) <= ACTIVITY_FIELDS:
+        return
+    user_id = instance.pk
+    transaction.on_commit(lambda: PrincipalCache.revoke_user(user_id))
+
+
+@receiver(post_save, sender=ClientProfile)
+@receiver(post_delete, sender=ClientProfile)
+@receiver(post_save, sender=TherapistProfile)
+@receiver(post_delete, sender=TherapistProfile)
+def revoke_profile_principals(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: PrincipalCache.revoke_user(user_id))
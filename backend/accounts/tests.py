@@ -0,0 +1,449 @@
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock, skipIf, skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.db.models import FloatField, Value
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+import numpy as np
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from therapy_management import geohash
+from therapy_management.activity_tracking import ActivityTracker, SESSION_BUFFER, USER_BUFFER
+from therapy_management.spatial_index import SpatialIndex, haversine_km
+from .authentication import CachedTokenAuthentication, PrincipalCache, local_principals
+from .models import User, Role, Permission, RolePermission, UserRole, UserSession
+from .search import UserKeysetPagination
+from .utils import PermissionResolver, RoleManager
+
+
+def redis_available():
+    if 'django_redis' not in settings.CACHES['default']['BACKEND']:
+        return False
+    try:
+        return get_redis_connection('default').ping()
+    except Exception:
+        return False
+
+
+class PrincipalCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        local_principals.clear()
+        self.addCleanup(local_principals.clear)
+        self.user = User.objects.create_user(username='asha', password='old-pass', user_type='client')
+        self.token = Token.objects.create(user=self.user)
+        self.token_key = self.token.key
+
+    def authenticate(self):
+        return CachedTokenAuthentication().authenticate_credentials(self.token_key)
+
+    def test_principal_is_served_from_cache(self):
+        self.authenticate()
+        local_principals.clear()
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+        self.assertEqual((user.pk, token.key), (self.user.pk, self.token_key))
+
+    def test_logout_revokes_the_token(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+    def test_deactivation_revokes_the_principal(self):
+        self.authenticate()
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+    def test_password_change_reloads_the_principal(self):
+        self.authenticate()
+        self.user.set_password('new-pass')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        user, _ = self.authenticate()
+        self.assertTrue(user.check_password('new-pass'))
+
+    def test_revoke_during_a_load_is_not_undone(self):
+        stale = PrincipalCache._load(self.token_key)
+
+        def load_then_revoke(token_key):
+            # The user is deactivated after this request read the database
+            User.objects.filter(pk=self.user.pk).update(is_active=False)
+            PrincipalCache.revoke(token_key)
+            return stale
+
+        with mock.patch.object(PrincipalCache, '_load', side_effect=load_then_revoke):
+            self.assertTrue(PrincipalCache.get(self.token_key).user.is_active)
+
+        # Another process: nothing local, and the stale Redis entry is ignored
+        local_principals.clear()
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+
+class PermissionResolverTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='ravi', password='pass', user_type='admin')
+        self.role = Role.objects.create(name='Reviewer')
+        self.permission = Permission.objects.create(
+            name='View reports', codename='view_reports', category='reporting'
+        )
+        RolePermission.objects.create(role=self.role, permission=self.permission)
+
+    def fresh_user(self):
+        """The user as the next request sees it"""
+        return User.objects.get(pk=self.user.pk)
+
+    def test_role_manager_updates_the_same_instance(self):
+        self.assertFalse(self.user.has_permission('view_reports'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RoleManager.assign_role_to_user(self.user, 'Reviewer')
+        self.assertTrue(self.user.has_role('Reviewer'))
+        self.assertTrue(self.fresh_user().has_permission('view_reports'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RoleManager.remove_role_from_user(self.user, 'Reviewer')
+        self.assertFalse(self.user.has_role('Reviewer'))
+        self.assertFalse(self.fresh_user().has_permission('view_reports'))
+
+    def test_user_role_rows_and_m2m_changes_invalidate(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            user_role = UserRole.objects.create(user=self.user, role=self.role)
+        self.assertTrue(self.fresh_user().has_role('Reviewer'))
+
+        user_role.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user_role.save()
+        self.assertFalse(self.fresh_user().has_role('Reviewer'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user_role.delete()
+            self.user.roles.add(self.role)
+        self.assertTrue(self.user.has_permission('view_reports'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.role.user_set.remove(self.user)
+        self.assertFalse(self.fresh_user().has_permission('view_reports'))
+
+    def test_role_and_permission_deactivation_invalidate_every_user(self):
+        UserRole.objects.create(user=self.user, role=self.role)
+        self.assertTrue(self.fresh_user().has_permission('view_reports'))
+
+        self.permission.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.permission.save()
+        user = self.fresh_user()
+        self.assertTrue(user.has_role('Reviewer'))
+        self.assertFalse(user.has_permission('view_reports'))
+
+        self.role.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.role.save()
+        self.assertFalse(self.fresh_user().has_role('Reviewer'))
+
+    def test_cached_entry_expires_with_the_first_role(self):
+        expires_at = timezone.now() + timedelta(seconds=90)
+        UserRole.objects.create(user=self.user, role=self.role, expires_at=expires_at)
+        resolved, timeout = PermissionResolver._load(self.user.pk)
+        self.assertEqual(resolved['roles'], ['Reviewer'])
+        self.assertLessEqual(timeout, 91)
+
+        # Once lapsed, the assignment no longer counts
+        UserRole.objects.filter(user=self.user).update(expires_at=timezone.now() - timedelta(seconds=1))
+        cache.clear()
+        self.assertFalse(self.fresh_user().has_role('Reviewer'))
+
+    def test_self_assignment_refreshes_request_user(self):
+        role_admin = Role.objects.create(name='Role admin')
+        RolePermission.objects.create(role=role_admin, permission=Permission.objects.create(
+            name='Manage roles', codename='manage_roles', category='system_admin'
+        ))
+        UserRole.objects.create(user=self.user, role=role_admin)
+
+        api_client = APIClient()
+        api_client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = api_client.post('/api/auth/roles/assign/', {
+                'user_id': self.user.pk, 'role_name': 'Reviewer'
+            }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        # The view checked manage_roles on this very instance before the assignment
+        self.assertTrue(self.user.has_permission('view_reports'))
+
+
+class UserListPaginationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(
+            username='admin', password='pass', user_type='admin', is_superuser=True
+        )
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(self.admin)
+
+    def walk(self, url):
+        """Follow next links from ``url`` and return every id in order"""
+        ids = []
+        while url:
+            response = self.api_client.get(url)
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertNotIn('count', response.data)
+            ids.extend(user['id'] for user in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_cursor_walks_every_user_once(self):
+        users = [self.admin] + [
+            User.objects.create_user(username=f'user{i}', password='pass', user_type='client')
+            for i in range(5)
+        ]
+        # Three users share a timestamp, so the id breaks the tie across pages
+        now = timezone.now()
+        User.objects.filter(pk__in=[user.pk for user in users[:3]]).update(created_at=now - timedelta(days=1))
+        User.objects.filter(pk__in=[user.pk for user in users[3:]]).update(created_at=now)
+
+        expected = list(User.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk('/api/auth/users/?page_size=2'), expected)
+
+    @skipIf(connection.vendor == 'postgresql', 'Ranks with the icontains fallback')
+    def test_search_ranks_prefix_matches_and_pages_by_rank(self):
+        by_email = User.objects.create_user(
+            username='zed', password='pass', user_type='client', email='asha@example.com'
+        )
+        by_name = User.objects.create_user(
+            username='rao', password='pass', user_type='client', first_name='Asha'
+        )
+        by_username = User.objects.create_user(username='asha', password='pass', user_type='client')
+        inside = User.objects.create_user(username='kasha', password='pass', user_type='client')
+
+        self.assertEqual(
+            self.walk('/api/auth/users/?search=Asha&page_size=1'),
+            [by_username.pk, by_name.pk, by_email.pk, inside.pk]
+        )
+
+    def test_tied_fractional_ranks_page_without_gaps(self):
+        for i in range(4):
+            User.objects.create_user(username=f'user{i}', password='pass', user_type='client')
+        queryset = User.objects.annotate(
+            search_rank=Value(0.1, output_field=FloatField())
+        ).order_by('-search_rank', '-id')
+
+        ids = []
+        url = '/api/auth/users/?page_size=1'
+        while url:
+            paginator = UserKeysetPagination()
+            request = Request(APIRequestFactory().get(url))
+            ids.extend(user.pk for user in paginator.paginate_queryset(
+                queryset, request, SimpleNamespace(keyset_field='search_rank')
+            ))
+            url = paginator.get_next_link()
+        self.assertEqual(ids, list(queryset.values_list('id', flat=True)))
+
+    @skipUnless(connection.vendor == 'postgresql', 'Ranks with ts_rank and similarity')
+    def test_tied_postgres_ranks_page_without_gaps(self):
+        # Same-length usernames give every match the same fractional rank
+        users = [
+            User.objects.create_user(
+                username=f'u{i}', password='pass', user_type='client', first_name='Asha', last_name='Rao'
+            )
+            for i in range(4)
+        ]
+        self.assertEqual(
+            self.walk('/api/auth/users/?search=rao&page_size=1'),
+            sorted((user.pk for user in users), reverse=True)
+        )
+
+    def test_page_numbers_are_rejected_past_the_first_page(self):
+        self.assertEqual(self.api_client.get('/api/auth/users/?page=1').status_code, 200)
+        response = self.api_client.get('/api/auth/users/?page=2')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('page', response.data)
+        self.assertEqual(self.api_client.get('/api/auth/users/?cursor=not-a-cursor').status_code, 404)
+
+
+class GeohashTest(SimpleTestCase):
+
+    def test_known_vectors(self):
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geohash.encode(42.6, -5.6, 5), 'ezs42')
+        self.assertEqual(geohash.encode(-25.382708, -49.265506, 8), '6gkzwgjz')
+        # Coarser cells are prefixes of the stored precision
+        self.assertEqual(geohash.encode(57.64911, 10.40744), 'u4pruydqq')
+
+    def test_cell_size_and_covering_precision(self):
+        self.assertEqual(geohash.cell_size(1), (45.0, 45.0))
+        self.assertEqual(geohash.cell_size(2), (5.625, 11.25))
+        self.assertEqual(geohash.covering_precision(0.01, 0.01), 6)
+        self.assertEqual(geohash.covering_precision(100, 100), 0)
+
+    def test_covering_cells_include_both_sides_of_a_boundary(self):
+        cells = geohash.covering_cells(51.49, -0.01, 51.51, 0.01, 5)
+        self.assertIn(geohash.encode(51.5, -0.005, 5), cells)
+        self.assertIn(geohash.encode(51.5, 0.005, 5), cells)
+
+
+class SpatialIndexTest(TestCase):
+
+    def locate(self, username, latitude, longitude):
+        return User.objects.create_user(
+            username=username, password='pass', user_type='client',
+            latitude=Decimal(str(latitude)), longitude=Decimal(str(longitude))
+        )
+
+    def search(self, latitude, longitude, radius_km, **kwargs):
+        return SpatialIndex.search(User.objects.all(), latitude, longitude, radius_km, prefix='', **kwargs)
+
+    def test_haversine_distances(self):
+        distances = haversine_km(
+            51.5074, -0.1278, np.array([51.5074, 48.8566]), np.array([-0.1278, 2.3522])
+        )
+        self.assertAlmostEqual(distances[0], 0.0)
+        self.assertAlmostEqual(distances[1], 343.5, delta=1)
+
+    def test_neighbours_across_a_cell_boundary_are_found(self):
+        # The prime meridian splits London between the 'g' and 'u' top-level cells
+        west = self.locate('west', 51.5, -0.005)
+        east = self.locate('east', 51.5, 0.005)
+        self.locate('far', 51.52, 0.0)
+        self.assertNotEqual(west.geohash[0], east.geohash[0])
+
+        total, matches = self.search(51.5, 0.0005, 1)
+        self.assertEqual(total, 2)
+        self.assertEqual([pk for pk, _ in matches], [east.pk, west.pk])
+
+    def test_radius_filter_orders_and_pages_by_distance(self):
+        london = self.locate('london', 51.5074, -0.1278)
+        paris = self.locate('paris', 48.8566, 2.3522)
+        self.locate('berlin', 52.52, 13.405)
+
+        total, matches = self.search(51.5074, -0.1278, 350)
+        self.assertEqual(total, 2)
+        self.assertEqual([pk for pk, _ in matches], [london.pk, paris.pk])
+        self.assertAlmostEqual(matches[1][1], 343.5, delta=1)
+        # Inside the bounding box but outside the circle
+        self.assertEqual(self.search(51.5074, -0.1278, 300)[0], 1)
+        self.assertEqual(self.search(51.5074, -0.1278, 350, limit=1, offset=1), (2, [(paris.pk, matches[1][1])]))
+
+    def test_search_across_the_antimeridian(self):
+        west = self.locate('west', -17.0, 179.99)
+        east = self.locate('east', -17.0, -179.99)
+        total, matches = self.search(-17.0, 179.999, 10)
+        self.assertEqual(total, 2)
+        self.assertEqual({pk for pk, _ in matches}, {west.pk, east.pk})
+
+
+@override_settings(ACTIVITY_TRACKING_RESOLUTION=60)
+class ActivityTrackingTest(TestCase):
+
+    def setUp(self):
+        ActivityTracker._recent.clear()
+        self.addCleanup(ActivityTracker._recent.clear)
+        self.user = User.objects.create_user(username='asha', password='pass', user_type='client')
+
+    def request(self, token_key):
+        request = RequestFactory().get('/')
+        request.auth = SimpleNamespace(key=token_key)
+        return request
+
+    def test_repeat_requests_coalesce_within_the_resolution(self):
+        with mock.patch('therapy_management.activity_tracking.get_redis_connection') as redis, \
+                mock.patch('therapy_management.activity_tracking.time.time', return_value=1000.0) as clock:
+            for _ in range(3):
+                ActivityTracker.record(self.request('token-1'), self.user)
+            # Another session of the same user is tracked on its own
+            ActivityTracker.record(self.request('token-2'), self.user)
+            self.assertEqual(redis.return_value.pipeline.return_value.execute.call_count, 2)
+
+            clock.return_value = 1060.0
+            ActivityTracker.record(self.request('token-1'), self.user)
+            self.assertEqual(redis.return_value.pipeline.return_value.execute.call_count, 3)
+
+    def test_middleware_never_fails_a_request_when_redis_is_down(self):
+        api_client = APIClient()
+        api_client.force_authenticate(self.user)
+        with mock.patch(
+            'therapy_management.activity_tracking.get_redis_connection',
+            side_effect=ConnectionError('Redis unavailable')
+        ), self.assertLogs('therapy_management.activity_tracking', 'WARNING'):
+            response = api_client.get('/api/auth/users/')
+        self.assertEqual(response.status_code, 200)
+
+
+@skipUnless(redis_available(), 'Activity buffers need the Redis cache')
+class ActivityFlushTest(TestCase):
+
+    def setUp(self):
+        self.redis = get_redis_connection('default')
+        self.keys = [
+            cache.make_key(name)
+            for name in (USER_BUFFER, f'{USER_BUFFER}_flushing', SESSION_BUFFER, f'{SESSION_BUFFER}_flushing')
+        ]
+        self.redis.delete(*self.keys)
+        self.addCleanup(self.redis.delete, *self.keys)
+        self.user = User.objects.create_user(username='asha', password='pass', user_type='client')
+
+    def buffer_user(self, user_id, at):
+        self.redis.hset(cache.make_key(USER_BUFFER), user_id, at)
+
+    def buffer_session(self, session_key, user_id, at):
+        self.redis.hset(cache.make_key(SESSION_BUFFER), session_key, json.dumps({
+            'user_id': user_id, 'at': at, 'ip_address': '127.0.0.1', 'user_agent': 'tests'
+        }))
+
+    def last_activity(self):
+        return User.objects.get(pk=self.user.pk).last_activity
+
+    def test_flush_writes_users_and_sessions_of_existing_users(self):
+        gone = User.objects.create_user(username='gone', password='pass', user_type='client')
+        known = UserSession.objects.create(
+            user=self.user, session_key='known', ip_address='127.0.0.1', user_agent='tests'
+        )
+        self.buffer_user(self.user.pk, 1000.0)
+        self.buffer_user(gone.pk, 1000.0)
+        self.buffer_session('known', self.user.pk, 1000.0)
+        self.buffer_session('new', self.user.pk, 1000.0)
+        self.buffer_session('orphan', gone.pk, 1000.0)
+        gone.delete()
+
+        self.assertEqual(ActivityTracker.flush(), {'users': 2, 'sessions': 2})
+
+        at = datetime.fromtimestamp(1000.0, tz=dt_timezone.utc)
+        self.assertEqual(self.last_activity(), at)
+        known.refresh_from_db()
+        self.assertEqual(known.last_activity, at)
+        self.assertEqual(
+            set(UserSession.objects.values_list('session_key', flat=True)), {'known', 'new'}
+        )
+        self.assertEqual(self.redis.exists(*self.keys), 0)
+
+    def test_a_buffer_left_by_a_failed_flush_is_drained_again(self):
+        self.buffer_user(self.user.pk, 1000.0)
+        with mock.patch.object(User.objects, 'bulk_update', side_effect=DatabaseError('Connection lost')):
+            with self.assertRaises(DatabaseError):
+                ActivityTracker.flush()
+        self.assertEqual(self.redis.exists(cache.make_key(f'{USER_BUFFER}_flushing')), 1)
+
+        # Newer activity waits in the live buffer until the leftover is written
+        self.buffer_user(self.user.pk, 2000.0)
+        ActivityTracker.flush()
+        self.assertEqual(self.last_activity(), datetime.fromtimestamp(1000.0, tz=dt_timezone.utc))
+        ActivityTracker.flush()
+        self.assertEqual(self.last_activity(), datetime.fromtimestamp(2000.0, tz=dt_timezone.utc))
@@ -1,10 +1,109 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
+from django.db.models import Q
+from django.utils import timezone
+from therapy_management.cache_versions import VersionStamp
 from .models import Role, Permission, UserRole
 from functools import wraps
 
 User = get_user_model()
 
+PERMISSION_CACHE_PREFIX = 'resolved_permissions'
+PERMISSION_VERSION_KEY = 'resolved_permissions_version'
+
+
+class PermissionResolver:
+    """
+    Effective roles and permission codenames per user.
+
+    A user's active, unexpired role assignments on active roles, and the
+    active permissions those roles grant, are resolved with two queries and
+    cached twice: on the user instance for the rest of the request, and in
+    the default (Redis) cache across requests. Cache keys carry a global
+    version stamp, bumped when a Role, Permission or RolePermission changes,
+    and a per-user stamp, bumped when one of the user's UserRole rows
+    changes, so stale entries are never read again. Entries also expire no
+    later than the user's earliest role expiry.
+    """
+
+    @staticmethod
+    def timeout():
+        return getattr(settings, 'PERMISSION_CACHE_TIMEOUT', 15 * 60)
+
+    @staticmethod
+    def user_version_key(user_id):
+        return f"{PERMISSION_VERSION_KEY}:{user_id}"
+
+    @staticmethod
+    def invalidate_all():
+        """Move every user to a new cache version"""
+        VersionStamp.bump(PERMISSION_VERSION_KEY)
+
+    @staticmethod
+    def invalidate_user(user_id):
+        VersionStamp.bump(PermissionResolver.user_version_key(user_id))
+
+    @staticmethod
+    def forget(user):
+        """Drop the copy memoized on a user instance"""
+        user.__dict__.pop('_resolved_permissions', None)
+
+    @staticmethod
+    def resolve(user):
+        """{'roles': frozenset of role names, 'permissions': frozenset of codenames} for ``user``"""
+        resolved = getattr(user, '_resolved_permissions', None)
+        if resolved is not None:
+            return resolved
+
+        user_version_key = PermissionResolver.user_version_key(user.pk)
+        versions = cache.get_many([PERMISSION_VERSION_KEY, user_version_key])
+        key = (
+            f"{PERMISSION_CACHE_PREFIX}:{versions.get(PERMISSION_VERSION_KEY, 1)}:"
+            f"{user.pk}:{versions.get(user_version_key, 1)}"
+        )
+
+        cached = cache.get(key)
+        if cached is None:
+            cached, timeout = PermissionResolver._load(user.pk)
+            cache.set(key, cached, timeout)
+
+        resolved = {
+            'roles': frozenset(cached['roles']),
+            'permissions': frozenset(cached['permissions']),
+        }
+        user._resolved_permissions = resolved
+        return resolved
+
+    @staticmethod
+    def _load(user_id):
+        now = timezone.now()
+        assignments = list(UserRole.objects.filter(
+            user_id=user_id,
+            is_active=True,
+            role__is_active=True
+        ).filter(
+            Q(expires_at__isnull=True) | Q(expires_at__gt=now)
+        ).values_list('role_id', 'role__name', 'expires_at'))
+
+        role_ids = [role_id for role_id, _, _ in assignments]
+        permissions = list(Permission.objects.filter(
+            is_active=True,
+            permission_roles__role_id__in=role_ids
+        ).values_list('codename', flat=True).distinct()) if role_ids else []
+
+        timeout = PermissionResolver.timeout()
+        expiries = [expires_at for _, _, expires_at in assignments if expires_at is not None]
+        if expiries:
+            # Drop the entry as soon as the first role lapses
+            timeout = max(1, min(timeout, int((min(expiries) - now).total_seconds()) + 1))
+
+        return {
+            'roles': [name for _, name, _ in assignments],
+            'permissions': permissions,
+        }, timeout
+
 
 class RoleManager:
     """
@@ -49,6 +148,7 @@ class RoleManager:
                     'expires_at': expires_at
                 }
             )
+            PermissionResolver.forget(user)
             return user_role, created
         except Role.DoesNotExist:
             raise ValueError(f"Role '{role_name}' does not exist")
@@ -61,6 +161,7 @@ class RoleManager:
         try:
             role = Role.objects.get(name=role_name)
             UserRole.objects.filter(user=user, role=role).delete()
+            PermissionResolver.forget(user)
             return True
         except Role.DoesNotExist:
             return False
@@ -97,7 +198,7 @@ def require_permission(permission_codename):
             if not request.user.is_authenticated:
                 raise PermissionDenied("Authentication required")
             
-            if not request.user.has_permission(permission_codename) and not request.user.is_superuser:
+            if not request.user.is_superuser and not request.user.has_permission(permission_codename):
                 raise PermissionDenied(f"Permission '{permission_codename}' required")
             
             return view_func(request, *args, **kwargs)
@@ -115,7 +216,7 @@ def require_role(role_name):
             if not request.user.is_authenticated:
                 raise PermissionDenied("Authentication required")
             
-            if not request.user.has_role(role_name) and not request.user.is_superuser:
+            if not request.user.is_superuser and not request.user.has_role(role_name):
                 raise PermissionDenied(f"Role '{role_name}' required")
             
             return view_func(request, *args, **kwargs)
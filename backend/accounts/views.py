@@ -3,14 +3,14 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import login, logout
-from django.db.models import Q
 from .models import User, Role, Permission, UserRole
 from .serializers import (
     UserSerializer, UserCreateSerializer, UserUpdateSerializer,
     LoginSerializer, ChangePasswordSerializer, RoleSerializer,
     RoleCreateSerializer, RoleUpdateSerializer, PermissionSerializer
 )
-from .utils import require_permission, RoleManager, get_permission_checker
+from .utils import require_permission, PermissionResolver, RoleManager, get_permission_checker
+from .search import UserSearch, UserKeysetPagination
 
 
 class RegisterView(generics.CreateAPIView):
@@ -73,6 +73,11 @@ def logout_view(request):
 class UserListView(generics.ListAPIView):
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = UserKeysetPagination
+
+    @property
+    def keyset_field(self):
+        return 'search_rank' if self.request.query_params.get('search') else 'created_at'
 
     def get_queryset(self):
         user = self.request.user
@@ -92,20 +97,15 @@ class UserListView(generics.ListAPIView):
             queryset = User.objects.filter(id=user.id)
         
         # Apply filters
-        search = self.request.query_params.get('search')
-        if search:
-            queryset = queryset.filter(
-                Q(username__icontains=search) |
-                Q(first_name__icontains=search) |
-                Q(last_name__icontains=search) |
-                Q(email__icontains=search)
-            )
-        
         user_type = self.request.query_params.get('user_type')
         if user_type:
             queryset = queryset.filter(user_type=user_type)
         
-        return queryset.order_by('-created_at')
+        search = self.request.query_params.get('search')
+        if search:
+            return UserSearch.search(queryset, search)
+        
+        return queryset.order_by('-created_at', '-id')
 
 
 class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -231,6 +231,9 @@ def assign_role_to_user(request):
         user_role, created = RoleManager.assign_role_to_user(
             target_user, role_name, assigned_by=user
         )
+        if target_user.pk == user.pk:
+            # request.user is a separate instance with its own memoized permissions
+            PermissionResolver.forget(user)
         
         message = 'Role assigned successfully' if created else 'User already has this role'
         return Response({
@@ -280,6 +283,8 @@ def remove_role_from_user(request):
     try:
         target_user = User.objects.get(id=user_id)
         success = RoleManager.remove_role_from_user(target_user, role_name)
+        if target_user.pk == user.pk:
+            PermissionResolver.forget(user)
         
         if success:
             return Response({'message': 'Role removed successfully'})
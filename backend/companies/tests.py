@@ -1,3 +1,242 @@
-from django.test import TestCase
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import GeocodeCache, LocationRollup
+from clients.models import ClientProfile
+from therapy_management.geotagging import GeotaggingManager, load_pincode_centroids
+from therapy_management.location_rollup import LocationRollupManager
+from therapy_management.map_tiles import MapTileManager, tile_bounds, tile_for, tiles_for_bbox
+from .models import Company
+
+User = get_user_model()
+
+
+class StubGeocoder:
+    """Local stand-in for Nominatim that answers from a fixed table"""
+
+    def __init__(self, known):
+        self.known = known
+        self.queries = []
+
+    def geocode(self, query):
+        self.queries.append(query)
+        if query in self.known:
+            latitude, longitude = self.known[query]
+            return SimpleNamespace(latitude=latitude, longitude=longitude, address=query)
+        return None
+
+
+class BulkGeocodingTest(TestCase):
+
+    def setUp(self):
+        handle, self.centroids_path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w') as csv_file:
+            csv_file.write('pincode,latitude,longitude\n560002,12.9600,77.5800\n')
+        self.addCleanup(os.remove, self.centroids_path)
+
+        settings_override = override_settings(PINCODE_CENTROIDS_CSV=self.centroids_path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        load_pincode_centroids.cache_clear()
+        self.addCleanup(load_pincode_centroids.cache_clear)
+
+        for i in range(3):
+            User.objects.create_user(username=f'shared{i}', address='12 MG Road', pincode='560001')
+        User.objects.create_user(username='unknown', address='Nowhere Lane', pincode='560002')
+        self.company = Company.objects.create(
+            name='Acme',
+            registration_number='ACME-1',
+            contact_person_name='HR',
+            contact_person_designation='HR',
+            contact_email='hr@acme.example',
+            contact_phone='+910000000000',
+            address='12, MG  Road',
+            city='Bengaluru',
+            state='Karnataka',
+            pincode='560001',
+        )
+
+    def test_bulk_update_geocodes_each_address_once_and_caches(self):
+        geocoder = StubGeocoder({'12 MG Road, 560001': (12.9750, 77.6060)})
+        manager = GeotaggingManager(geolocator=geocoder, rate_limit=0, max_workers=2)
+
+        updated = manager.bulk_update_locations()
+
+        self.assertEqual(updated, 5)
+        # Users and the company share one normalized address; the other falls back to its centroid
+        self.assertEqual(len(geocoder.queries), 2)
+        shared = User.objects.get(username='shared0')
+        self.assertAlmostEqual(float(shared.latitude), 12.975)
+        self.assertTrue(shared.geohash)
+        unknown = User.objects.get(username='unknown')
+        self.assertAlmostEqual(float(unknown.latitude), 12.96)
+        self.company.refresh_from_db()
+        self.assertAlmostEqual(float(self.company.longitude), 77.606)
+        self.assertEqual(
+            set(GeocodeCache.objects.values_list('source', flat=True)),
+            {'geocoder', 'pincode_centroid'}
+        )
+
+        # Everything is answered from the cache on the next lookup
+        geocoder.queries.clear()
+        result = manager.geocode_address('12 mg road', '560001')
+        self.assertEqual(geocoder.queries, [])
+        self.assertAlmostEqual(result['latitude'], 12.975)
+
+    def test_offline_run_uses_pincode_centroids_only(self):
+        geocoder = StubGeocoder({})
+        manager = GeotaggingManager(geolocator=geocoder, rate_limit=0)
+
+        updated = manager.bulk_update_locations(offline=True)
+
+        self.assertEqual(updated, 1)
+        self.assertEqual(geocoder.queries, [])
+        self.assertFalse(GeocodeCache.objects.exists())
+
+
+class LocationRollupTest(TestCase):
+
+    def rollup(self, entity_type, pincode):
+        row = LocationRollup.objects.filter(entity_type=entity_type, pincode=pincode).first()
+        return (row.total, row.with_location, row.active) if row else (0, 0, 0)
+
+    def test_signals_keep_rollups_in_step_with_source_tables(self):
+        located = User.objects.create_user(username='located', pincode='560001', latitude=12.97, longitude=77.59)
+        User.objects.create_user(username='unlocated', pincode='560001')
+        moving = User.objects.create_user(username='moving', pincode='560001', is_active=False)
+        self.assertEqual(self.rollup('user', '560001'), (3, 1, 2))
+
+        moving.pincode = '110001'
+        moving.save()
+        located.latitude = None
+        located.save()
+        self.assertEqual(self.rollup('user', '560001'), (2, 0, 2))
+        self.assertEqual(self.rollup('user', '110001'), (1, 0, 0))
+
+        moving.delete()
+        self.assertEqual(self.rollup('user', '110001'), (0, 0, 0))
+
+        # Nothing drifted, so reconciliation only drops the emptied row
+        self.assertEqual(LocationRollupManager.reconcile(), {'created': 0, 'updated': 0, 'deleted': 1})
+
+    def test_saves_of_untracked_fields_skip_the_rollup_lookup(self):
+        user = User.objects.create_user(username='a', pincode='560001')
+        user.last_activity = timezone.now()
+        with CaptureQueriesContext(connection) as queries:
+            user.save(update_fields=['last_activity'])
+        self.assertEqual([query['sql'].split()[0] for query in queries], ['UPDATE'])
+
+        user.pincode = '400001'
+        user.save(update_fields=['pincode'])
+        self.assertEqual(self.rollup('user', '400001'), (1, 0, 1))
+
+    def test_reconcile_repairs_writes_that_bypass_signals(self):
+        User.objects.create_user(username='a', pincode='560001')
+        User.objects.filter(username='a').update(pincode='400001')
+
+        LocationRollupManager.reconcile()
+
+        self.assertEqual(self.rollup('user', '560001'), (0, 0, 0))
+        self.assertEqual(self.rollup('user', '400001'), (1, 0, 1))
+        statistics = GeotaggingManager().get_location_statistics()
+        self.assertEqual(statistics['users'], {'with_location': 0, 'total': 1, 'percentage': 0})
+
+
+class MapTileMathTest(SimpleTestCase):
+
+    def test_tile_for_clamps_to_the_map(self):
+        self.assertEqual(tile_for(0, 0, 0), (0, 0))
+        self.assertEqual(tile_for(0, 0, 1), (1, 1))
+        self.assertEqual(tile_for(89.9, -180, 2), (0, 0))
+        self.assertEqual(tile_for(-90, 180, 2), (3, 3))
+
+    def test_tile_bounds_contain_their_points(self):
+        min_lat, min_lon, max_lat, max_lon = tile_bounds(0, 0, 0)
+        self.assertAlmostEqual(max_lat, 85.05112878)
+        self.assertAlmostEqual(min_lat, -85.05112878)
+        self.assertEqual((min_lon, max_lon), (-180.0, 180.0))
+
+        x, y = tile_for(12.9716, 77.5946, 12)
+        min_lat, min_lon, max_lat, max_lon = tile_bounds(x, y, 12)
+        self.assertTrue(min_lat <= 12.9716 < max_lat and min_lon <= 77.5946 < max_lon)
+
+    def test_tiles_for_bbox(self):
+        self.assertEqual(tiles_for_bbox(-1, -1, 1, 1, 1), [(0, 0), (0, 1), (1, 0), (1, 1)])
+        self.assertEqual(len(tiles_for_bbox(12.97, 77.59, 12.98, 77.60, 10)), 1)
+
+
+@override_settings(MAP_MARKER_MIN_ZOOM=14)
+class MapTileTest(TestCase):
+
+    # A viewport around central Bengaluru, one tile at zoom 5 and a few at zoom 14
+    BOUNDS = {'min_lat': 12.96, 'min_lon': 77.58, 'max_lat': 12.98, 'max_lon': 77.60}
+
+    def setUp(self):
+        cache.clear()
+        admin = User.objects.create_user(username='admin', password='pass', user_type='admin', is_staff=True)
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(admin)
+        for i in range(3):
+            self.locate(f'client{i}', 12.970 + i * 0.001, 77.590)
+
+    def locate(self, username, latitude, longitude):
+        user = User.objects.create_user(
+            username=username, password='pass', user_type='client', first_name=username.title(),
+            latitude=latitude, longitude=longitude
+        )
+        return ClientProfile.objects.create(user=user)
+
+    def tiles(self, zoom, **bounds):
+        return self.api_client.get('/api/admin/map/tiles/', {'zoom': zoom, **(bounds or self.BOUNDS)})
+
+    def test_low_zoom_returns_clusters(self):
+        response = self.tiles(5)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['mode'], response.data['tile_count']), ('clusters', 1))
+        self.assertEqual(response.data['markers'], [])
+        self.assertEqual([(c['type'], c['count']) for c in response.data['clusters']], [('client', 3)])
+
+    def test_high_zoom_returns_markers(self):
+        response = self.tiles(14)
+        self.assertEqual(response.data['mode'], 'markers')
+        self.assertEqual(response.data['clusters'], [])
+        self.assertEqual(
+            sorted(marker['name'] for marker in response.data['markers']), ['Client0', 'Client1', 'Client2']
+        )
+
+    def test_dense_tiles_fall_back_to_fine_clusters(self):
+        with mock.patch('therapy_management.map_tiles.MAX_MARKERS_PER_TILE', 2):
+            response = self.tiles(14)
+        self.assertEqual(response.data['markers'], [])
+        self.assertEqual(sum(cluster['count'] for cluster in response.data['clusters']), 3)
+
+    def test_viewport_is_validated(self):
+        self.assertEqual(self.tiles(21).status_code, 400)
+        self.assertEqual(self.tiles(5, min_lat=13, min_lon=77, max_lat=12, max_lon=78).status_code, 400)
+        self.assertEqual(self.api_client.get('/api/admin/map/tiles/', {'zoom': 5}).status_code, 400)
+        # 64 tiles at most per request
+        self.assertEqual(self.tiles(10, min_lat=-60, min_lon=-180, max_lat=60, max_lon=180).status_code, 400)
+
+        client = APIClient()
+        client.force_authenticate(User.objects.get(username='client0'))
+        self.assertEqual(client.get('/api/admin/map/tiles/', {'zoom': 5, **self.BOUNDS}).status_code, 403)
+
+    def test_tiles_are_cached_until_invalidated(self):
+        self.tiles(5)
+        self.locate('client3', 12.975, 77.595)
+        with self.assertNumQueries(0):
+            tiles = MapTileManager.get_tiles(5, **self.BOUNDS)
+        self.assertEqual(tiles[0]['clusters'][0]['count'], 3)
+
+        MapTileManager.invalidate()
+        self.assertEqual(self.tiles(5).data['clusters'][0]['count'], 4)
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from coupons.models import CouponSystem, COUPON_CODE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Generate individual coupon codes for a coupon system in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('coupon_system_id', type=int, help='CouponSystem id')
+        parser.add_argument('count', type=int, help='Number of codes to generate')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=COUPON_CODE_BATCH_SIZE,
+            help='Codes drawn and inserted per batch'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            coupon_system = CouponSystem.objects.get(id=options['coupon_system_id'])
+        except CouponSystem.DoesNotExist:
+            raise CommandError(f"CouponSystem {options['coupon_system_id']} does not exist")
+
+        if options['count'] < 1 or options['batch_size'] < 1:
+            raise CommandError('count and --batch-size must be positive')
+
+        self.stdout.write(f"Generating {options['count']} codes for {coupon_system.name}...")
+
+        start = time.perf_counter()
+        codes = coupon_system.generate_coupon_codes(options['count'], batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+
+        rate = len(codes) / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(f'Generated {len(codes)} codes in {elapsed:.2f}s ({rate:,.0f} codes/sec)')
+        )
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 import uuid
@@ -7,6 +7,12 @@ import string
 
 User = get_user_model()
 
+# Codes per insert; keeps the code__in lookups under SQLite's parameter limit
+COUPON_CODE_BATCH_SIZE = 900
+# Rolled-back batches in a row before the IntegrityError is raised; a
+# collision is rare, so repeated failures point at something else
+COUPON_CODE_MAX_RETRIES = 5
+
 
 class CouponSystem(models.Model):
     """
@@ -92,23 +98,50 @@ class CouponSystem(models.Model):
             (self.max_total_usage is None or self.current_usage < self.max_total_usage)
         )
 
-    def generate_coupon_codes(self, count=1):
-        """Generate individual coupon codes for this system"""
+    def generate_coupon_codes(self, count=1, batch_size=COUPON_CODE_BATCH_SIZE):
+        """
+        Generate individual coupon codes for this system.
+
+        Candidate codes are drawn in memory a batch at a time, checked
+        against existing codes with one query per batch and inserted with
+        one bulk_create. Codes that already exist are drawn again in the
+        next batch. A batch is inserted whole or not at all: if a concurrent
+        generator took one of its codes after the check, the batch is rolled
+        back and drawn again, so only rows inserted by this call are returned.
+        After COUPON_CODE_MAX_RETRIES failed batches in a row the
+        IntegrityError is raised.
+        """
         codes = []
-        for _ in range(count):
-            code = IndividualCoupon.objects.create(
-                coupon_system=self,
-                code=self._generate_unique_code()
-            )
-            codes.append(code)
+        retries = 0
+        while len(codes) < count:
+            candidates = set()
+            while len(candidates) < min(batch_size, count - len(codes)):
+                candidates.add(self._random_code())
+
+            taken = set(IndividualCoupon.objects.filter(
+                code__in=candidates
+            ).values_list('code', flat=True))
+            candidates -= taken
+
+            coupons = [IndividualCoupon(coupon_system=self, code=code) for code in candidates]
+            try:
+                with transaction.atomic():
+                    IndividualCoupon.objects.bulk_create(coupons)
+            except IntegrityError:
+                retries += 1
+                if retries > COUPON_CODE_MAX_RETRIES:
+                    raise
+                continue
+            retries = 0
+            if coupons and coupons[0].pk is None:
+                # No RETURNING on this backend; the whole batch is ours, so read it back by code
+                coupons = list(IndividualCoupon.objects.filter(code__in=candidates))
+            codes.extend(coupons)
         return codes
 
-    def _generate_unique_code(self):
-        """Generate a unique coupon code"""
-        while True:
-            code = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(8))
-            if not IndividualCoupon.objects.filter(code=code).exists():
-                return code
+    @staticmethod
+    def _random_code():
+        return ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(8))
 
     class Meta:
         ordering = ['-created_at']
@@ -207,6 +240,7 @@ class CouponEmailLog(models.Model):
     """
     EMAIL_STATUS = [
         ('queued', 'Queued'),
+        ('sending', 'Sending'),
         ('sent', 'Sent'),
         ('delivered', 'Delivered'),
         ('opened', 'Opened'),
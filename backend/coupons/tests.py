@@ -0,0 +1,157 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from communications.models import EmailTemplate
+from therapy_management.coupon_campaigns import CouponCampaignManager
+from .models import COUPON_CODE_MAX_RETRIES, CouponSystem, IndividualCoupon, CouponEmailLog
+
+
+class FailingEmailBackend(EmailBackend):
+    """Mail backend whose server refuses every message"""
+
+    def send_messages(self, messages):
+        raise ConnectionError('SMTP server unavailable')
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    COUPON_CAMPAIGN_RATE_LIMIT=0
+)
+class CouponCampaignTest(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        self.coupon_system = CouponSystem.objects.create(
+            name='Wellbeing week',
+            coupon_type='promotional',
+            discount_type='percentage',
+            discount_value=20,
+            valid_from=now - timedelta(days=1),
+            valid_until=now + timedelta(days=30),
+        )
+        EmailTemplate.objects.create(
+            name='Coupon delivery',
+            template_type='coupon_delivery',
+            subject='Your code {coupon_code}',
+            html_content='<p>Hi {recipient_name}, use {coupon_code}</p>',
+        )
+        self.coupons = [
+            IndividualCoupon.objects.create(
+                coupon_system=self.coupon_system,
+                code=f'CODE{i:04d}',
+                recipient_email=f'user{i}@example.com',
+                recipient_name=f'User {i}',
+            )
+            for i in range(3)
+        ]
+        self.coupon_ids = [coupon.id for coupon in self.coupons]
+
+    def test_send_chunk_marks_coupons_sent(self):
+        self.assertEqual(CouponCampaignManager.send_chunk(self.coupon_ids), 3)
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            set(IndividualCoupon.objects.values_list('status', flat=True)),
+            {'sent'}
+        )
+        self.assertEqual(
+            set(CouponEmailLog.objects.values_list('status', flat=True)),
+            {'sent'}
+        )
+        # A chunk delivered twice finds nothing left to send
+        self.assertEqual(CouponCampaignManager.send_chunk(self.coupon_ids), 0)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_in_flight_coupons_are_skipped_until_the_claim_goes_stale(self):
+        log = CouponEmailLog.objects.create(
+            coupon=self.coupons[0],
+            recipient_email=self.coupons[0].recipient_email,
+            status='sending'
+        )
+
+        self.assertEqual(CouponCampaignManager.send_chunk(self.coupon_ids[:1]), 0)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(CouponCampaignManager.get_progress(self.coupon_system.id)['sending'], 1)
+
+        # The worker holding the claim died; after the timeout the coupon is taken over
+        CouponEmailLog.objects.filter(pk=log.pk).update(
+            updated_at=timezone.now() - timedelta(seconds=CouponCampaignManager.claim_timeout() + 1)
+        )
+        self.assertEqual(CouponCampaignManager.send_chunk(self.coupon_ids[:1]), 1)
+        log.refresh_from_db()
+        self.assertEqual(log.status, 'sent')
+        self.assertEqual(CouponEmailLog.objects.count(), 1)
+
+    @override_settings(EMAIL_BACKEND='coupons.tests.FailingEmailBackend')
+    def test_failed_sends_release_the_claim(self):
+        self.assertEqual(CouponCampaignManager.send_chunk(self.coupon_ids), 0)
+
+        self.assertFalse(IndividualCoupon.objects.filter(email_sent_at__isnull=False).exists())
+        self.assertEqual(
+            set(CouponEmailLog.objects.values_list('status', flat=True)),
+            {'failed'}
+        )
+        progress = CouponCampaignManager.get_progress(self.coupon_system.id)
+        self.assertEqual((progress['sending'], progress['failed'], progress['remaining']), (0, 3, 3))
+
+
+class CouponCodeGenerationTest(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        self.coupon_system = CouponSystem.objects.create(
+            name='Wellbeing week',
+            coupon_type='promotional',
+            discount_type='percentage',
+            discount_value=20,
+            valid_from=now - timedelta(days=1),
+            valid_until=now + timedelta(days=30),
+        )
+
+    def generate(self, draws, count):
+        with mock.patch.object(CouponSystem, '_random_code', side_effect=draws):
+            return self.coupon_system.generate_coupon_codes(count)
+
+    def test_existing_codes_are_drawn_again(self):
+        IndividualCoupon.objects.create(coupon_system=self.coupon_system, code='AAAA0001')
+
+        coupons = self.generate(['AAAA0001', 'BBBB0002', 'CCCC0003'], 2)
+
+        self.assertEqual(sorted(coupon.code for coupon in coupons), ['BBBB0002', 'CCCC0003'])
+        self.assertTrue(all(coupon.pk for coupon in coupons))
+        self.assertEqual(self.coupon_system.individual_coupons.count(), 3)
+
+    def test_codes_taken_by_a_concurrent_generator_are_not_returned(self):
+        bulk_create = IndividualCoupon.objects.bulk_create
+        calls = []
+
+        def bulk_create_after_a_concurrent_insert(objs, *args, **kwargs):
+            if not calls:
+                # Another generator for the same system inserts one of our codes after the check
+                IndividualCoupon.objects.create(coupon_system=self.coupon_system, code='AAAA0001')
+            calls.append(objs)
+            return bulk_create(objs, *args, **kwargs)
+
+        with mock.patch.object(
+            IndividualCoupon.objects, 'bulk_create', side_effect=bulk_create_after_a_concurrent_insert
+        ):
+            coupons = self.generate(['AAAA0001', 'BBBB0002', 'CCCC0003', 'DDDD0004'], 2)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sorted(coupon.code for coupon in coupons), ['CCCC0003', 'DDDD0004'])
+        # The rolled-back batch left nothing behind
+        self.assertFalse(IndividualCoupon.objects.filter(code='BBBB0002').exists())
+
+    def test_persistent_integrity_errors_are_raised(self):
+        with mock.patch.object(
+            IndividualCoupon.objects, 'bulk_create', side_effect=IntegrityError('FOREIGN KEY constraint failed')
+        ) as bulk_create:
+            with self.assertRaises(IntegrityError):
+                self.coupon_system.generate_coupon_codes(2)
+        self.assertEqual(bulk_create.call_count, COUPON_CODE_MAX_RETRIES + 1)
@@ -218,7 +218,7 @@ class SessionTemplateAdmin(admin.ModelAdmin):
         }),
         ('Validity', {
             'fields': (
-                'start_date', 'end_date', 'max_sessions', 'sessions_created'
+                'start_date', 'end_date', 'max_sessions', 'sessions_created', 'generated_until'
             )
         }),
         ('Status', {
@@ -226,7 +226,7 @@ class SessionTemplateAdmin(admin.ModelAdmin):
         })
     )
     
-    readonly_fields = ['sessions_created']
+    readonly_fields = ['sessions_created', 'generated_until']
     
     def therapist_name(self, obj):
         return obj.therapist.user.get_full_name()
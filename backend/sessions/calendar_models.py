@@ -140,9 +140,13 @@ class AvailabilitySlot(models.Model):
         ordering = ['date', 'start_time']
 
 
-class SessionReminder(models.Model):
+class AutomatedReminder(models.Model):
     """
-    Automated session reminders
+    Automated session reminders.
+
+    Doubles as the reminder delivery queue: one row per session, reminder
+    type and recipient, due at ``scheduled_for``. Workers claim due rows
+    with SELECT ... FOR UPDATE SKIP LOCKED (see therapy_management/reminder_queue.py).
     """
     REMINDER_TYPES = [
         ('booking_confirmation', 'Booking Confirmation'),
@@ -197,8 +201,11 @@ class SessionReminder(models.Model):
         return f"{self.reminder_type} for {self.session} to {self.recipient.get_full_name()}"
 
     class Meta:
-        unique_together = ['session', 'reminder_type', 'recipient_type']
+        unique_together = ['session', 'reminder_type', 'recipient_type', 'recipient']
         ordering = ['scheduled_for']
+        indexes = [
+            models.Index(fields=['is_sent', 'scheduled_for']),
+        ]
 
 
 class SessionJoinControl(models.Model):
@@ -0,0 +1,55 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from therapy_management.slot_index import FreeSlotIndex
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the free-slot index from scratch and diff it against the live cached index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--therapist',
+            type=int,
+            action='append',
+            dest='therapist_ids',
+            help='Only check this therapist id (can be repeated)'
+        )
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            help='Write the rebuilt entries for every missing or stale key'
+        )
+        parser.add_argument(
+            '--verbose-keys',
+            action='store_true',
+            help='List every missing and stale key'
+        )
+
+    def handle(self, *args, **options):
+        window_start, window_end = FreeSlotIndex.window()
+        self.stdout.write(f'Checking free-slot index for {window_start} to {window_end}...')
+
+        rebuilt, missing, stale = FreeSlotIndex.diff(options.get('therapist_ids'))
+
+        self.stdout.write(f'Entries rebuilt: {len(rebuilt)}')
+        self.stdout.write(f'Missing from cache: {len(missing)}')
+        if stale:
+            self.stdout.write(self.style.ERROR(f'Stale entries: {len(stale)}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Stale entries: 0'))
+
+        if options['verbose_keys']:
+            for key in missing:
+                self.stdout.write(f'  missing {key}')
+            for key in stale:
+                self.stdout.write(f'  stale   {key}')
+
+        if options['repair'] and (missing or stale):
+            cache.set_many(
+                {key: rebuilt[key] for key in missing + stale},
+                FreeSlotIndex.timeout()
+            )
+            self.stdout.write(
+                self.style.SUCCESS(f'Repaired {len(missing) + len(stale)} index entries')
+            )
@@ -108,8 +108,15 @@ class TherapySession(models.Model):
         return f"{self.client.user.get_full_name()} - {self.therapist.user.get_full_name()} ({self.scheduled_date})"
 
     def get_session_datetime(self):
-        from datetime import datetime, time
-        return datetime.combine(self.scheduled_date, self.scheduled_time)
+        """Aware start of the session in its own timezone"""
+        from datetime import datetime
+        from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+        from django.conf import settings
+        try:
+            tz = ZoneInfo(self.timezone or settings.TIME_ZONE)
+        except (ZoneInfoNotFoundError, ValueError):
+            tz = ZoneInfo(settings.TIME_ZONE)
+        return datetime.combine(self.scheduled_date, self.scheduled_time, tzinfo=tz)
 
     def can_be_cancelled(self):
         """Check if session can be cancelled (30 hours before)"""
@@ -136,6 +143,16 @@ class TherapySession(models.Model):
 
     class Meta:
         ordering = ['-scheduled_date', '-scheduled_time']
+        constraints = [
+            # Last line of defence against double booking; overlapping
+            # sessions with different start times are kept out by the
+            # locks in therapy_management/booking.py
+            models.UniqueConstraint(
+                fields=['therapist', 'scheduled_date', 'scheduled_time'],
+                condition=models.Q(status__in=['scheduled', 'confirmed', 'in_progress']),
+                name='unique_booked_therapist_slot'
+            ),
+        ]
 
 
 class SessionParticipant(models.Model):
@@ -211,6 +228,11 @@ class SessionTemplate(models.Model):
     end_date = models.DateField(null=True, blank=True)
     max_sessions = models.PositiveIntegerField(null=True, blank=True)
     sessions_created = models.PositiveIntegerField(default=0)
+    generated_until = models.DateField(
+        null=True,
+        blank=True,
+        help_text="Occurrences up to this date have been generated or reported as conflicts"
+    )
     
     # Status
     is_active = models.BooleanField(default=True)
@@ -386,4 +408,30 @@ class SessionReminder(models.Model):
         return f"{self.session} - {self.reminder_type} to {self.recipient.get_full_name()}"
 
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+
+
+class BookingIdempotencyKey(models.Model):
+    """
+    Outcome of a booking request sent with an Idempotency-Key header, so a
+    retried request gets the original response instead of acting twice
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='booking_idempotency_keys')
+    key = models.CharField(max_length=255)
+    endpoint = models.CharField(max_length=50)
+    request_hash = models.CharField(max_length=64)
+
+    # Response
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.endpoint} - {self.key} ({self.user})"
+
+    class Meta:
+        unique_together = ['user', 'key']
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
@@ -0,0 +1,213 @@
+from datetime import datetime, timedelta
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from therapists.models import TherapistAvailability
+from therapy_management.intervals import day_span
+from therapy_management.slot_index import FreeSlotIndex
+from therapy_management.reminder_queue import ReminderQueueManager
+from therapy_management.rating_aggregates import RatingAggregateManager
+from therapy_management.recurrence import RecurringAvailability, is_rule
+from therapy_management.therapist_dashboard import TherapistDashboard
+from .models import TherapySession, SessionFeedback
+from .calendar_models import TherapistCalendar, AvailabilitySlot, CalendarEvent
+
+
+def _date_range(start, end):
+    days = set()
+    current = start
+    while current <= end:
+        days.add(current)
+        current += timedelta(days=1)
+    return days
+
+
+def _session_days(scheduled_date, scheduled_time, duration_minutes):
+    """Every day a session touches, including the next one when it runs past midnight"""
+    start = datetime.combine(scheduled_date, scheduled_time)
+    return set(day_span(start, start + timedelta(minutes=duration_minutes))) or {scheduled_date}
+
+
+def _schedule_refresh(therapist_id, days=None):
+    """Refresh the free-slot index once the surrounding transaction commits"""
+    transaction.on_commit(lambda: FreeSlotIndex.refresh(therapist_id, days))
+
+
+def _remember_previous(sender, instance, fields):
+    """Store the persisted values of ``fields`` so post_save can tell what moved"""
+    if instance.pk is None:
+        instance._previous_values = None
+        return
+    instance._previous_values = sender.objects.filter(
+        pk=instance.pk
+    ).values(*fields).first()
+
+
+# Bookings
+
+@receiver(pre_save, sender=TherapySession)
+def remember_session_slot(sender, instance, **kwargs):
+    _remember_previous(
+        sender, instance, ['therapist_id', 'scheduled_date', 'scheduled_time', 'duration_minutes', 'timezone']
+    )
+
+
+@receiver(post_save, sender=TherapySession)
+@receiver(post_delete, sender=TherapySession)
+def refresh_index_for_session(sender, instance, **kwargs):
+    days = _session_days(instance.scheduled_date, instance.scheduled_time, instance.duration_minutes)
+    previous = getattr(instance, '_previous_values', None)
+    if previous:
+        previous_days = _session_days(
+            previous['scheduled_date'], previous['scheduled_time'], previous['duration_minutes']
+        )
+        if previous['therapist_id'] != instance.therapist_id:
+            _schedule_refresh(previous['therapist_id'], previous_days)
+        else:
+            days |= previous_days
+    _schedule_refresh(instance.therapist_id, days)
+
+
+@receiver(post_save, sender=TherapySession)
+@receiver(post_delete, sender=TherapySession)
+def invalidate_dashboard_for_session(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_values', None)
+    TherapistDashboard.invalidate([instance.therapist_id, previous['therapist_id'] if previous else None])
+
+
+@receiver(post_save, sender=TherapySession)
+def queue_session_reminders(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_values', None)
+
+    def queue():
+        # Reload so due times come from the stored values, not raw request data
+        session = TherapySession.objects.filter(
+            pk=instance.pk
+        ).select_related('client', 'therapist').first()
+        if session is None:
+            return
+        if created or previous is None:
+            ReminderQueueManager.enqueue_sessions([session])
+        elif (previous['scheduled_date'], previous['scheduled_time'], previous['timezone']) != (
+            session.scheduled_date, session.scheduled_time, session.timezone
+        ):
+            ReminderQueueManager.reschedule_session(session)
+
+    transaction.on_commit(queue)
+
+
+# One-off availability slots
+
+@receiver(pre_save, sender=AvailabilitySlot)
+def remember_availability_slot(sender, instance, **kwargs):
+    _remember_previous(sender, instance, ['therapist_id', 'date', 'is_recurring', 'recurrence_type'])
+
+
+@receiver(post_save, sender=AvailabilitySlot)
+@receiver(post_delete, sender=AvailabilitySlot)
+def refresh_index_for_availability_slot(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_values', None)
+    RecurringAvailability.invalidate([instance.therapist_id, previous['therapist_id'] if previous else None])
+
+    if is_rule(instance.__dict__) or (previous and is_rule(previous)):
+        # A recurring slot (or one that used to be) can touch every indexed day
+        _schedule_refresh(instance.therapist_id)
+        if previous and previous['therapist_id'] != instance.therapist_id:
+            _schedule_refresh(previous['therapist_id'])
+        return
+
+    _schedule_refresh(instance.therapist_id, {instance.date})
+    if previous and (previous['therapist_id'], previous['date']) != (
+        instance.therapist_id, instance.date
+    ):
+        _schedule_refresh(previous['therapist_id'], {previous['date']})
+
+
+# Weekly and date-specific availability rules
+
+@receiver(pre_save, sender=TherapistAvailability)
+def remember_therapist_availability(sender, instance, **kwargs):
+    _remember_previous(sender, instance, ['therapist_id', 'specific_date'])
+
+
+@receiver(post_save, sender=TherapistAvailability)
+@receiver(post_delete, sender=TherapistAvailability)
+def refresh_index_for_therapist_availability(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_values', None)
+    if instance.specific_date is None or (previous and previous['specific_date'] is None):
+        # A weekly rule (or a rule that used to be weekly) touches every indexed week
+        _schedule_refresh(instance.therapist_id)
+    else:
+        days = {instance.specific_date}
+        if previous and previous['specific_date']:
+            days.add(previous['specific_date'])
+        _schedule_refresh(instance.therapist_id, days)
+
+
+# Calendar events (holidays, breaks, trainings...)
+
+@receiver(pre_save, sender=CalendarEvent)
+def remember_calendar_event(sender, instance, **kwargs):
+    _remember_previous(sender, instance, ['therapist_id', 'start_date', 'end_date'])
+
+
+@receiver(post_save, sender=CalendarEvent)
+@receiver(post_delete, sender=CalendarEvent)
+def refresh_index_for_calendar_event(sender, instance, **kwargs):
+    days = _date_range(instance.start_date, instance.end_date)
+    previous = getattr(instance, '_previous_values', None)
+    # Events are exceptions to recurring slots
+    RecurringAvailability.invalidate([instance.therapist_id, previous['therapist_id'] if previous else None])
+    if previous:
+        previous_days = _date_range(previous['start_date'], previous['end_date'])
+        if previous['therapist_id'] != instance.therapist_id:
+            _schedule_refresh(previous['therapist_id'], previous_days)
+        else:
+            days |= previous_days
+    _schedule_refresh(instance.therapist_id, days)
+
+
+# Buffer time changes affect every indexed day
+
+@receiver(post_save, sender=TherapistCalendar)
+@receiver(post_delete, sender=TherapistCalendar)
+def refresh_index_for_calendar_settings(sender, instance, **kwargs):
+    _schedule_refresh(instance.therapist_id)
+
+
+# Client feedback ratings roll up to the session's therapist
+
+FEEDBACK_RATING_FIELDS = ['feedback_type', 'overall_rating', 'session_quality', 'technical_quality']
+
+
+def _feedback_contribution(therapist_id, values):
+    return RatingAggregateManager.feedback_contribution(
+        therapist_id, **{field: values[field] for field in FEEDBACK_RATING_FIELDS}
+    )
+
+
+@receiver(pre_save, sender=SessionFeedback)
+@receiver(pre_delete, sender=SessionFeedback)
+def remember_feedback_rating(sender, instance, **kwargs):
+    previous = None
+    if instance.pk is not None:
+        previous = sender.objects.filter(pk=instance.pk).values(
+            'session__therapist_id', *FEEDBACK_RATING_FIELDS
+        ).first()
+    instance._previous_contribution = (
+        _feedback_contribution(previous['session__therapist_id'], previous) if previous else {}
+    )
+
+
+@receiver(post_save, sender=SessionFeedback)
+def update_ratings_for_feedback(sender, instance, **kwargs):
+    RatingAggregateManager.apply_change(
+        getattr(instance, '_previous_contribution', {}),
+        _feedback_contribution(instance.session.therapist_id, instance.__dict__)
+    )
+
+
+@receiver(post_delete, sender=SessionFeedback)
+def remove_feedback_rating(sender, instance, **kwargs):
+    RatingAggregateManager.apply_change(getattr(instance, '_previous_contribution', {}), {})
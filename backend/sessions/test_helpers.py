@@ -0,0 +1,45 @@
+# Test Fixtures
+from datetime import time
+
+from django.contrib.auth import get_user_model
+
+from clients.models import ClientProfile
+from therapists.models import TherapistProfile, TherapistAvailability
+from .calendar_models import AvailabilitySlot
+
+User = get_user_model()
+
+
+def create_therapist(username='therapist', first_name='', last_name='', **fields):
+    """A therapist profile and its user; ``fields`` override the profile defaults"""
+    user = User.objects.create_user(
+        username=username, password='pass', user_type='therapist', first_name=first_name, last_name=last_name
+    )
+    fields = {
+        'license_number': f'LIC-{username}',
+        'bio': 'Bio',
+        'languages_spoken': 'English',
+        **fields,
+    }
+    return TherapistProfile.objects.create(user=user, **fields)
+
+
+def create_client(username='client', **user_fields):
+    """A client profile and its user; ``user_fields`` go to the user"""
+    user = User.objects.create_user(username=username, password='pass', user_type='client', **user_fields)
+    return ClientProfile.objects.create(user=user)
+
+
+def create_bookable_therapist(day):
+    """An approved therapist with one-off slots at 10, 11 and 12 and regular hours 9-17 on ``day``"""
+    therapist = create_therapist(approval_status='approved')
+    TherapistAvailability.objects.create(
+        therapist=therapist, day_of_week=day.weekday(), start_time=time(9, 0), end_time=time(17, 0)
+    )
+    slots = [
+        AvailabilitySlot.objects.create(
+            therapist=therapist, date=day, start_time=time(hour, 0), end_time=time(hour + 1, 0)
+        )
+        for hour in (10, 11, 12)
+    ]
+    return therapist, slots
@@ -1,3 +1,633 @@
-from django.test import TestCase
+import json
+import random
+from collections import defaultdict
+from io import BytesIO, StringIO
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import openpyxl
+from rest_framework.test import APIClient
+
+from clients.models import ClientProfile
+from communications.models import EmailTemplate
+from therapists.models import TherapistAvailability
+from therapy_management.availability import (
+    AvailabilityEngine, find_overlaps, merge_intervals, slot_starts, subtract_intervals
+)
+from therapy_management.management.commands.benchmark_monthly_report import Command as BenchmarkCommand
+from therapy_management.recurrence import RecurringAvailability
+from therapy_management.reporting import MonthlyReportGenerator, StreamingReportExporter
+from therapy_management.reminder_queue import ReminderQueueManager
+from therapy_management.session_templates import SessionTemplateScheduler
+from therapy_management.slot_index import FreeSlotIndex
+from .models import TherapySession, SessionExtension, SessionParticipant, SessionTemplate
+from .calendar_models import AvailabilitySlot, AutomatedReminder, CalendarEvent, TherapistCalendar
+from .test_helpers import create_bookable_therapist, create_client, create_therapist
+
+User = get_user_model()
+
+
+class TherapistSessionListQueryCountTest(TestCase):
+    """
+    The therapist session listing must issue a fixed number of queries
+    regardless of how many sessions are returned.
+    """
+
+    def setUp(self):
+        self.therapist = create_therapist(first_name='Asha', last_name='Rao')
+        self.therapist_user = self.therapist.user
+        self.client_profile = create_client(first_name='Ravi', last_name='Kumar')
+        self.member_profile = create_client('member')
+
+        self.api_client = APIClient()
+        self.api_client.force_login(self.therapist_user)
+
+    def _create_sessions(self, count):
+        start = date(2024, 1, 1)
+        sessions = TherapySession.objects.bulk_create([
+            TherapySession(
+                client=self.client_profile,
+                therapist=self.therapist,
+                session_type='group' if i % 2 else 'individual',
+                scheduled_date=start + timedelta(days=i // 4),
+                scheduled_time=time(9 + i % 4, 0),
+            )
+            for i in range(count)
+        ])
+        SessionExtension.objects.bulk_create([
+            SessionExtension(session=s, extended_by_minutes=10, requested_by=self.therapist_user)
+            for s in sessions
+        ])
+        # One reminder sent per session, one still queued
+        AutomatedReminder.objects.bulk_create([
+            AutomatedReminder(
+                session=s,
+                reminder_type=reminder_type,
+                recipient_type='client',
+                recipient=self.client_profile.user,
+                delivery_method='email',
+                subject='Reminder',
+                message='Reminder',
+                scheduled_for=timezone.now(),
+                sent_at=timezone.now() if is_sent else None,
+                is_sent=is_sent,
+            )
+            for s in sessions
+            for reminder_type, is_sent in (('24_hour_reminder', True), ('1_hour_reminder', False))
+        ])
+        SessionParticipant.objects.bulk_create([
+            SessionParticipant(session=s, client=self.member_profile)
+            for s in sessions if s.session_type == 'group'
+        ])
+
+    def _count_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.api_client.get('/api/sessions/therapist/', {'page_size': 500})
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.data
+
+    def test_query_count_is_constant(self):
+        self._create_sessions(10)
+        small_count, small_data = self._count_queries()
+        self.assertEqual(len(small_data['sessions']), 10)
+
+        TherapySession.objects.all().delete()
+        self._create_sessions(1000)
+        large_count, large_data = self._count_queries()
+        self.assertEqual(len(large_data['sessions']), 500)
+        self.assertTrue(large_data['has_more'])
+
+        self.assertEqual(small_count, large_count)
+
+    def test_annotations_and_keyset_pagination(self):
+        self._create_sessions(10)
+
+        response = self.api_client.get('/api/sessions/therapist/', {'page_size': 4})
+        first_page = response.data
+        self.assertEqual(first_page['total_count'], 10)
+        self.assertEqual(len(first_page['sessions']), 4)
+        self.assertEqual(first_page['sessions'][0]['extensions_used'], 1)
+        self.assertEqual(first_page['sessions'][0]['total_extended'], 10)
+        self.assertEqual(first_page['sessions'][0]['reminders_sent'], 1)
+        self.assertIsNotNone(first_page['sessions'][0]['last_reminder_sent'])
+
+        seen = [s['id'] for s in first_page['sessions']]
+        cursor = first_page['next_cursor']
+        while cursor:
+            page = self.api_client.get(
+                '/api/sessions/therapist/', {'page_size': 4, 'cursor': cursor}
+            ).data
+            seen.extend(s['id'] for s in page['sessions'])
+            cursor = page['next_cursor']
+
+        self.assertEqual(len(seen), 10)
+        self.assertEqual(len(set(seen)), 10)
+
+
+class IntervalArithmeticTest(SimpleTestCase):
+
+    def test_merge_joins_overlapping_and_touching_intervals(self):
+        self.assertEqual(
+            merge_intervals([(30, 60), (0, 30), (50, 90), (100, 100), (120, 150), (125, 130)]),
+            [(0, 90), (120, 150)]
+        )
+
+    def test_subtract_at_window_boundaries(self):
+        windows = [(0, 100), (200, 300)]
+        busy = [(0, 10), (50, 60), (90, 210), (300, 320)]
+        self.assertEqual(subtract_intervals(windows, busy), [(10, 50), (60, 90), (210, 300)])
+        # Busy time covering a whole window leaves nothing of it
+        self.assertEqual(subtract_intervals(windows, [(-10, 100)]), [(200, 300)])
+
+    def test_slot_starts_round_up_to_the_grid(self):
+        self.assertEqual(slot_starts([(10, 130)], 60, 30), [30, 60])
+        self.assertEqual(slot_starts([(0, 60), (90, 120)], 60, 30), [0])
+
+    def test_find_overlaps_sweeps_each_key_separately(self):
+        overlaps = find_overlaps([
+            ('a', 0, 100, 1),
+            ('a', 10, 20, 2),
+            ('a', 20, 30, 3),   # touches 2, overlaps 1
+            ('a', 100, 110, 4),  # touches 1
+            ('b', 0, 100, 5),
+        ])
+        self.assertEqual(sorted(overlaps), [(1, 2), (1, 3)])
+
+
+class AvailabilityEngineTest(TestCase):
+
+    def setUp(self):
+        self.day = date(2029, 1, 2)
+        self.therapist, _ = create_bookable_therapist(self.day)
+        TherapistCalendar.objects.create(therapist=self.therapist, buffer_time_between_sessions=15)
+        # Open from midnight on the day itself, instead of the weekly 9-17
+        TherapistAvailability.objects.create(
+            therapist=self.therapist, day_of_week=self.day.weekday(), specific_date=self.day,
+            start_time=time(0, 0), end_time=time(13, 0)
+        )
+        self.client_profile = create_client()
+
+    def book(self, day, start, minutes):
+        return TherapySession.objects.create(
+            client=self.client_profile, therapist=self.therapist,
+            scheduled_date=day, scheduled_time=start, duration_minutes=minutes
+        )
+
+    def test_bookings_buffers_overnight_sessions_and_events_are_busy(self):
+        # Runs 23:30-01:00 across midnight, so 00:00-01:15 is taken with the buffer
+        self.book(self.day - timedelta(days=1), time(23, 30), 90)
+        self.book(self.day, time(11, 0), 60)
+        CalendarEvent.objects.create(
+            therapist=self.therapist, title='Supervision', event_type='personal',
+            start_date=self.day, end_date=self.day, is_all_day=False,
+            start_time=time(12, 30), end_time=time(13, 30)
+        )
+
+        free = AvailabilityEngine.get_free_intervals([self.therapist.pk], self.day, self.day + timedelta(days=1))
+        self.assertEqual(free[self.therapist.pk][self.day], [(75, 645), (735, 750)])
+        # Only Tuesdays have weekly hours
+        self.assertEqual(free[self.therapist.pk][self.day + timedelta(days=1)], [])
+
+        slots = AvailabilityEngine.get_free_slots(
+            [self.therapist.pk], self.day, session_duration=60, step_minutes=30,
+            not_before=datetime.combine(self.day, time(9, 0))
+        )
+        self.assertEqual(slots[self.therapist.pk][self.day], [time(9, 0), time(9, 30)])
+
+    def test_holiday_override_clears_the_day(self):
+        TherapistAvailability.objects.create(
+            therapist=self.therapist, day_of_week=self.day.weekday(), specific_date=self.day,
+            start_time=time(9, 0), end_time=time(10, 0), is_holiday=True
+        )
+        free = AvailabilityEngine.get_free_intervals([self.therapist.pk], self.day)
+        self.assertEqual(free, {self.therapist.pk: {self.day: []}})
+
+
+class FreeSlotIndexTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.day = timezone.localdate() + timedelta(days=3)
+        self.next_day = self.day + timedelta(days=1)
+        self.therapist, _ = create_bookable_therapist(self.day)
+        TherapistAvailability.objects.create(
+            therapist=self.therapist, day_of_week=self.next_day.weekday(), specific_date=self.next_day,
+            start_time=time(0, 0), end_time=time(2, 0)
+        )
+        self.client_profile = create_client()
+        # Warm the index for both days
+        FreeSlotIndex.get_free_intervals([self.therapist.pk], self.day, self.next_day)
+
+    def cached(self, day):
+        return cache.get(FreeSlotIndex.key(self.therapist.pk, day))
+
+    def test_overnight_booking_refreshes_every_day_it_spans(self):
+        self.assertEqual(self.cached(self.next_day), [(0, 120)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            session = TherapySession.objects.create(
+                client=self.client_profile, therapist=self.therapist,
+                scheduled_date=self.day, scheduled_time=time(23, 30), duration_minutes=90
+            )
+        self.assertEqual(self.cached(self.next_day), [(60, 120)])
+
+        # Moving it back inside the day frees the next morning again
+        session.scheduled_time = time(16, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            session.save()
+        self.assertEqual(self.cached(self.day), [(540, 960)])
+        self.assertEqual(self.cached(self.next_day), [(0, 120)])
+        self.assertEqual(FreeSlotIndex.diff([self.therapist.pk])[2], [])
+
+    def test_deleting_calendar_settings_drops_the_buffer(self):
+        TherapySession.objects.create(
+            client=self.client_profile, therapist=self.therapist,
+            scheduled_date=self.day, scheduled_time=time(12, 0)
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            calendar = TherapistCalendar.objects.create(therapist=self.therapist, buffer_time_between_sessions=30)
+        self.assertEqual(self.cached(self.day), [(540, 690), (810, 1020)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            calendar.delete()
+        self.assertEqual(self.cached(self.day), [(540, 720), (780, 1020)])
+
+    def test_check_command_reports_and_repairs_stale_entries(self):
+        cache.set(FreeSlotIndex.key(self.therapist.pk, self.day), [(0, 1440)])
+
+        output = StringIO()
+        call_command('check_free_slot_index', therapist_ids=[self.therapist.pk], repair=True, stdout=output)
+        self.assertIn('Stale entries: 1', output.getvalue())
+        self.assertIn('Repaired', output.getvalue())
+
+        _, missing, stale = FreeSlotIndex.diff([self.therapist.pk])
+        self.assertEqual((missing, stale), ([], []))
+        self.assertEqual(self.cached(self.day), [(540, 1020)])
+
+
+class RecurringAvailabilityTest(TestCase):
+
+    def setUp(self):
+        self.therapist = create_therapist()
+        # Mondays 10:00-11:00 from 1 Jan 2029 until the end of June
+        self.rule = AvailabilitySlot.objects.create(
+            therapist=self.therapist,
+            date=date(2029, 1, 1),
+            start_time=time(10, 0),
+            end_time=time(11, 0),
+            is_recurring=True,
+            recurrence_type='weekly',
+            recurrence_end_date=date(2029, 6, 30)
+        )
+
+    def test_rule_expands_with_exceptions_and_overrides(self):
+        CalendarEvent.objects.create(
+            therapist=self.therapist, title='Holiday', event_type='holiday',
+            start_date=date(2029, 1, 15), end_date=date(2029, 1, 15)
+        )
+        AvailabilitySlot.objects.create(
+            therapist=self.therapist, date=date(2029, 1, 22),
+            start_time=time(10, 0), end_time=time(11, 0), status='blocked'
+        )
+
+        occurrences = RecurringAvailability.load([self.therapist.pk], date(2029, 1, 1), date(2029, 1, 31))[self.therapist.pk]
+        self.assertEqual(
+            [(slot['date'].day, slot['status'], slot['occurrence_of']) for slot in occurrences],
+            [(1, 'available', self.rule.pk), (8, 'available', self.rule.pk), (22, 'blocked', None), (29, 'available', self.rule.pk)]
+        )
+
+    def test_year_costs_the_same_rows_as_a_week(self):
+        with self.assertNumQueries(2):
+            week = RecurringAvailability.load([self.therapist.pk], date(2029, 3, 5), date(2029, 3, 11))[self.therapist.pk]
+        with self.assertNumQueries(2):
+            year = RecurringAvailability.load([self.therapist.pk], date(2029, 1, 1), date(2029, 12, 31))[self.therapist.pk]
+        self.assertEqual(len(week), 1)
+        # Every Monday up to the end date; nothing is stored per occurrence
+        self.assertEqual(len(year), 26)
+        self.assertEqual(AvailabilitySlot.objects.count(), 1)
+
+
+class SessionTemplateSchedulerTest(TestCase):
+
+    def setUp(self):
+        self.therapist = create_therapist()
+        self.client_profile = create_client()
+        # Mondays at 10:00 from 1 Jan 2029, five sessions at most
+        self.template = SessionTemplate.objects.create(
+            therapist=self.therapist,
+            client=self.client_profile,
+            title='Weekly check-in',
+            recurrence_type='weekly',
+            preferred_day_of_week=0,
+            preferred_time=time(10, 0),
+            start_date=date(2029, 1, 1),
+            max_sessions=5
+        )
+
+    def test_generates_around_conflicts_until_max_sessions(self):
+        TherapySession.objects.create(
+            client=self.client_profile,
+            therapist=self.therapist,
+            scheduled_date=date(2029, 1, 8),
+            scheduled_time=time(10, 30)
+        )
+
+        reports = SessionTemplateScheduler.generate(horizon_days=90, today=date(2028, 12, 31))
+        self.assertEqual(reports, [{
+            'template_id': self.template.pk,
+            'created': 5,
+            'conflicts': [{'date': date(2029, 1, 8), 'time': time(10, 0), 'reason': 'therapist_busy'}],
+            'skipped': None,
+        }])
+        generated = TherapySession.objects.filter(title='Weekly check-in').order_by('scheduled_date')
+        self.assertEqual(
+            [session.scheduled_date.day for session in generated],
+            [1, 15, 22, 29, 5]
+        )
+        self.template.refresh_from_db()
+        self.assertEqual((self.template.sessions_created, self.template.generated_until), (5, date(2029, 2, 5)))
+
+        reports = SessionTemplateScheduler.generate(horizon_days=90, today=date(2028, 12, 31))
+        self.assertEqual(reports[0]['skipped'], 'Maximum number of sessions reached')
+        self.assertEqual(generated.count(), 5)
+
+
+class BookingTest(TestCase):
+
+    def setUp(self):
+        self.day = timezone.localdate() + timedelta(days=5)
+        self.therapist, self.slots = create_bookable_therapist(self.day)
+        self.client_user = create_client().user
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(self.client_user)
+
+    def book(self, slot_time, key=None):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return self.api_client.post('/api/sessions/book/', {
+            'therapist_id': self.therapist.pk, 'date': self.day.isoformat(), 'time': slot_time
+        }, format='json', **headers)
+
+    def test_retry_with_idempotency_key_books_once(self):
+        first = self.book('10:00', key='booking-1')
+        retry = self.book('10:00', key='booking-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.data), (first.status_code, first.data))
+        self.assertEqual(TherapySession.objects.count(), 1)
+
+        self.slots[0].refresh_from_db()
+        self.assertEqual(self.slots[0].status, 'booked')
+        self.assertEqual(str(self.slots[0].session.session_id), first.data['session']['session_id'])
+
+        # Overlaps the booked session; same key for a different request is refused
+        self.assertEqual(self.book('10:30').status_code, 409)
+        self.assertEqual(self.book('11:00', key='booking-1').status_code, 422)
+
+        response = self.api_client.post(f"/api/sessions/{first.data['session']['session_id']}/cancel/", format='json')
+        self.assertEqual(response.status_code, 200)
+        self.slots[0].refresh_from_db()
+        self.assertEqual((self.slots[0].status, self.slots[0].session), ('available', None))
+        self.assertEqual(self.book('10:30').status_code, 201)
+
+    def test_buffer_clash_with_a_booking_after_midnight_is_refused(self):
+        TherapistCalendar.objects.create(therapist=self.therapist, buffer_time_between_sessions=30)
+        TherapistAvailability.objects.create(
+            therapist=self.therapist, day_of_week=self.day.weekday(), specific_date=self.day,
+            start_time=time(22, 0), end_time=time(23, 59)
+        )
+        TherapySession.objects.create(
+            client=create_client('other'), therapist=self.therapist,
+            scheduled_date=self.day + timedelta(days=1), scheduled_time=time(0, 10), duration_minutes=50
+        )
+
+        def book(slot_time):
+            return self.api_client.post('/api/sessions/book/', {
+                'therapist_id': self.therapist.pk, 'date': self.day.isoformat(), 'time': slot_time,
+                'duration_minutes': 50
+            }, format='json')
+
+        # 23:00-23:50 ends inside the 30 minutes before the 00:10 booking
+        self.assertEqual(book('23:00').status_code, 409)
+        self.assertEqual(book('22:00').status_code, 201)
+
+
+class ReminderDispatchTest(TestCase):
+
+    def setUp(self):
+        self.therapist, _ = create_bookable_therapist(timezone.localdate() + timedelta(days=2))
+        client_profile = create_client(email='client@example.com')
+        # Reminders are queued once the booking commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.session = TherapySession.objects.create(
+                client=client_profile,
+                therapist=self.therapist,
+                scheduled_date=timezone.localdate() + timedelta(days=2),
+                scheduled_time=time(10, 0)
+            )
+        EmailTemplate.objects.create(
+            name='24 hour reminder',
+            template_type='session_reminder_24h',
+            subject='See you soon, {client_name}',
+            html_content='<p>{session_date} at {session_time}</p>',
+        )
+        # Bring the 24 hour reminders forward so they are due now
+        self.due = AutomatedReminder.objects.filter(session=self.session, reminder_type='24_hour_reminder')
+        self.due.update(scheduled_for=timezone.now() - timedelta(minutes=1))
+
+    def test_due_reminders_are_sent_once(self):
+        self.assertEqual(ReminderQueueManager.dispatch_due(), 2)
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(set(self.due.values_list('is_sent', 'delivery_status')), {(True, 'sent')})
+        self.session.refresh_from_db()
+        self.assertTrue(self.session.reminder_sent_24h)
+        self.assertFalse(self.session.reminder_sent_1h)
+        self.assertEqual(ReminderQueueManager.dispatch_due(), 0)
+
+    def test_failed_sends_are_recorded_after_the_claim(self):
+        with mock.patch.object(EmailBackend, 'send_messages', side_effect=ConnectionError('SMTP down')):
+            self.assertEqual(ReminderQueueManager.dispatch_due(), 0)
+
+        self.assertEqual(
+            set(self.due.values_list('is_sent', 'sent_at', 'delivery_status', 'error_message')),
+            {(False, None, 'failed', 'SMTP down')}
+        )
+        self.session.refresh_from_db()
+        self.assertFalse(self.session.reminder_sent_24h)
+
+
+class ReportExportTest(TestCase):
+
+    def setUp(self):
+        self.day = date(2029, 1, 2)
+        self.therapist = create_therapist(first_name='Asha', last_name='Rao')
+        self.client_profile = create_client(first_name='Ravi', last_name='Kumar')
+        self.sessions = [
+            TherapySession.objects.create(
+                client=self.client_profile, therapist=self.therapist,
+                scheduled_date=self.day, scheduled_time=time(hour, 0), status='completed'
+            )
+            for hour in (9, 11, 10)
+        ]
+        self.exporter = StreamingReportExporter(self.day, self.day, chunk_size=2)
+        self.admin = User.objects.create_user(username='admin', password='pass', user_type='admin', is_staff=True)
+
+    def session_ids(self):
+        return [str(session.session_id) for session in sorted(self.sessions, key=lambda s: s.scheduled_time)]
+
+    def test_rows_come_in_order_and_in_chunks(self):
+        rows = list(self.exporter.rows())
+        self.assertEqual([row[0] for row in rows], self.session_ids())
+        self.assertEqual(rows[0][3:8], ('Asha Rao', 'Ravi Kumar', '', 'individual', 'completed'))
+        self.assertEqual([len(chunk) for chunk in self.exporter.chunks()], [2, 1])
+
+    def test_csv_and_ndjson_stream_every_row(self):
+        lines = ''.join(self.exporter.stream_csv()).splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['Session ID', 'Date'])
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], self.session_ids())
+
+        records = [json.loads(line) for line in self.exporter.stream_ndjson()]
+        self.assertEqual([record['session_id'] for record in records], self.session_ids())
+        self.assertEqual(records[0]['scheduled_time'], '09:00:00')
+
+    def test_excel_export_writes_sessions_and_summary(self):
+        workbook = openpyxl.load_workbook(self.exporter.write_excel(BytesIO()))
+        self.assertEqual(workbook.sheetnames, ['Summary', 'Sessions'])
+        sessions = list(workbook['Sessions'].values)
+        self.assertEqual(sessions[0][0], 'Session ID')
+        self.assertEqual([row[0] for row in sessions[1:]], self.session_ids())
+        self.assertIn(('Total Sessions', 3), list(workbook['Summary'].values))
+
+    def test_pdf_export_builds_a_document(self):
+        self.assertTrue(self.exporter.write_pdf(BytesIO()).getvalue().startswith(b'%PDF'))
+
+    def test_export_endpoint_streams_for_admins_only(self):
+        api_client = APIClient()
+        api_client.force_authenticate(self.client_profile.user)
+        url = f'/api/reports/export/?date_from={self.day}&date_to={self.day}'
+        self.assertEqual(api_client.get(url).status_code, 403)
+
+        api_client.force_authenticate(self.admin)
+        self.assertEqual(api_client.get(url + '&file_format=docx').status_code, 400)
+        response = api_client.get(url + '&file_format=ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 3)
+        response = api_client.get(url + '&file_format=xlsx')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'PK'))
+
+    def test_monthly_report_files(self):
+        generator = MonthlyReportGenerator(2029, 1)
+        report_data = generator.generate_overall_report()
+
+        workbook = openpyxl.load_workbook(generator.generate_excel_report(report_data))
+        self.assertEqual(workbook.sheetnames[:2], ['Summary', 'Therapists'])
+        self.assertEqual(workbook['Summary']['A4'].value, 'Total Sessions')
+        self.assertEqual(workbook['Summary']['B4'].value, 3)
+        self.assertTrue(generator.generate_pdf_report(report_data).getvalue().startswith(b'%PDF'))
+
+
+class MonthlyReportQueryCountTest(TestCase):
+    """The monthly report runs a fixed set of grouped queries however much data there is"""
+
+    QUERIES = 10
+
+    def populate(self, therapists, companies, sessions):
+        random.seed(therapists)
+        BenchmarkCommand(stdout=StringIO()).populate({
+            'therapists': therapists, 'clients': therapists * 4, 'companies': companies,
+            'sessions': sessions, 'year': 2029, 'month': 1, 'batch_size': 500,
+        })
+
+    def test_query_count_is_constant(self):
+        generator = MonthlyReportGenerator(2029, 1)
+
+        self.populate(therapists=2, companies=1, sessions=20)
+        with self.assertNumQueries(self.QUERIES):
+            small = generator.generate_overall_report()
+
+        self.populate(therapists=40, companies=10, sessions=600)
+        with self.assertNumQueries(self.QUERIES):
+            large = generator.generate_overall_report()
+
+        self.assertEqual(large['sessions_data']['total_sessions'], 620)
+        self.assertGreater(
+            large['therapists_data']['active_therapists_count'],
+            small['therapists_data']['active_therapists_count']
+        )
+        self.assertGreater(
+            large['companies_data']['active_companies_count'],
+            small['companies_data']['active_companies_count']
+        )
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Concurrent writes need PostgreSQL')
+class ConcurrentBookingLoadTest(TransactionTestCase):
+    """
+    Thousands of concurrent booking requests for a handful of slots must
+    never leave two overlapping sessions behind.
+    """
+    REQUESTS = 2000
+    WORKERS = 32
+    CLIENTS = 50
+    TIMES = ['10:00', '10:30', '11:00', '11:30', '12:00', '13:00']
+
+    def setUp(self):
+        self.day = timezone.localdate() + timedelta(days=5)
+        self.therapist, self.slots = create_bookable_therapist(self.day)
+        self.users = [
+            User.objects.create_user(username=f'client{i}', password='pass', user_type='client')
+            for i in range(self.CLIENTS)
+        ]
+        ClientProfile.objects.bulk_create([ClientProfile(user=user) for user in self.users])
+
+    def request(self, i):
+        user = self.users[i % self.CLIENTS]
+        slot_time = self.TIMES[i % len(self.TIMES)]
+        # Every (client, time) pair is sent several times with the same key, like a retrying client
+        key = f'{user.pk}-{slot_time}'
+        try:
+            api_client = APIClient()
+            api_client.force_authenticate(user)
+            response = api_client.post('/api/sessions/book/', {
+                'therapist_id': self.therapist.pk, 'date': self.day.isoformat(), 'time': slot_time
+            }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+            return key, response.status_code, response.data
+        finally:
+            connections.close_all()
+
+    def test_concurrent_bookings_never_overlap(self):
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+            results = list(pool.map(self.request, range(self.REQUESTS)))
+
+        responses = defaultdict(set)
+        for key, status_code, data in results:
+            self.assertIn(status_code, (201, 409), data)
+            responses[key].add((status_code, json.dumps(data, sort_keys=True)))
+        # Retries got the original response back
+        self.assertTrue(all(len(outcomes) == 1 for outcomes in responses.values()))
+
+        sessions = list(TherapySession.objects.filter(therapist=self.therapist).order_by('scheduled_time'))
+        booked_ids = {data['session']['session_id'] for _, status_code, data in results if status_code == 201}
+        self.assertEqual({str(session.session_id) for session in sessions}, booked_ids)
+        self.assertTrue(sessions)
+        for previous, current in zip(sessions, sessions[1:]):
+            previous_end = datetime.combine(self.day, previous.scheduled_time) + timedelta(minutes=previous.duration_minutes)
+            self.assertLessEqual(previous_end, datetime.combine(self.day, current.scheduled_time))
+
+        starts = {session.scheduled_time: session for session in sessions}
+        for slot in self.slots:
+            slot.refresh_from_db()
+            if slot.start_time in starts:
+                self.assertEqual((slot.status, slot.session_id), ('booked', starts[slot.start_time].pk))
+            else:
+                self.assertEqual((slot.status, slot.session_id), ('available', None))
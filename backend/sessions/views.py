@@ -8,12 +8,17 @@ from django.utils.decorators import method_decorator
 from django.views.generic import ListView, DetailView, CreateView, UpdateView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.db import models
+from django.db.models import Count, Max, OuterRef, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from datetime import datetime, timedelta, time
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+import base64
+import binascii
 import json
 import uuid
 
@@ -22,17 +27,84 @@ from .models import (
     SessionExtension, SessionRecording, SessionReminder
 )
 from .calendar_models import (
-    TherapistCalendar, AvailabilitySlot, SessionJoinControl, CalendarEvent
+    TherapistCalendar, AvailabilitySlot, SessionJoinControl, CalendarEvent, AutomatedReminder
 )
 from therapists.models import TherapistProfile
 from clients.models import ClientProfile
+from therapy_management.availability_import import AvailabilityImporter
+from therapy_management.booking import BookingEngine
+from therapy_management.recurrence import RecurringAvailability
+from therapy_management.slot_index import FreeSlotIndex
 
 User = get_user_model()
 
 
+SESSION_LIST_PAGE_SIZE = 50
+SESSION_LIST_MAX_PAGE_SIZE = 500
+MAX_AVAILABILITY_RANGE_DAYS = 366
+
+
+def encode_session_cursor(session):
+    """Encode the keyset position of a session as an opaque cursor"""
+    raw = f"{session.scheduled_date.isoformat()}|{session.scheduled_time.strftime('%H:%M:%S')}|{session.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_session_cursor(cursor):
+    """Decode a cursor into (scheduled_date, scheduled_time, pk), or None if invalid"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        date_part, time_part, pk_part = raw.split('|')
+        return (
+            datetime.strptime(date_part, '%Y-%m-%d').date(),
+            datetime.strptime(time_part, '%H:%M:%S').time(),
+            int(pk_part),
+        )
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        return None
+
+
+def annotate_session_listing(sessions):
+    """
+    Fold per-session extension, reminder and participant lookups into a fixed
+    number of queries: one for the sessions and one for group participants.
+    """
+    extensions = SessionExtension.objects.filter(
+        session=OuterRef('pk')
+    ).order_by().values('session')
+    reminders = AutomatedReminder.objects.filter(
+        session=OuterRef('pk'),
+        is_sent=True
+    ).order_by().values('session')
+
+    return sessions.select_related('client__user').annotate(
+        extensions_used=Coalesce(
+            Subquery(extensions.annotate(c=Count('id')).values('c')), 0
+        ),
+        total_extended=Coalesce(
+            Subquery(extensions.annotate(s=Sum('extended_by_minutes')).values('s')), 0
+        ),
+        reminders_sent=Coalesce(
+            Subquery(reminders.annotate(c=Count('id')).values('c')), 0
+        ),
+        last_reminder_sent=Subquery(
+            reminders.annotate(m=Max('sent_at')).values('m')
+        ),
+    ).prefetch_related(
+        Prefetch(
+            'participants',
+            queryset=SessionParticipant.objects.select_related('client__user')
+        )
+    )
+
+
 class TherapistSessionListView(LoginRequiredMixin, APIView):
     """
-    List therapist sessions with filtering and calendar view
+    List therapist sessions with filtering and calendar view.
+
+    Results are keyset-paginated over (scheduled_date, scheduled_time, id) in
+    descending order; pass the returned ``next_cursor`` as ``cursor`` to fetch
+    the following page. The query count does not grow with the page size.
     """
     permission_classes = [permissions.IsAuthenticated]
 
@@ -48,8 +120,15 @@ class TherapistSessionListView(LoginRequiredMixin, APIView):
         status_filter = request.GET.get('status')
         session_type = request.GET.get('type')
         view_type = request.GET.get('view', 'list')  # list, calendar, today, week
+        cursor = request.GET.get('cursor')
 
-        sessions = therapist.sessions.all()
+        try:
+            page_size = int(request.GET.get('page_size', SESSION_LIST_PAGE_SIZE))
+        except ValueError:
+            return Response({'error': 'page_size must be an integer'}, status=400)
+        page_size = max(1, min(page_size, SESSION_LIST_MAX_PAGE_SIZE))
+
+        sessions = TherapySession.objects.filter(therapist=therapist)
 
         # Apply filters
         if date_from:
@@ -71,12 +150,30 @@ class TherapistSessionListView(LoginRequiredMixin, APIView):
             week_end = week_start + timedelta(days=6)
             sessions = sessions.filter(scheduled_date__range=[week_start, week_end])
 
+        total_count = sessions.count()
+
+        # Keyset pagination: continue strictly after the cursor position
+        if cursor:
+            position = decode_session_cursor(cursor)
+            if position is None:
+                return Response({'error': 'Invalid cursor'}, status=400)
+            cursor_date, cursor_time, cursor_id = position
+            sessions = sessions.filter(
+                Q(scheduled_date__lt=cursor_date) |
+                Q(scheduled_date=cursor_date, scheduled_time__lt=cursor_time) |
+                Q(scheduled_date=cursor_date, scheduled_time=cursor_time, id__lt=cursor_id)
+            )
+
+        page = list(
+            annotate_session_listing(sessions).order_by(
+                '-scheduled_date', '-scheduled_time', '-id'
+            )[:page_size + 1]
+        )
+        has_more = len(page) > page_size
+        page = page[:page_size]
+
         sessions_data = []
-        for session in sessions.order_by('-scheduled_date', '-scheduled_time'):
-            # Get extension information
-            extensions = session.extensions.all()
-            total_extended = sum(ext.extended_by_minutes for ext in extensions)
-            
+        for session in page:
             session_data = {
                 'id': str(session.session_id),
                 'client_id': session.client.id,
@@ -91,27 +188,29 @@ class TherapistSessionListView(LoginRequiredMixin, APIView):
                 'meeting_id': session.meeting_id,
                 'can_join': session.can_join(),
                 'notes': session.session_notes,
-                'extensions_used': extensions.count(),
+                'extensions_used': session.extensions_used,
                 'max_extensions': 3,
-                'total_extended': total_extended,
+                'total_extended': session.total_extended,
                 'session_price': 2500,  # This should come from pricing model
                 'timezone': session.timezone,
-                'reminders_sent': session.reminders.count(),
-                'last_reminder_sent': session.reminders.order_by('-sent_at').first().sent_at if session.reminders.exists() else None,
+                'reminders_sent': session.reminders_sent,
+                'last_reminder_sent': session.last_reminder_sent,
             }
 
             # Add participants for group sessions
             if session.session_type in ['family', 'group']:
-                participants = session.participants.all()
                 session_data['participants'] = [
-                    p.client.user.get_full_name() for p in participants
+                    p.client.user.get_full_name() for p in session.participants.all()
                 ]
 
             sessions_data.append(session_data)
 
         return Response({
             'sessions': sessions_data,
-            'total_count': len(sessions_data),
+            'total_count': total_count,
+            'page_size': page_size,
+            'has_more': has_more,
+            'next_cursor': encode_session_cursor(page[-1]) if has_more else None,
             'view_type': view_type
         })
 
@@ -348,29 +447,37 @@ class AvailabilityManagementView(LoginRequiredMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        """Get availability slots"""
+        """Get availability slots, with recurring slots expanded into their occurrences"""
         try:
             therapist = request.user.therapist_profile
-            date_from = request.GET.get('date_from', timezone.now().date())
-            date_to = request.GET.get('date_to', timezone.now().date() + timedelta(days=30))
-            
-            slots = therapist.availability_slots.filter(
-                date__range=[date_from, date_to]
-            ).order_by('date', 'start_time')
+            today = timezone.now().date()
+            try:
+                date_from = parse_date(request.GET['date_from']) if request.GET.get('date_from') else today
+                date_to = parse_date(request.GET['date_to']) if request.GET.get('date_to') else today + timedelta(days=30)
+            except ValueError:
+                date_from = date_to = None
+            if date_from is None or date_to is None or date_to < date_from:
+                return Response({'error': 'Invalid date range'}, status=status.HTTP_400_BAD_REQUEST)
+            if (date_to - date_from).days > MAX_AVAILABILITY_RANGE_DAYS:
+                return Response({
+                    'error': f'Date range cannot exceed {MAX_AVAILABILITY_RANGE_DAYS} days'
+                }, status=status.HTTP_400_BAD_REQUEST)
             
+            modification_cutoff = today + timedelta(days=2)
             slots_data = []
-            for slot in slots:
+            for slot in RecurringAvailability.get(therapist.pk, date_from, date_to):
                 slots_data.append({
-                    'id': slot.id,
-                    'date': slot.date.isoformat(),
-                    'start_time': slot.start_time.strftime('%H:%M'),
-                    'end_time': slot.end_time.strftime('%H:%M'),
-                    'duration': slot.duration_minutes,
-                    'status': slot.status,
-                    'is_recurring': slot.is_recurring,
-                    'recurrence_type': slot.recurrence_type,
-                    'notes': slot.notes,
-                    'can_be_modified': slot.can_be_modified(),
+                    'id': slot['id'],
+                    'date': slot['date'].isoformat(),
+                    'start_time': slot['start_time'].strftime('%H:%M'),
+                    'end_time': slot['end_time'].strftime('%H:%M'),
+                    'duration': slot['duration_minutes'],
+                    'status': slot['status'],
+                    'is_recurring': slot['is_recurring'],
+                    'recurrence_type': slot['recurrence_type'],
+                    'occurrence_of': slot['occurrence_of'],
+                    'notes': slot['notes'],
+                    'can_be_modified': slot['date'] > modification_cutoff,
                 })
             
             return Response({
@@ -385,48 +492,22 @@ class AvailabilityManagementView(LoginRequiredMixin, APIView):
             return Response({'error': 'Therapist profile not found'}, status=404)
 
     def post(self, request):
-        """Create availability slots"""
+        """Create availability slots; either the whole batch is created or none of it"""
         try:
             therapist = request.user.therapist_profile
-            slots_data = request.data.get('slots', [])
-            
-            created_slots = []
-            errors = []
-            
-            for slot_data in slots_data:
-                try:
-                    # Validate 2-day advance notice for new slots
-                    slot_date = datetime.strptime(slot_data['date'], '%Y-%m-%d').date()
-                    if slot_date <= timezone.now().date() + timedelta(days=2):
-                        errors.append(f"Cannot create slots with less than 2 days advance notice: {slot_date}")
-                        continue
-                    
-                    slot = AvailabilitySlot.objects.create(
-                        therapist=therapist,
-                        date=slot_date,
-                        start_time=datetime.strptime(slot_data['start_time'], '%H:%M').time(),
-                        end_time=datetime.strptime(slot_data['end_time'], '%H:%M').time(),
-                        duration_minutes=slot_data.get('duration_minutes', 60),
-                        status='available',
-                        is_recurring=slot_data.get('is_recurring', False),
-                        recurrence_type=slot_data.get('recurrence_type', 'none'),
-                        notes=slot_data.get('notes', '')
-                    )
-                    created_slots.append(slot)
-                    
-                except Exception as e:
-                    errors.append(f"Error creating slot: {str(e)}")
+            created_slots, errors = AvailabilityImporter.import_slots(therapist, request.data.get('slots', []))
+            if errors:
+                return Response({
+                    'error': 'No slots were created',
+                    'created_slots': 0,
+                    'errors': errors
+                }, status=400)
             
-            response_data = {
+            return Response({
                 'message': f'{len(created_slots)} slots created successfully',
                 'created_slots': len(created_slots),
-                'errors': errors
-            }
-            
-            if errors:
-                response_data['warning'] = f'{len(errors)} slots failed to create'
-            
-            return Response(response_data)
+                'errors': []
+            })
             
         except TherapistProfile.DoesNotExist:
             return Response({'error': 'Therapist profile not found'}, status=404)
@@ -606,3 +687,116 @@ def case_sheets(request):
             
     except TherapistProfile.DoesNotExist:
         return Response({'error': 'Therapist profile not found'}, status=404)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def available_slots(request):
+    """
+    Free booking slots for one or more therapists over a date range, served
+    from the cached free-slot index.
+
+    Query parameters: ``therapist_ids`` (comma-separated, defaults to all
+    approved therapists), ``date_from`` (defaults to today), ``days``
+    (defaults to 7, max 31) and ``duration`` in minutes (defaults to 60).
+    """
+    try:
+        date_from = request.GET.get('date_from')
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else timezone.localdate()
+        days = min(max(int(request.GET.get('days', 7)), 1), 31)
+        duration = int(request.GET.get('duration', 60))
+        therapist_ids = request.GET.get('therapist_ids')
+        therapist_ids = [int(pk) for pk in therapist_ids.split(',') if pk] if therapist_ids else None
+    except ValueError:
+        return Response({'error': 'Invalid query parameters'}, status=400)
+
+    if duration <= 0:
+        return Response({'error': 'duration must be positive'}, status=400)
+
+    date_to = date_from + timedelta(days=days - 1)
+    free_slots = FreeSlotIndex.get_free_slots(
+        therapist_ids=therapist_ids,
+        date_from=date_from,
+        date_to=date_to,
+        session_duration=duration,
+        not_before=timezone.localtime().replace(tzinfo=None)
+    )
+
+    names = {
+        therapist_id: f"{first_name} {last_name}".strip()
+        for therapist_id, first_name, last_name in TherapistProfile.objects.filter(
+            id__in=free_slots.keys()
+        ).values_list('id', 'user__first_name', 'user__last_name')
+    }
+
+    return Response({
+        'date_from': date_from.isoformat(),
+        'date_to': date_to.isoformat(),
+        'duration': duration,
+        'therapists': [{
+            'therapist_id': therapist_id,
+            'therapist_name': names.get(therapist_id, ''),
+            'slots': {
+                slot_date.isoformat(): [slot.strftime('%H:%M') for slot in slots]
+                for slot_date, slots in days_slots.items()
+            },
+        } for therapist_id, days_slots in free_slots.items()],
+    })
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def book_session(request):
+    """
+    Book a session with a therapist. Send an Idempotency-Key header to make
+    retries safe: a repeated request gets the original response back.
+
+    Body: ``therapist_id``, ``date`` (YYYY-MM-DD), ``time`` (HH:MM) and
+    optionally ``duration_minutes``, ``session_type``, ``title`` and
+    ``description``.
+    """
+    try:
+        client = request.user.client_profile
+    except ClientProfile.DoesNotExist:
+        return Response({'error': 'Client profile not found'}, status=404)
+
+    status_code, body = BookingEngine.idempotent(
+        request.user, request.headers.get('Idempotency-Key'), 'book', request.data,
+        lambda: BookingEngine.book(client, request.data)
+    )
+    return Response(body, status=status_code)
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def cancel_session(request, session_id):
+    """
+    Cancel a session as its client or therapist (30 hours advance notice).
+    Honours the Idempotency-Key header like book_session.
+    """
+    status_code, body = BookingEngine.idempotent(
+        request.user, request.headers.get('Idempotency-Key'), 'cancel',
+        {'session_id': str(session_id), 'data': request.data},
+        lambda: BookingEngine.cancel(request.user, session_id, request.data)
+    )
+    return Response(body, status=status_code)
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def reschedule_session(request, session_id):
+    """
+    Move a session to a new ``date`` and ``time`` as its client or
+    therapist (30 hours advance notice). Honours the Idempotency-Key header
+    like book_session.
+    """
+    status_code, body = BookingEngine.idempotent(
+        request.user, request.headers.get('Idempotency-Key'), 'reschedule',
+        {'session_id': str(session_id), 'data': request.data},
+        lambda: BookingEngine.reschedule(request.user, session_id, request.data)
+    )
+    return Response(body, status=status_code)
+
+
+# The legacy calendar route serves the therapist calendar
+session_calendar = SessionCalendarView.as_view()
@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
+from therapy_management.rating_aggregates import RatingAggregateManager
 from .models import (
     TherapistProfile, TherapyCategory, Competency, TherapistCompetency,
     TherapistDocument, TherapistAvailability, TherapistReview, SupervisorRelationship
@@ -293,12 +294,12 @@ class TherapistReviewAdmin(admin.ModelAdmin):
     actions = ['approve_reviews', 'disapprove_reviews']
     
     def approve_reviews(self, request, queryset):
-        updated = queryset.update(is_approved=True)
+        updated = RatingAggregateManager.set_review_approval(queryset, True)
         self.message_user(request, f'{updated} reviews approved.')
     approve_reviews.short_description = "Approve selected reviews"
     
     def disapprove_reviews(self, request, queryset):
-        updated = queryset.update(is_approved=False)
+        updated = RatingAggregateManager.set_review_approval(queryset, False)
         self.message_user(request, f'{updated} reviews disapproved.')
     disapprove_reviews.short_description = "Disapprove selected reviews"
 
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from therapy_management.rating_aggregates import RatingAggregateManager
+
+
+class Command(BaseCommand):
+    help = 'Recount therapist rating aggregates from reviews and feedback and correct any drift'
+
+    def handle(self, *args, **options):
+        result = RatingAggregateManager.reconcile()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {result['created']}, updated {result['updated']} aggregates; "
+                f"corrected {result['profiles']} therapist profiles"
+            )
+        )
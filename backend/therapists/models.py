@@ -1,3 +1,4 @@
+from decimal import Decimal
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -276,4 +277,41 @@ class TherapistReview(models.Model):
 
     class Meta:
         unique_together = ['therapist', 'client']
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+
+class TherapistRatingAggregate(models.Model):
+    """
+    Running rating sums and counts per therapist, kept current by the
+    signals in therapists/signals.py and sessions/signals.py and reconciled
+    nightly. Reviews count once approved; session feedback counts when it
+    comes from the client.
+    """
+    therapist = models.OneToOneField(
+        TherapistProfile,
+        on_delete=models.CASCADE,
+        related_name='rating_aggregate'
+    )
+
+    # Approved TherapistReview ratings
+    review_count = models.IntegerField(default=0)
+    review_sum = models.IntegerField(default=0)
+
+    # Client SessionFeedback ratings, per dimension
+    overall_count = models.IntegerField(default=0)
+    overall_sum = models.IntegerField(default=0)
+    session_quality_count = models.IntegerField(default=0)
+    session_quality_sum = models.IntegerField(default=0)
+    technical_quality_count = models.IntegerField(default=0)
+    technical_quality_sum = models.IntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Ratings for {self.therapist}"
+
+    def average(self, dimension):
+        """Average of ``dimension`` ('review', 'overall', 'session_quality', 'technical_quality'), or None"""
+        count = getattr(self, f'{dimension}_count')
+        if count <= 0:
+            return None
+        return (Decimal(getattr(self, f'{dimension}_sum')) / count).quantize(Decimal('0.01'))
@@ -81,7 +81,7 @@ class TherapistAvailabilitySerializer(serializers.ModelSerializer):
         model = TherapistAvailability
         fields = [
             'id', 'day_of_week', 'start_time', 'end_time', 'is_available',
-            'specific_date', 'is_holiday', 'notes', 'created_at', 'updated_at'
+            'specific_date', 'is_holiday', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
 
@@ -95,27 +95,8 @@ class TherapistAvailabilitySerializer(serializers.ModelSerializer):
                 "Start time must be before end time"
             )
         
-        # Check for overlapping slots
-        therapist = data.get('therapist') or self.instance.therapist
-        day_of_week = data.get('day_of_week')
-        specific_date = data.get('specific_date')
-        
-        overlapping_slots = TherapistAvailability.objects.filter(
-            therapist=therapist,
-            day_of_week=day_of_week,
-            specific_date=specific_date,
-            start_time__lt=end_time,
-            end_time__gt=start_time
-        )
-        
-        if self.instance:
-            overlapping_slots = overlapping_slots.exclude(id=self.instance.id)
-        
-        if overlapping_slots.exists():
-            raise serializers.ValidationError(
-                "This time slot overlaps with an existing availability slot"
-            )
-        
+        # Overlaps with other slots are checked for the whole batch at once
+        # by AvailabilityImporter
         return data
 
 
@@ -176,6 +157,7 @@ class TherapistProfileSerializer(serializers.ModelSerializer):
     is_approved = serializers.SerializerMethodField()
     total_documents = serializers.SerializerMethodField()
     verified_documents = serializers.SerializerMethodField()
+    rating_breakdown = serializers.SerializerMethodField()
     
     class Meta:
         model = TherapistProfile
@@ -185,9 +167,9 @@ class TherapistProfileSerializer(serializers.ModelSerializer):
             'years_of_experience', 'bio', 'consultation_fee', 'languages_spoken',
             'is_available', 'max_clients_per_day', 'session_duration_minutes',
             'approval_status', 'approved_by', 'approved_at', 'rejection_reason',
-            'average_rating', 'total_reviews', 'total_sessions', 'documents',
-            'availability', 'reviews', 'supervisor_relationships', 'is_approved',
-            'total_documents', 'verified_documents', 'created_at', 'updated_at'
+            'average_rating', 'total_reviews', 'total_sessions', 'rating_breakdown',
+            'documents', 'availability', 'reviews', 'supervisor_relationships',
+            'is_approved', 'total_documents', 'verified_documents', 'created_at', 'updated_at'
         ]
         read_only_fields = [
             'id', 'approved_by', 'approved_at', 'average_rating', 'total_reviews',
@@ -206,6 +188,17 @@ class TherapistProfileSerializer(serializers.ModelSerializer):
     def get_verified_documents(self, obj):
         return obj.documents.filter(is_verified=True).count()
 
+    def get_rating_breakdown(self, obj):
+        """Averages and counts of client session feedback, per dimension"""
+        aggregate = getattr(obj, 'rating_aggregate', None) if obj.pk else None
+        breakdown = {}
+        for dimension in ('overall', 'session_quality', 'technical_quality'):
+            breakdown[dimension] = {
+                'average': aggregate.average(dimension) if aggregate else None,
+                'count': getattr(aggregate, f'{dimension}_count', 0),
+            }
+        return breakdown
+
     def validate_license_number(self, value):
         """Validate license number uniqueness"""
         if TherapistProfile.objects.filter(license_number=value).exclude(
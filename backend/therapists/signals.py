@@ -0,0 +1,130 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from therapy_management.rating_aggregates import RatingAggregateManager
+from therapy_management.therapist_dashboard import TherapistDashboard
+from therapy_management.therapist_search import TherapistSearchIndex
+from .models import TherapistProfile, TherapistCompetency, TherapyCategory, Competency, TherapistReview
+
+User = get_user_model()
+
+# Saves that only stamp activity don't touch anything the search index holds
+ACTIVITY_FIELDS = {'last_login', 'last_activity'}
+
+
+# Therapist search index
+
+@receiver(post_save, sender=TherapistProfile)
+@receiver(post_delete, sender=TherapistProfile)
+def reindex_therapist(sender, instance, **kwargs):
+    TherapistSearchIndex.notify([instance.pk])
+
+
+@receiver(post_save, sender=TherapistCompetency)
+@receiver(post_delete, sender=TherapistCompetency)
+def reindex_therapist_competencies(sender, instance, **kwargs):
+    TherapistSearchIndex.notify([instance.therapist_id])
+
+
+@receiver(m2m_changed, sender=TherapistProfile.specializations.through)
+@receiver(m2m_changed, sender=TherapistProfile.competencies.through)
+def reindex_therapist_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        TherapistSearchIndex.notify([instance.pk])
+    elif pk_set is None:
+        # A category or competency was cleared of all its therapists
+        TherapistSearchIndex.notify()
+    elif pk_set:
+        TherapistSearchIndex.notify(pk_set)
+
+
+@receiver(post_save, sender=User)
+def reindex_therapist_user(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields and set(update_fields) <= ACTIVITY_FIELDS:
+        return
+    if instance.user_type != 'therapist':
+        return
+    therapist_ids = list(TherapistProfile.objects.filter(user_id=instance.pk).values_list('id', flat=True))
+    if therapist_ids:
+        TherapistSearchIndex.notify(therapist_ids)
+
+
+@receiver(post_save, sender=TherapyCategory)
+@receiver(post_delete, sender=TherapyCategory)
+@receiver(post_save, sender=Competency)
+@receiver(post_delete, sender=Competency)
+def reindex_all_therapists(sender, instance, **kwargs):
+    # Names shared by many therapists; cheaper to rebuild than to find them
+    TherapistSearchIndex.notify()
+
+
+# Therapist dashboard snapshots
+
+@receiver(post_save, sender=TherapistProfile)
+@receiver(post_delete, sender=TherapistProfile)
+def invalidate_dashboard_for_profile(sender, instance, **kwargs):
+    TherapistDashboard.invalidate([instance.pk])
+
+
+@receiver(m2m_changed, sender=TherapistProfile.specializations.through)
+def invalidate_dashboard_for_specializations(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        TherapistDashboard.invalidate([instance.pk])
+    elif pk_set:
+        TherapistDashboard.invalidate(pk_set)
+    elif pk_set is None:
+        # A category was cleared; its therapists are already gone from the through table
+        TherapistDashboard.invalidate(TherapistProfile.objects.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=TherapyCategory)
+def invalidate_dashboard_for_category(sender, instance, created, **kwargs):
+    if not created:
+        TherapistDashboard.invalidate(instance.therapists.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=User)
+def invalidate_dashboard_for_therapist_user(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields and set(update_fields) <= ACTIVITY_FIELDS:
+        return
+    if instance.user_type == 'therapist':
+        TherapistDashboard.invalidate(TherapistProfile.objects.filter(user_id=instance.pk).values_list('id', flat=True))
+
+
+# Rating aggregates
+
+def _review_contribution(values):
+    return RatingAggregateManager.review_contribution(
+        values['therapist_id'], values['rating'], values['is_approved']
+    )
+
+
+@receiver(pre_save, sender=TherapistReview)
+@receiver(pre_delete, sender=TherapistReview)
+def remember_review_rating(sender, instance, **kwargs):
+    # The stored row, not the instance: approval may have changed through
+    # a queryset update (see RatingAggregateManager.set_review_approval)
+    previous = None
+    if instance.pk is not None:
+        previous = sender.objects.filter(pk=instance.pk).values('therapist_id', 'rating', 'is_approved').first()
+    instance._previous_contribution = _review_contribution(previous) if previous else {}
+
+
+@receiver(post_save, sender=TherapistReview)
+def update_ratings_for_review(sender, instance, **kwargs):
+    RatingAggregateManager.apply_change(
+        getattr(instance, '_previous_contribution', {}),
+        _review_contribution(instance.__dict__)
+    )
+
+
+@receiver(post_delete, sender=TherapistReview)
+def remove_review_rating(sender, instance, **kwargs):
+    RatingAggregateManager.apply_change(getattr(instance, '_previous_contribution', {}), {})
@@ -1,3 +1,355 @@
-from django.test import TestCase
+from datetime import date, time, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from clients.models import ClientProfile, ClientConcern
+from sessions.calendar_models import AvailabilitySlot
+from sessions.models import TherapySession, SessionFeedback
+from sessions.test_helpers import create_client, create_therapist
+from therapy_management.availability_import import AvailabilityImporter
+from therapy_management.matching import MatchingEngine, time_preferences
+from therapy_management.rating_aggregates import RatingAggregateManager
+from therapy_management.therapist_dashboard import TherapistDashboard
+from therapy_management.therapist_search import TherapistSearchIndex
+from .models import (
+    TherapistReview, TherapistRatingAggregate, TherapistAvailability, TherapyCategory
+)
+
+User = get_user_model()
+
+
+class RatingAggregateTest(TestCase):
+
+    def setUp(self):
+        self.therapist = create_therapist()
+        self.clients = [
+            User.objects.create_user(username=f'client{i}', password='pass', user_type='client')
+            for i in range(3)
+        ]
+
+    def aggregate(self):
+        return TherapistRatingAggregate.objects.get(therapist=self.therapist)
+
+    def test_reviews_count_once_approved(self):
+        first = TherapistReview.objects.create(therapist=self.therapist, client=self.clients[0], rating=5)
+        second = TherapistReview.objects.create(therapist=self.therapist, client=self.clients[1], rating=2)
+        self.therapist.refresh_from_db()
+        self.assertEqual((self.therapist.total_reviews, self.therapist.average_rating), (0, Decimal('0.00')))
+
+        first.is_approved = True
+        first.save()
+        RatingAggregateManager.set_review_approval(TherapistReview.objects.all(), True)
+        self.therapist.refresh_from_db()
+        self.assertEqual((self.therapist.total_reviews, self.therapist.average_rating), (2, Decimal('3.50')))
+
+        second.delete()
+        self.therapist.refresh_from_db()
+        self.assertEqual((self.therapist.total_reviews, self.therapist.average_rating), (1, Decimal('5.00')))
+
+        RatingAggregateManager.set_review_approval(TherapistReview.objects.all(), False)
+        self.therapist.refresh_from_db()
+        self.assertEqual((self.therapist.total_reviews, self.therapist.average_rating), (0, Decimal('0.00')))
+
+    def test_client_feedback_rolls_up_per_dimension(self):
+        client_profile = ClientProfile.objects.create(user=self.clients[0])
+        sessions = [
+            TherapySession.objects.create(
+                client=client_profile,
+                therapist=self.therapist,
+                scheduled_date=date(2030, 1, day),
+                scheduled_time=time(10, 0)
+            )
+            for day in (1, 2)
+        ]
+        SessionFeedback.objects.create(
+            session=sessions[0], feedback_type='client', overall_rating=4, session_quality=5, technical_quality=2
+        )
+        SessionFeedback.objects.create(session=sessions[1], feedback_type='client', overall_rating=3)
+        # Therapists rating their own sessions don't count
+        SessionFeedback.objects.create(session=sessions[1], feedback_type='therapist', overall_rating=1)
+
+        aggregate = self.aggregate()
+        self.assertEqual(aggregate.average('overall'), Decimal('3.50'))
+        self.assertEqual(aggregate.average('session_quality'), Decimal('5.00'))
+        self.assertEqual(aggregate.average('technical_quality'), Decimal('2.00'))
+        self.assertIsNone(aggregate.average('review'))
+
+    def test_reconcile_repairs_writes_that_bypass_signals(self):
+        TherapistReview.objects.create(therapist=self.therapist, client=self.clients[0], rating=4, is_approved=True)
+        TherapistReview.objects.filter(therapist=self.therapist).update(rating=2)
+        TherapistRatingAggregate.objects.filter(therapist=self.therapist).update(overall_count=7)
+
+        self.assertEqual(RatingAggregateManager.reconcile(), {'created': 0, 'updated': 1, 'profiles': 1})
+
+        aggregate = self.aggregate()
+        self.assertEqual((aggregate.review_count, aggregate.review_sum, aggregate.overall_count), (1, 2, 0))
+        self.therapist.refresh_from_db()
+        self.assertEqual(self.therapist.average_rating, Decimal('2.00'))
+        self.assertEqual(RatingAggregateManager.reconcile(), {'created': 0, 'updated': 0, 'profiles': 0})
+
+
+class TherapistDashboardTest(TestCase):
+
+    def setUp(self):
+        self.therapist = create_therapist()
+        self.session = TherapySession.objects.create(
+            client=create_client(),
+            therapist=self.therapist,
+            scheduled_date=timezone.now().date(),
+            scheduled_time=time(23, 59),
+            status='confirmed'
+        )
+        # Don't pick up snapshots cached by an earlier run for the same id
+        TherapistDashboard.bump([self.therapist.pk])
+
+    def test_snapshot_is_served_from_cache_until_a_session_changes(self):
+        with self.assertNumQueries(3):
+            dashboard = TherapistDashboard.get(self.therapist.pk)
+        self.assertEqual(len(dashboard['today_schedule']), 1)
+        self.assertEqual(dashboard['weekly_stats']['sessions_scheduled'], 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(TherapistDashboard.get(self.therapist.pk), dashboard)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.session.status = 'cancelled'
+            self.session.save()
+
+        dashboard = TherapistDashboard.get(self.therapist.pk)
+        self.assertEqual(dashboard['today_schedule'], [])
+        self.assertEqual(dashboard['weekly_stats']['sessions_scheduled'], 0)
+
+
+class AvailabilityImportTest(TestCase):
+
+    def setUp(self):
+        self.therapist = create_therapist()
+        self.existing = TherapistAvailability.objects.create(
+            therapist=self.therapist, day_of_week=0, start_time=time(9, 0), end_time=time(12, 0)
+        )
+
+    def test_batch_with_conflicts_reports_all_and_creates_nothing(self):
+        slots = [
+            {'day_of_week': 0, 'start_time': '11:00', 'end_time': '13:00'},  # overlaps the existing rule
+            {'day_of_week': 1, 'start_time': '09:00', 'end_time': '12:00'},
+            {'day_of_week': 1, 'start_time': '11:30', 'end_time': '14:00'},  # overlaps the previous entry
+            {'day_of_week': 2, 'start_time': '10:00', 'end_time': '09:00'},
+        ]
+        created, errors = AvailabilityImporter.import_rules(self.therapist, slots)
+        self.assertEqual(created, [])
+        self.assertEqual([error['index'] for error in errors], [3])
+
+        del slots[3]
+        created, errors = AvailabilityImporter.import_rules(self.therapist, slots)
+        self.assertEqual(created, [])
+        self.assertEqual(errors, [
+            {'index': 0, 'errors': {'non_field_errors': [f'Overlaps existing slot {self.existing.pk}']}},
+            {'index': 1, 'errors': {'non_field_errors': ['Overlaps slot 2']}},
+            {'index': 2, 'errors': {'non_field_errors': ['Overlaps slot 1']}},
+        ])
+        self.assertEqual(TherapistAvailability.objects.count(), 1)
+
+    def test_valid_batch_is_created_in_one_go(self):
+        slots = [
+            {'day_of_week': day, 'start_time': f'{hour:02d}:00', 'end_time': f'{hour:02d}:50'}
+            for day in range(1, 6) for hour in range(9, 17)
+        ]
+        # Touching the existing rule is not an overlap
+        slots.append({'day_of_week': 0, 'start_time': '12:00', 'end_time': '13:00'})
+
+        created, errors = AvailabilityImporter.import_rules(self.therapist, slots)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(created), 41)
+        self.assertEqual(TherapistAvailability.objects.count(), 42)
+
+    def test_recurring_slots_are_checked_on_every_date(self):
+        day = timezone.localdate() + timedelta(days=7)
+        one_off = AvailabilitySlot.objects.create(
+            therapist=self.therapist, date=day + timedelta(weeks=2), start_time=time(10, 0), end_time=time(11, 0)
+        )
+        rule = AvailabilitySlot.objects.create(
+            therapist=self.therapist, date=day + timedelta(weeks=5), start_time=time(10, 0), end_time=time(11, 0),
+            is_recurring=True, recurrence_type='weekly'
+        )
+        slots = [
+            # Free on its first date, clashes two and five weeks later
+            {'date': day.isoformat(), 'start_time': '10:30', 'end_time': '11:30',
+             'is_recurring': True, 'recurrence_type': 'weekly'},
+            # Ends before the one-off slot
+            {'date': (day + timedelta(days=1)).isoformat(), 'start_time': '10:00', 'end_time': '11:00',
+             'is_recurring': True, 'recurrence_type': 'weekly',
+             'recurrence_end_date': (day + timedelta(days=8)).isoformat()},
+        ]
+
+        created, errors = AvailabilityImporter.import_slots(self.therapist, slots)
+        self.assertEqual(created, [])
+        self.assertEqual([error['index'] for error in errors], [0])
+        self.assertCountEqual(errors[0]['errors']['non_field_errors'], [
+            f'Overlaps existing slot {one_off.pk}', f'Overlaps existing slot {rule.pk}'
+        ])
+
+        created, errors = AvailabilityImporter.import_slots(self.therapist, slots[1:])
+        self.assertEqual((len(created), errors), (1, []))
+
+    def test_serializer_errors_in_either_drf_shape(self):
+        expected = [{'index': 2, 'errors': {'start_time': ['Invalid']}}]
+        self.assertEqual(AvailabilityImporter._item_errors([{}, {}, {'start_time': ['Invalid']}]), expected)
+        self.assertEqual(AvailabilityImporter._item_errors({2: {'start_time': ['Invalid']}}), expected)
+
+
+class TherapistSearchTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        TherapistSearchIndex._snapshot = (None, None)
+        self.addCleanup(setattr, TherapistSearchIndex, '_snapshot', (None, None))
+        self.anxiety = TherapyCategory.objects.create(name='Anxiety')
+        self.depression = TherapyCategory.objects.create(name='Depression')
+        self.asha = self.create_therapist('asha', 'Asha', 'Rao', 'English, Hindi', 800, [self.anxiety])
+        self.ravi = self.create_therapist('ravi', 'Ravi', 'Kumar', 'English', 2500, [self.depression])
+
+    def create_therapist(self, username, first_name, last_name, languages, fee, categories):
+        therapist = create_therapist(
+            username, first_name, last_name,
+            bio='Talk therapy', languages_spoken=languages, consultation_fee=fee, approval_status='approved'
+        )
+        therapist.specializations.set(categories)
+        return therapist
+
+    def ids(self, query, **filters):
+        return [result['id'] for result in TherapistSearchIndex.search(query, **filters)['results']]
+
+    def test_typos_and_prefixes_match(self):
+        self.assertEqual(self.ids('anxeity'), [self.asha.pk])
+        self.assertEqual(self.ids('talk depr'), [self.ravi.pk])
+        self.assertEqual(self.ids('hindi'), [self.asha.pk])
+        self.assertEqual(self.ids('kum'), [self.ravi.pk])
+        # Three letters must match exactly, or as a prefix
+        self.assertEqual(self.ids('rai'), [])
+
+    def test_facets_cover_every_match(self):
+        response = TherapistSearchIndex.search('talk', limit=1, max_fee=3000)
+        self.assertEqual((response['count'], len(response['results'])), (2, 1))
+        facets = response['facets']
+        self.assertEqual(
+            [(entry['name'], entry['count']) for entry in facets['categories']],
+            [('Anxiety', 1), ('Depression', 1)]
+        )
+        self.assertEqual(facets['languages'], [
+            {'language': 'English', 'count': 2}, {'language': 'Hindi', 'count': 1}
+        ])
+        self.assertEqual(facets['fee_bands'], [
+            {'band': '500-1000', 'count': 1}, {'band': '2000-5000', 'count': 1}
+        ])
+        self.assertEqual(self.ids('', category_id=self.anxiety.pk, language='hindi'), [self.asha.pk])
+
+    def test_changes_are_replayed_into_a_new_snapshot(self):
+        self.assertEqual(len(self.ids('')), 2)
+        index, version = TherapistSearchIndex._snapshot
+
+        self.ravi.bio = 'Mindfulness coaching'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ravi.save()
+            self.asha.approval_status = 'suspended'
+            self.asha.save()
+
+        with self.assertNumQueries(3):
+            self.assertEqual(self.ids('mindful'), [self.ravi.pk])
+        self.assertEqual(self.ids('asha'), [])
+        self.assertEqual(TherapistSearchIndex._snapshot[1], version + 2)
+        # Readers of the old snapshot are unaffected
+        self.assertEqual(set(index.documents), {self.asha.pk, self.ravi.pk})
+        self.assertIn('talk', index.documents[self.ravi.pk]['tokens'])
+
+
+class TimePreferencesTest(SimpleTestCase):
+
+    def test_names_ranges_and_lists_weigh_day_parts(self):
+        self.assertEqual(time_preferences('Morning').tolist(), [1, 0, 0, 0])
+        self.assertEqual(time_preferences('18:00-20:00').tolist(), [0, 0, 1, 0])
+        self.assertEqual(time_preferences('', ['morning', '21:00 - 24:00']).tolist(), [0.5, 0, 0, 0.5])
+        # A range across two day parts counts the share of each part it covers
+        morning, afternoon, evening, night = time_preferences('16:00-18:00').tolist()
+        self.assertEqual((morning, night), (0, 0))
+        self.assertAlmostEqual(evening / afternoon, (60 / 240) / (60 / 300))
+        self.assertEqual(time_preferences(None, []).tolist(), [0.25, 0.25, 0.25, 0.25])
+
+
+class MatchingEngineTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.reset_engine()
+        self.addCleanup(self.reset_engine)
+        anxiety = TherapyCategory.objects.create(name='Anxiety')
+        depression = TherapyCategory.objects.create(name='Depression')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.asha = create_therapist('asha', languages_spoken='English, Hindi', approval_status='approved')
+            self.asha.specializations.set([anxiety])
+            self.ravi = create_therapist('ravi', approval_status='approved')
+            self.ravi.specializations.set([depression])
+        self.client_profile = create_client()
+
+    def reset_engine(self):
+        MatchingEngine._features = None
+        MatchingEngine._version = None
+
+    def ranking(self):
+        return [match['therapist_id'] for match in MatchingEngine.top_matches(self.client_profile)]
+
+    def test_ranks_by_concern(self):
+        ClientConcern.objects.create(client=self.client_profile, category='depression', description='Low mood')
+        self.assertEqual(self.ranking(), [self.ravi.pk, self.asha.pk])
+
+        # Resolved concerns no longer count
+        ClientConcern.objects.update(is_resolved=True)
+        ClientConcern.objects.create(
+            client=self.client_profile, category='anxiety', description='Panic', priority='urgent'
+        )
+        self.assertEqual(self.ranking(), [self.asha.pk, self.ravi.pk])
+
+    def test_ranks_by_language(self):
+        self.client_profile.preferred_language = 'Hindi'
+        self.assertEqual(self.ranking(), [self.asha.pk, self.ravi.pk])
+
+    def test_ranks_by_free_capacity_in_preferred_day_parts(self):
+        for day_of_week in range(7):
+            TherapistAvailability.objects.create(
+                therapist=self.ravi, day_of_week=day_of_week, start_time=time(9, 0), end_time=time(12, 0)
+            )
+            TherapistAvailability.objects.create(
+                therapist=self.asha, day_of_week=day_of_week, start_time=time(18, 0), end_time=time(20, 0)
+            )
+        self.client_profile.preferred_session_time = 'morning'
+        self.assertEqual(self.ranking(), [self.ravi.pk, self.asha.pk])
+        self.reset_engine()
+        self.client_profile.preferred_session_time = 'evening'
+        self.assertEqual(self.ranking(), [self.asha.pk, self.ravi.pk])
+
+    def test_therapist_no_longer_approved_is_deactivated_in_place(self):
+        self.ranking()
+        features = MatchingEngine._features
+
+        self.asha.approval_status = 'suspended'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.asha.save()
+
+        self.assertEqual(self.ranking(), [self.ravi.pk])
+        self.assertIs(MatchingEngine._features, features)
+
+    def test_new_language_rebuilds_the_features(self):
+        self.ranking()
+        features = MatchingEngine._features
+
+        self.ravi.languages_spoken = 'English, Tamil'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ravi.save()
+
+        self.client_profile.preferred_language = 'Tamil'
+        self.assertEqual(self.ranking(), [self.ravi.pk, self.asha.pk])
+        self.assertIsNot(MatchingEngine._features, features)
+        self.assertIn('tamil', MatchingEngine._features.language_column)
@@ -19,6 +19,9 @@ import json
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
+from therapy_management.availability_import import AvailabilityImporter
+from therapy_management.therapist_dashboard import TherapistDashboard
+from therapy_management.therapist_search import TherapistSearchIndex
 from .models import (
     TherapistProfile, TherapyCategory, Competency, TherapistCompetency,
     TherapistDocument, TherapistAvailability, TherapistReview
@@ -103,49 +106,9 @@ class TherapistDashboardView(LoginRequiredMixin, APIView):
         except TherapistProfile.DoesNotExist:
             return Response({'error': 'Therapist profile not found'}, status=404)
 
-        # Get today's sessions
-        today = timezone.now().date()
-        today_sessions = therapist.sessions.filter(
-            scheduled_date=today,
-            status__in=['scheduled', 'confirmed', 'in_progress']
-        ).order_by('scheduled_time')
-
-        # Get weekly stats
-        week_start = today - timedelta(days=today.weekday())
-        week_end = week_start + timedelta(days=6)
-        
-        weekly_sessions = therapist.sessions.filter(
-            scheduled_date__range=[week_start, week_end]
-        )
-
-        dashboard_data = {
-            'profile': {
-                'name': therapist.user.get_full_name(),
-                'license_number': therapist.license_number,
-                'approval_status': therapist.approval_status,
-                'specializations': [spec.name for spec in therapist.specializations.all()],
-                'average_rating': float(therapist.average_rating),
-                'total_reviews': therapist.total_reviews,
-                'total_sessions': therapist.total_sessions,
-            },
-            'today_schedule': [{
-                'id': session.session_id,
-                'client_name': session.client.user.get_full_name(),
-                'time': session.scheduled_time.strftime('%H:%M'),
-                'duration': session.duration_minutes,
-                'type': session.session_type,
-                'status': session.status,
-                'meeting_link': session.meeting_link,
-                'can_join': session.can_join(),
-            } for session in today_sessions],
-            'weekly_stats': {
-                'sessions_completed': weekly_sessions.filter(status='completed').count(),
-                'sessions_scheduled': weekly_sessions.filter(status__in=['scheduled', 'confirmed']).count(),
-                'average_rating': float(therapist.average_rating),
-                'clients_seen': weekly_sessions.values('client').distinct().count(),
-                'no_shows': weekly_sessions.filter(status='no_show').count(),
-            }
-        }
+        dashboard_data = TherapistDashboard.get(therapist.pk)
+        if dashboard_data is None:
+            return Response({'error': 'Therapist profile not found'}, status=404)
 
         return Response(dashboard_data)
 
@@ -204,20 +167,15 @@ class TherapistAvailabilityView(LoginRequiredMixin, APIView):
             return Response({'error': 'Therapist profile not found'}, status=404)
 
     def post(self, request):
-        """Create or update availability slots"""
+        """Create availability slots; either the whole batch is created or none of it"""
         try:
             therapist = request.user.therapist_profile
-            slots_data = request.data.get('slots', [])
-            
-            created_slots = []
-            for slot_data in slots_data:
-                slot_data['therapist'] = therapist.id
-                serializer = TherapistAvailabilitySerializer(data=slot_data)
-                if serializer.is_valid():
-                    slot = serializer.save()
-                    created_slots.append(slot)
-                else:
-                    return Response(serializer.errors, status=400)
+            created_slots, errors = AvailabilityImporter.import_rules(therapist, request.data.get('slots', []))
+            if errors:
+                return Response({
+                    'error': 'No availability slots were created',
+                    'errors': errors
+                }, status=400)
             
             return Response({
                 'message': f'{len(created_slots)} availability slots created',
@@ -518,45 +476,30 @@ class CompetencyListView(generics.ListAPIView):
 
 # Search and filter views
 @api_view(['GET'])
+@permission_classes([permissions.AllowAny])
 def therapist_search(request):
     """
-    Search therapists by name, specialization, or competency
+    Search therapists by name, bio, specialization, competency or language.
+    Typo-tolerant, prefix-matches the last word, and returns facet counts.
+
+    Query params: q, category, language, min_fee, max_fee, min_rating,
+    limit (default 20, max 100), offset.
     """
     query = request.GET.get('q', '')
-    category_id = request.GET.get('category')
-    
-    therapists = TherapistProfile.objects.filter(
-        approval_status='approved',
-        is_available=True
-    )
-    
-    if query:
-        therapists = therapists.filter(
-            user__first_name__icontains=query
-        ) | therapists.filter(
-            user__last_name__icontains=query
-        ) | therapists.filter(
-            specializations__name__icontains=query
-        )
-    
-    if category_id:
-        therapists = therapists.filter(specializations__id=category_id)
-    
-    therapists_data = []
-    for therapist in therapists.distinct():
-        therapists_data.append({
-            'id': therapist.id,
-            'name': therapist.user.get_full_name(),
-            'license_number': therapist.license_number,
-            'specializations': [spec.name for spec in therapist.specializations.all()],
-            'bio': therapist.bio,
-            'average_rating': float(therapist.average_rating),
-            'total_reviews': therapist.total_reviews,
-            'consultation_fee': float(therapist.consultation_fee),
-            'languages_spoken': therapist.languages_spoken,
-        })
+    try:
+        filters = {
+            'category_id': int(request.GET['category']) if request.GET.get('category') else None,
+            'language': request.GET.get('language') or None,
+            'min_fee': float(request.GET['min_fee']) if request.GET.get('min_fee') else None,
+            'max_fee': float(request.GET['max_fee']) if request.GET.get('max_fee') else None,
+            'min_rating': float(request.GET['min_rating']) if request.GET.get('min_rating') else None,
+        }
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+        offset = max(int(request.GET.get('offset', 0)), 0)
+    except ValueError:
+        return Response({'error': 'Invalid filter value'}, status=status.HTTP_400_BAD_REQUEST)
     
-    return Response(therapists_data)
+    return Response(TherapistSearchIndex.search(query, limit=limit, offset=offset, **filters))
 
 
 @api_view(['GET'])
@@ -625,7 +568,8 @@ def create_review(request):
     if existing_review:
         return Response({'error': 'You have already reviewed this therapist'}, status=400)
     
-    review = TherapistReview.objects.create(
+    # The rating counts towards average_rating once the review is approved
+    TherapistReview.objects.create(
         therapist=therapist,
         client=request.user,
         rating=rating,
@@ -633,13 +577,6 @@ def create_review(request):
         is_anonymous=is_anonymous
     )
     
-    # Update therapist's average rating
-    reviews = TherapistReview.objects.filter(therapist=therapist, is_approved=True)
-    avg_rating = sum(r.rating for r in reviews) / len(reviews)
-    therapist.average_rating = avg_rating
-    therapist.total_reviews = len(reviews)
-    therapist.save()
-    
     return Response({'message': 'Review created successfully'})
 
 
@@ -0,0 +1,187 @@
+# Write-behind Activity Tracking
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+from accounts.models import User, UserSession
+
+logger = logging.getLogger(__name__)
+
+USER_BUFFER = 'activity_users'
+SESSION_BUFFER = 'activity_sessions'
+MAX_LOCAL_ENTRIES = 10000
+
+
+class ActivityTracker:
+    """
+    Records User.last_activity and UserSession.last_activity off the
+    request path.
+
+    Requests only write to Redis hashes keyed by user id and by session,
+    so repeated hits overwrite each other, and each process skips even that
+    write when it already recorded the same user and session within
+    ACTIVITY_TRACKING_RESOLUTION seconds. The flush_activity task drains the
+    hashes and writes them back with batched UPDATEs, creating UserSession
+    rows for sessions seen for the first time.
+
+    A session is the Django session for session logins, or a SHA-1 of the
+    DRF token or JWT id, so no credential is stored as a session key.
+    """
+
+    _recent = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def resolution():
+        return getattr(settings, 'ACTIVITY_TRACKING_RESOLUTION', 60)
+
+    @staticmethod
+    def batch_size():
+        return getattr(settings, 'ACTIVITY_FLUSH_BATCH_SIZE', 1000)
+
+    @staticmethod
+    def session_key(request):
+        auth = getattr(request, 'auth', None)
+        if auth is not None:
+            token_key = getattr(auth, 'key', None)
+            if token_key is None and hasattr(auth, 'get'):
+                token_key = auth.get('jti')
+            if token_key:
+                return hashlib.sha1(str(token_key).encode()).hexdigest()
+        session = getattr(request, 'session', None)
+        return session.session_key if session is not None else None
+
+    @staticmethod
+    def record(request, user):
+        session_key = ActivityTracker.session_key(request)
+        now = time.time()
+
+        # Coalesce in-process first so most requests never reach Redis
+        marker = (user.pk, session_key)
+        with ActivityTracker._lock:
+            last = ActivityTracker._recent.get(marker)
+            if last is not None and now - last < ActivityTracker.resolution():
+                return
+            if len(ActivityTracker._recent) >= MAX_LOCAL_ENTRIES:
+                ActivityTracker._recent.clear()
+            ActivityTracker._recent[marker] = now
+
+        redis = get_redis_connection('default')
+        pipe = redis.pipeline(transaction=False)
+        pipe.hset(cache.make_key(USER_BUFFER), user.pk, now)
+        if session_key:
+            pipe.hset(cache.make_key(SESSION_BUFFER), session_key, json.dumps({
+                'user_id': user.pk,
+                'at': now,
+                'ip_address': request.META.get('REMOTE_ADDR') or '0.0.0.0',
+                'user_agent': request.META.get('HTTP_USER_AGENT', ''),
+            }))
+        pipe.execute()
+
+    @staticmethod
+    def _drain(name):
+        """
+        Move a buffer aside and return (processing_key, entries). A buffer
+        left aside by a flush that died is picked up again first.
+        """
+        redis = get_redis_connection('default')
+        key = cache.make_key(name)
+        processing = cache.make_key(f'{name}_flushing')
+        try:
+            redis.renamenx(key, processing)
+        except ResponseError:
+            # Nothing buffered since the last flush
+            pass
+        entries = {
+            field.decode(): value.decode()
+            for field, value in redis.hgetall(processing).items()
+        }
+        return processing, entries
+
+    @staticmethod
+    def _timestamp(value):
+        return datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+
+    @staticmethod
+    def flush():
+        """Write buffered activity to the database. Returns the rows written."""
+        redis = get_redis_connection('default')
+        batch_size = ActivityTracker.batch_size()
+
+        processing, entries = ActivityTracker._drain(USER_BUFFER)
+        users = [
+            User(id=int(user_id), last_activity=ActivityTracker._timestamp(at))
+            for user_id, at in entries.items()
+        ]
+        with transaction.atomic():
+            User.objects.bulk_update(users, ['last_activity'], batch_size=batch_size)
+        redis.delete(processing)
+
+        processing, entries = ActivityTracker._drain(SESSION_BUFFER)
+        sessions = {key: json.loads(value) for key, value in entries.items()}
+        existing = dict(UserSession.objects.filter(
+            session_key__in=list(sessions)
+        ).values_list('session_key', 'id'))
+        live_users = set(User.objects.filter(
+            id__in={session['user_id'] for key, session in sessions.items() if key not in existing}
+        ).values_list('id', flat=True))
+
+        to_update = []
+        to_create = []
+        for key, session in sessions.items():
+            at = ActivityTracker._timestamp(session['at'])
+            if key in existing:
+                to_update.append(UserSession(id=existing[key], last_activity=at))
+            elif session['user_id'] in live_users:
+                to_create.append(UserSession(
+                    user_id=session['user_id'],
+                    session_key=key,
+                    ip_address=session['ip_address'],
+                    user_agent=session['user_agent'],
+                    last_activity=at
+                ))
+        with transaction.atomic():
+            UserSession.objects.bulk_update(to_update, ['last_activity'], batch_size=batch_size)
+            UserSession.objects.bulk_create(to_create, batch_size=batch_size, ignore_conflicts=True)
+        redis.delete(processing)
+
+        return {'users': len(users), 'sessions': len(to_update) + len(to_create)}
+
+
+class ActivityTrackingMiddleware:
+    """
+    Buffer activity for authenticated requests. Runs after the view so
+    users authenticated by DRF (token, JWT) are seen too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            try:
+                ActivityTracker.record(request, user)
+            except Exception as e:
+                # Activity tracking must never fail a request
+                logger.warning(f"Activity tracking error: {e}")
+        return response
+
+
+# Celery tasks
+@shared_task
+def flush_activity():
+    """
+    Periodic task to write buffered activity to users and sessions
+    """
+    return ActivityTracker.flush()
@@ -0,0 +1,293 @@
+# Free-slot Availability Engine
+import heapq
+from collections import defaultdict
+from datetime import datetime, timedelta, time
+from django.db.models import Q
+
+from sessions.models import TherapySession
+from sessions.calendar_models import TherapistCalendar, CalendarEvent
+from therapists.models import TherapistProfile, TherapistAvailability
+from .intervals import day_span, event_intervals
+from .recurrence import RecurringAvailability
+
+
+MINUTES_PER_DAY = 24 * 60
+BOOKED_STATUSES = ['scheduled', 'confirmed', 'in_progress']
+
+
+def _to_minutes(value):
+    """Minutes since midnight for a time object"""
+    return value.hour * 60 + value.minute
+
+
+def _from_minutes(minutes):
+    """Time object for a number of minutes since midnight"""
+    return time(minutes // 60, minutes % 60)
+
+
+def merge_intervals(intervals):
+    """
+    Merge overlapping or touching (start, end) intervals.
+    Returns a sorted list of disjoint intervals.
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def subtract_intervals(windows, busy):
+    """
+    Subtract busy intervals from availability windows.
+    Both inputs must be sorted and disjoint (see merge_intervals); the sweep
+    is linear in the combined number of intervals.
+    """
+    free = []
+    j = 0
+    for start, end in windows:
+        cursor = start
+        while j < len(busy) and busy[j][1] <= cursor:
+            j += 1
+        k = j
+        while k < len(busy) and busy[k][0] < end:
+            busy_start, busy_end = busy[k]
+            if busy_start > cursor:
+                free.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+            if cursor >= end:
+                break
+            k += 1
+        if cursor < end:
+            free.append((cursor, end))
+    return free
+
+
+def find_overlaps(intervals):
+    """
+    Every pair of overlapping intervals among ``(key, start, end, ref)``
+    tuples with the same key, as ``(ref, ref)`` pairs. One sorted sweep per
+    key with a heap of the intervals still open, so the cost is
+    O(n log n) plus the number of overlaps reported. Touching intervals
+    don't overlap.
+    """
+    by_key = defaultdict(list)
+    for key, start, end, ref in intervals:
+        by_key[key].append((start, end, ref))
+
+    overlaps = []
+    for rows in by_key.values():
+        rows.sort(key=lambda row: (row[0], row[1]))
+        open_intervals = []
+        for seq, (start, end, ref) in enumerate(rows):
+            while open_intervals and open_intervals[0][0] <= start:
+                heapq.heappop(open_intervals)
+            overlaps.extend((other, ref) for _, _, other in open_intervals)
+            heapq.heappush(open_intervals, (end, seq, ref))
+    return overlaps
+
+
+def slot_starts(free, duration, step):
+    """
+    Start minutes of every slot of ``duration`` that fits inside the free
+    intervals, aligned to a ``step``-minute grid from midnight.
+    """
+    starts = []
+    for start, end in free:
+        current = -(-start // step) * step  # round up to the grid
+        while current + duration <= end:
+            starts.append(current)
+            current += step
+    return starts
+
+
+class AvailabilityEngine:
+    """
+    Compute free booking slots for many therapists over a date range.
+
+    All inputs are loaded with a fixed number of queries (therapists, calendar
+    settings, weekly and date-specific availability, bookings, calendar events
+    and blocked slots), grouped per therapist and day in memory, and resolved
+    with sorted interval arithmetic.
+    """
+
+    @staticmethod
+    def get_free_slots(therapist_ids=None, date_from=None, date_to=None,
+                       session_duration=60, step_minutes=30, not_before=None):
+        """
+        Return {therapist_id: {date: [time, ...]}} of free slot start times.
+
+        ``therapist_ids`` defaults to every approved, available therapist.
+        ``not_before`` is an optional naive datetime; earlier slots are dropped.
+        """
+        free_intervals = AvailabilityEngine.get_free_intervals(therapist_ids, date_from, date_to)
+        return AvailabilityEngine.slots_from_intervals(
+            free_intervals, session_duration, step_minutes, not_before
+        )
+
+    @staticmethod
+    def slots_from_intervals(free_intervals, session_duration=60, step_minutes=30, not_before=None):
+        """
+        Turn {therapist_id: {date: [(start, end), ...]}} free intervals into
+        {therapist_id: {date: [time, ...]}} slot start times.
+        """
+        result = {}
+        for therapist_id, days in free_intervals.items():
+            result[therapist_id] = {}
+            for current_date, free in days.items():
+                starts = slot_starts(free, session_duration, step_minutes)
+                if not_before is not None:
+                    if current_date < not_before.date():
+                        starts = []
+                    elif current_date == not_before.date():
+                        cutoff = _to_minutes(not_before.time())
+                        starts = [start for start in starts if start >= cutoff]
+                result[therapist_id][current_date] = [_from_minutes(start) for start in starts]
+        return result
+
+    @staticmethod
+    def get_free_intervals(therapist_ids=None, date_from=None, date_to=None, exclude_session_ids=()):
+        """
+        Return {therapist_id: {date: [(start_minute, end_minute), ...]}} of
+        free time, with every therapist and day in the range present.
+        Sessions in ``exclude_session_ids`` don't count as busy, e.g. the
+        one being rescheduled.
+        """
+        if date_to is None:
+            date_to = date_from
+
+        therapists = TherapistProfile.objects.filter(
+            approval_status='approved',
+            is_available=True
+        ) if therapist_ids is None else TherapistProfile.objects.filter(id__in=therapist_ids)
+        therapist_ids = list(therapists.values_list('id', flat=True))
+        if not therapist_ids:
+            return {}
+
+        data = AvailabilityEngine._load(therapist_ids, date_from, date_to, exclude_session_ids)
+
+        result = {}
+        for therapist_id in therapist_ids:
+            buffer = data['buffers'].get(therapist_id, 0)
+            days = {}
+            current_date = date_from
+            while current_date <= date_to:
+                windows = AvailabilityEngine._windows_for_day(
+                    data['weekly'][therapist_id],
+                    data['specific'][(therapist_id, current_date)],
+                    current_date
+                )
+                if windows:
+                    busy = list(data['busy'][(therapist_id, current_date)])
+                    busy.extend(
+                        (start - buffer, end + buffer)
+                        for start, end in data['bookings'][(therapist_id, current_date)]
+                    )
+                    days[current_date] = subtract_intervals(windows, merge_intervals(busy))
+                else:
+                    days[current_date] = []
+                current_date += timedelta(days=1)
+            result[therapist_id] = days
+
+        return result
+
+    @staticmethod
+    def _windows_for_day(weekly_rows, specific_rows, target_date):
+        """
+        Merged availability windows for a day. Date-specific rows override the
+        weekly schedule; a holiday or unavailable override clears the day.
+        """
+        if specific_rows:
+            if any(row['is_holiday'] or not row['is_available'] for row in specific_rows):
+                return []
+            rows = specific_rows
+        else:
+            rows = [
+                row for row in weekly_rows
+                if row['day_of_week'] == target_date.weekday() and row['is_available']
+            ]
+        return merge_intervals(
+            (_to_minutes(row['start_time']), _to_minutes(row['end_time'])) for row in rows
+        )
+
+    @staticmethod
+    def _load(therapist_ids, date_from, date_to, exclude_session_ids=()):
+        """Load every row the engine needs, grouped by therapist and day"""
+        buffers = dict(
+            TherapistCalendar.objects.filter(
+                therapist_id__in=therapist_ids
+            ).values_list('therapist_id', 'buffer_time_between_sessions')
+        )
+
+        weekly = defaultdict(list)
+        specific = defaultdict(list)
+        availability_rows = TherapistAvailability.objects.filter(
+            Q(specific_date__isnull=True) | Q(specific_date__range=[date_from, date_to]),
+            therapist_id__in=therapist_ids
+        ).values(
+            'therapist_id', 'day_of_week', 'start_time', 'end_time',
+            'is_available', 'is_holiday', 'specific_date'
+        )
+        for row in availability_rows:
+            if row['specific_date'] is None:
+                weekly[row['therapist_id']].append(row)
+            else:
+                specific[(row['therapist_id'], row['specific_date'])].append(row)
+
+        bookings = defaultdict(list)
+        sessions = TherapySession.objects.filter(
+            therapist_id__in=therapist_ids,
+            scheduled_date__range=[date_from - timedelta(days=1), date_to],
+            status__in=BOOKED_STATUSES
+        ).exclude(
+            id__in=exclude_session_ids
+        ).values_list('therapist_id', 'scheduled_date', 'scheduled_time', 'duration_minutes')
+        for therapist_id, session_date, session_time, duration in sessions:
+            start = _to_minutes(session_time)
+            end = start + duration
+            bookings[(therapist_id, session_date)].append((start, end))
+            if end > MINUTES_PER_DAY:
+                # Session runs past midnight into the next day
+                bookings[(therapist_id, session_date + timedelta(days=1))].append(
+                    (0, end - MINUTES_PER_DAY)
+                )
+
+        busy = defaultdict(list)
+        # Blocked slots, including occurrences of recurring blocked slots;
+        # calendar events are added as busy time below
+        slots = RecurringAvailability.load(therapist_ids, date_from, date_to, exceptions=False)
+        for therapist_id, occurrences in slots.items():
+            for slot in occurrences:
+                if slot['status'] == 'blocked':
+                    busy[(therapist_id, slot['date'])].append(
+                        (_to_minutes(slot['start_time']), _to_minutes(slot['end_time']))
+                    )
+
+        events = CalendarEvent.objects.filter(
+            therapist_id__in=therapist_ids,
+            blocks_availability=True,
+            start_date__lte=date_to,
+            end_date__gte=date_from
+        ).values_list('therapist_id', 'start_date', 'end_date', 'is_all_day', 'start_time', 'end_time')
+        for therapist_id, *event in events:
+            for event_start, event_end in event_intervals([event]):
+                for day in day_span(event_start, event_end):
+                    if not date_from <= day <= date_to:
+                        continue
+                    day_start = datetime.combine(day, time.min)
+                    start = max(0, int((event_start - day_start).total_seconds() // 60))
+                    end = min(MINUTES_PER_DAY, int((event_end - day_start).total_seconds() // 60))
+                    busy[(therapist_id, day)].append((start, end))
+
+        return {
+            'buffers': buffers,
+            'weekly': weekly,
+            'specific': specific,
+            'bookings': bookings,
+            'busy': busy,
+        }
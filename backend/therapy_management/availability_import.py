@@ -0,0 +1,234 @@
+# Bulk Availability Import
+from collections import defaultdict
+from datetime import datetime, timedelta
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from sessions.calendar_models import AvailabilitySlot
+from therapists.models import TherapistProfile, TherapistAvailability
+from therapists.serializers import TherapistAvailabilitySerializer
+from .availability import find_overlaps
+from .recurrence import RecurringAvailability, expand, is_rule
+from .slot_index import FreeSlotIndex
+
+MAX_IMPORT_SIZE = 5000
+SLOT_NOTICE_DAYS = 2
+RECURRING_CHECK_DAYS = 366
+RECURRENCE_TYPES = {choice for choice, _ in AvailabilitySlot.RECURRENCE_TYPES}
+
+
+class AvailabilityImporter:
+    """
+    All-or-nothing creation of a batch of availability.
+
+    The batch is parsed and validated in memory. The therapist's existing
+    windows on the affected days are then loaded with one query, and the
+    batch is checked against them and against itself with find_overlaps.
+    Every problem is reported with the index of the entry it concerns, and
+    if there is any, nothing is written. Otherwise the rows go in with a
+    single bulk_create inside a transaction that holds the therapist row
+    locked, so two uploads for the same therapist can't both pass the
+    check. bulk_create skips the per-row signals, so the free-slot index is
+    refreshed once for the whole batch instead.
+    """
+
+    @staticmethod
+    def import_rules(therapist, slots_data):
+        """
+        Create weekly or date-specific TherapistAvailability rows.
+        Returns (created rows, errors); errors is a list of {'index', 'errors'}.
+        """
+        errors = AvailabilityImporter._check_size(slots_data)
+        if errors:
+            return [], errors
+
+        serializer = TherapistAvailabilitySerializer(data=slots_data, many=True)
+        if not serializer.is_valid():
+            return [], AvailabilityImporter._item_errors(serializer.errors)
+        rows = [TherapistAvailability(therapist=therapist, **data) for data in serializer.validated_data]
+        dates = {row.specific_date for row in rows if row.specific_date}
+
+        with transaction.atomic():
+            AvailabilityImporter._lock(therapist)
+            existing = TherapistAvailability.objects.filter(therapist=therapist).filter(
+                Q(specific_date__isnull=True) | Q(specific_date__in=dates)
+            ).values_list('id', 'day_of_week', 'specific_date', 'start_time', 'end_time')
+
+            # Same rule as the per-slot check this replaces: rows clash when
+            # they share day_of_week and specific_date and their times overlap
+            intervals = [
+                ((day_of_week, specific_date), start_time, end_time, ('existing', row_id))
+                for row_id, day_of_week, specific_date, start_time, end_time in existing
+            ]
+            intervals.extend(
+                ((row.day_of_week, row.specific_date), row.start_time, row.end_time, ('new', index))
+                for index, row in enumerate(rows)
+            )
+            errors = AvailabilityImporter._conflicts(find_overlaps(intervals))
+            if errors:
+                return [], errors
+
+            TherapistAvailability.objects.bulk_create(rows)
+            # A weekly rule touches every indexed week
+            days = None if any(row.specific_date is None for row in rows) else dates
+            transaction.on_commit(lambda: FreeSlotIndex.refresh(therapist.pk, days))
+
+        return rows, []
+
+    @staticmethod
+    def import_slots(therapist, slots_data):
+        """
+        Create one-off AvailabilitySlot rows, at least SLOT_NOTICE_DAYS ahead.
+        Returns (created rows, errors); errors is a list of {'index', 'errors'}.
+        """
+        errors = AvailabilityImporter._check_size(slots_data)
+        if errors:
+            return [], errors
+
+        earliest = timezone.now().date() + timedelta(days=SLOT_NOTICE_DAYS + 1)
+        rows = []
+        for index, slot_data in enumerate(slots_data):
+            slot, slot_errors = AvailabilityImporter._parse_slot(slot_data, earliest)
+            if slot_errors:
+                errors.append({'index': index, 'errors': slot_errors})
+            else:
+                rows.append(AvailabilitySlot(therapist=therapist, status='available', **slot))
+        if errors:
+            return [], errors
+        dates = {row.date for row in rows}
+        # Recurring slots are checked on every date of the series; open-ended
+        # ones for RECURRING_CHECK_DAYS
+        new_slots = [
+            {
+                'id': index, 'date': row.date, 'start_time': row.start_time, 'end_time': row.end_time,
+                'is_recurring': row.is_recurring, 'recurrence_type': row.recurrence_type,
+                'recurrence_end_date': row.recurrence_end_date or row.date + timedelta(days=RECURRING_CHECK_DAYS),
+            }
+            for index, row in enumerate(rows)
+        ]
+        date_from = min(dates)
+        date_to = max(slot['recurrence_end_date'] if is_rule(slot) else slot['date'] for slot in new_slots)
+
+        with transaction.atomic():
+            AvailabilityImporter._lock(therapist)
+            # Existing slots, with recurring ones expanded the same way
+            existing = RecurringAvailability.load(
+                [therapist.pk], date_from, date_to, exceptions=False
+            ).get(therapist.pk, [])
+
+            intervals = [
+                (slot['date'], slot['start_time'], slot['end_time'], ('existing', slot['id']))
+                for slot in existing
+            ]
+            intervals.extend(
+                (slot['date'], slot['start_time'], slot['end_time'], ('new', slot['id']))
+                for slot in expand(new_slots, date_from, date_to)
+            )
+            errors = AvailabilityImporter._conflicts(find_overlaps(intervals))
+            if errors:
+                return [], errors
+
+            AvailabilitySlot.objects.bulk_create(rows)
+            # A recurring slot can touch every indexed day
+            recurring = any(row.is_recurring and row.recurrence_type != 'none' for row in rows)
+            days = None if recurring else dates
+            transaction.on_commit(lambda: FreeSlotIndex.refresh(therapist.pk, days))
+            RecurringAvailability.invalidate([therapist.pk])
+
+        return rows, []
+
+    @staticmethod
+    def _check_size(slots_data):
+        if not isinstance(slots_data, list):
+            return [{'index': None, 'errors': {'slots': ['Expected a list of slots']}}]
+        if len(slots_data) > MAX_IMPORT_SIZE:
+            return [{'index': None, 'errors': {'slots': [f'At most {MAX_IMPORT_SIZE} slots per request']}}]
+        return []
+
+    @staticmethod
+    def _item_errors(errors):
+        """
+        {'index', 'errors'} for every invalid entry. ListSerializer reports
+        a list with one entry per item or a dict keyed by index, depending
+        on the DRF version; anything else concerns the whole batch.
+        """
+        if isinstance(errors, dict):
+            items = errors.items()
+        else:
+            items = enumerate(errors)
+        result = []
+        for index, item_errors in items:
+            if not item_errors:
+                continue
+            if isinstance(index, int) or str(index).isdigit():
+                result.append({'index': int(index), 'errors': item_errors})
+            else:
+                result.append({'index': None, 'errors': {index: item_errors}})
+        return sorted(result, key=lambda error: -1 if error['index'] is None else error['index'])
+
+    @staticmethod
+    def _lock(therapist):
+        """Serialize imports for one therapist until the transaction ends"""
+        list(TherapistProfile.objects.select_for_update().filter(pk=therapist.pk).values_list('id', flat=True))
+
+    @staticmethod
+    def _parse_slot(slot_data, earliest):
+        """(AvailabilitySlot fields, errors) for one entry of an import"""
+        errors = {}
+        slot = {}
+        if not isinstance(slot_data, dict):
+            return None, {'non_field_errors': ['Expected an object']}
+
+        try:
+            slot['date'] = datetime.strptime(str(slot_data.get('date')), '%Y-%m-%d').date()
+            if slot['date'] < earliest:
+                errors['date'] = [f'Cannot create slots with less than {SLOT_NOTICE_DAYS} days advance notice']
+        except ValueError:
+            errors['date'] = ['Expected YYYY-MM-DD']
+        for field in ('start_time', 'end_time'):
+            try:
+                slot[field] = datetime.strptime(str(slot_data.get(field)), '%H:%M').time()
+            except ValueError:
+                errors[field] = ['Expected HH:MM']
+        if 'start_time' in slot and 'end_time' in slot and slot['start_time'] >= slot['end_time']:
+            errors['non_field_errors'] = ['Start time must be before end time']
+
+        try:
+            slot['duration_minutes'] = int(slot_data.get('duration_minutes', 60))
+            if slot['duration_minutes'] <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            errors['duration_minutes'] = ['Expected a positive number of minutes']
+        slot['recurrence_type'] = slot_data.get('recurrence_type', 'none')
+        if slot['recurrence_type'] not in RECURRENCE_TYPES:
+            errors['recurrence_type'] = [f"Expected one of {', '.join(sorted(RECURRENCE_TYPES))}"]
+        slot['is_recurring'] = bool(slot_data.get('is_recurring', False))
+        slot['recurrence_end_date'] = None
+        if slot_data.get('recurrence_end_date'):
+            try:
+                slot['recurrence_end_date'] = datetime.strptime(str(slot_data['recurrence_end_date']), '%Y-%m-%d').date()
+                if 'date' in slot and slot['recurrence_end_date'] < slot['date']:
+                    errors['recurrence_end_date'] = ['Must not be before the first date']
+            except ValueError:
+                errors['recurrence_end_date'] = ['Expected YYYY-MM-DD']
+        slot['notes'] = str(slot_data.get('notes', ''))
+
+        return slot, errors
+
+    @staticmethod
+    def _conflicts(overlaps):
+        """{'index', 'errors'} for every new entry involved in an overlap"""
+        messages = defaultdict(list)
+        # Two series clash on many dates; report each pair once
+        for first, second in sorted(set(overlaps)):
+            if first[0] == 'new':
+                other = f'existing slot {second[1]}' if second[0] == 'existing' else f'slot {second[1]}'
+                messages[first[1]].append(f'Overlaps {other}')
+            if second[0] == 'new':
+                other = f'existing slot {first[1]}' if first[0] == 'existing' else f'slot {first[1]}'
+                messages[second[1]].append(f'Overlaps {other}')
+        return [
+            {'index': index, 'errors': {'non_field_errors': messages[index]}}
+            for index in sorted(messages)
+        ]
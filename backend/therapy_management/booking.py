@@ -0,0 +1,407 @@
+# Session Booking Engine
+import hashlib
+import json
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from celery import shared_task
+
+from sessions.models import TherapySession, BookingIdempotencyKey
+from sessions.calendar_models import AvailabilitySlot, TherapistCalendar
+from therapists.models import TherapistProfile
+from clients.models import ClientProfile
+from .availability import AvailabilityEngine, BOOKED_STATUSES, MINUTES_PER_DAY
+from .intervals import day_span
+from .recurrence import RecurringAvailability, occurrence_dates
+from .reminder_queue import ReminderQueueManager
+
+# Same rule as TherapySession.can_be_cancelled
+CANCELLATION_NOTICE_HOURS = 30
+CANCELLABLE_STATUSES = ['scheduled', 'confirmed']
+SESSION_TYPES = {choice for choice, _ in TherapySession.SESSION_TYPES}
+CANCELLATION_REASONS = {choice for choice, _ in TherapySession.CANCELLATION_REASONS}
+
+
+class BookingError(Exception):
+    """A request the booking engine refuses, with the HTTP status to answer it with"""
+
+    def __init__(self, message, status=409):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _lock_key(*parts):
+    """Signed 64-bit advisory lock key for a booking resource"""
+    digest = hashlib.blake2b(':'.join(str(part) for part in ('booking', *parts)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class BookingEngine:
+    """
+    Booking, cancelling and rescheduling of sessions under concurrency.
+
+    Each write runs in one transaction that first takes short locks: a
+    PostgreSQL transaction-level advisory lock per therapist and day the
+    session (plus the therapist's buffer) touches, and one for the client.
+    Keys are taken in a fixed order so two requests can't deadlock. Other
+    databases fall back to locking the therapist and client rows. With the
+    locks held, the therapist's and client's bookings are checked for
+    overlaps and the matching AvailabilitySlot is flipped to booked in the
+    same transaction, so two requests for one slot can't both succeed. A
+    partial unique constraint on TherapySession backs this up in the
+    database. Requests sent with an Idempotency-Key header are recorded in
+    BookingIdempotencyKey together with their response, and a retry gets
+    that response back instead of acting twice.
+    """
+
+    # Idempotency
+
+    @staticmethod
+    def idempotent(user, key, endpoint, payload, action):
+        """
+        Run ``action`` (returning (status, body)) at most once per user and
+        key. A retry with the same key and payload gets the stored
+        response; a concurrent one waits for the first to commit.
+        """
+        if not key:
+            return action()
+        if len(key) > 255:
+            return 400, {'error': 'Idempotency-Key must be at most 255 characters'}
+
+        request_hash = hashlib.sha256(
+            json.dumps([endpoint, payload], sort_keys=True, default=str).encode()
+        ).hexdigest()
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    record = BookingIdempotencyKey.objects.create(
+                        user=user, key=key, endpoint=endpoint, request_hash=request_hash
+                    )
+            except IntegrityError:
+                # Inserting blocks until a request holding the same key
+                # commits, so the stored response is complete here
+                record = BookingIdempotencyKey.objects.get(user=user, key=key)
+                if (record.endpoint, record.request_hash) != (endpoint, request_hash):
+                    return 422, {'error': 'Idempotency-Key was already used for a different request'}
+                return record.response_status, record.response_body
+
+            status_code, body = action()
+            record.response_status = status_code
+            record.response_body = body
+            record.save(update_fields=['response_status', 'response_body'])
+        return status_code, body
+
+    @staticmethod
+    def purge_idempotency_keys(now=None):
+        """Delete recorded keys older than BOOKING_IDEMPOTENCY_KEY_TTL_HOURS"""
+        hours = getattr(settings, 'BOOKING_IDEMPOTENCY_KEY_TTL_HOURS', 24)
+        cutoff = (now or timezone.now()) - timedelta(hours=hours)
+        deleted, _ = BookingIdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+        return deleted
+
+    # Operations
+
+    @staticmethod
+    def book(client, data):
+        """Book a session for ``client``. Returns (status, body)."""
+        try:
+            try:
+                therapist_id = int(data.get('therapist_id'))
+            except (TypeError, ValueError):
+                raise BookingError('therapist_id is required', status=400)
+            session_type = data.get('session_type', 'individual')
+            if session_type not in SESSION_TYPES:
+                raise BookingError(f"session_type must be one of {', '.join(sorted(SESSION_TYPES))}", status=400)
+            if not TherapistProfile.objects.filter(
+                pk=therapist_id, approval_status='approved', is_available=True
+            ).exists():
+                raise BookingError('Therapist not found', status=404)
+
+            session = TherapySession(
+                client=client,
+                therapist_id=therapist_id,
+                session_type=session_type,
+                title=str(data.get('title', ''))[:200],
+                description=str(data.get('description', '')),
+                status='scheduled'
+            )
+            BookingEngine._set_start(session, data, default_duration=settings.DEFAULT_SESSION_DURATION)
+
+            with transaction.atomic():
+                occurrence = BookingEngine._reserve(session)
+                try:
+                    with transaction.atomic():
+                        session.save()
+                except IntegrityError:
+                    raise BookingError('This time is no longer available')
+                BookingEngine._claim_slot(session, occurrence)
+        except BookingError as error:
+            return error.status, {'error': error.message}
+
+        return 201, {'message': 'Session booked successfully', 'session': BookingEngine._session_data(session)}
+
+    @staticmethod
+    def cancel(user, session_id, data):
+        """Cancel a session of ``user`` (its client or therapist). Returns (status, body)."""
+        try:
+            with transaction.atomic():
+                session = BookingEngine._lock_session(user, session_id)
+                is_client = session.client.user_id == user.pk
+                reason = data.get('reason') or ('client_request' if is_client else 'therapist_unavailable')
+                if reason not in CANCELLATION_REASONS:
+                    raise BookingError(f"reason must be one of {', '.join(sorted(CANCELLATION_REASONS))}", status=400)
+                if timezone.now() > ReminderQueueManager.session_start(session) - timedelta(hours=CANCELLATION_NOTICE_HOURS):
+                    raise BookingError(
+                        f'Sessions can only be cancelled up to {CANCELLATION_NOTICE_HOURS} hours in advance', status=400
+                    )
+
+                session.status = 'cancelled'
+                session.cancellation_reason = reason
+                session.cancellation_notes = str(data.get('notes', ''))
+                session.cancelled_by = user
+                session.cancelled_at = timezone.now()
+                session.save()
+                BookingEngine._release_slot(session)
+        except BookingError as error:
+            return error.status, {'error': error.message}
+
+        return 200, {'message': 'Session cancelled successfully', 'session': BookingEngine._session_data(session)}
+
+    @staticmethod
+    def reschedule(user, session_id, data):
+        """Move a session of ``user`` to a new date and time. Returns (status, body)."""
+        try:
+            with transaction.atomic():
+                session = BookingEngine._lock_session(user, session_id)
+                if timezone.now() > ReminderQueueManager.session_start(session) - timedelta(hours=CANCELLATION_NOTICE_HOURS):
+                    raise BookingError(
+                        f'Sessions can only be rescheduled up to {CANCELLATION_NOTICE_HOURS} hours in advance', status=400
+                    )
+
+                BookingEngine._set_start(session, data, default_duration=session.duration_minutes)
+                # Free the old slot first so the session may move within it
+                BookingEngine._release_slot(session)
+                occurrence = BookingEngine._reserve(session)
+                try:
+                    with transaction.atomic():
+                        session.save()
+                except IntegrityError:
+                    raise BookingError('This time is no longer available')
+                BookingEngine._claim_slot(session, occurrence)
+        except BookingError as error:
+            return error.status, {'error': error.message}
+
+        return 200, {'message': 'Session rescheduled successfully', 'session': BookingEngine._session_data(session)}
+
+    # Helpers
+
+    @staticmethod
+    def _set_start(session, data, default_duration):
+        """Validate the requested date, time and duration and set them on ``session``"""
+        try:
+            session.scheduled_date = datetime.strptime(str(data.get('date')), '%Y-%m-%d').date()
+            session.scheduled_time = datetime.strptime(str(data.get('time')), '%H:%M').time()
+        except ValueError:
+            raise BookingError('date (YYYY-MM-DD) and time (HH:MM) are required', status=400)
+        try:
+            session.duration_minutes = int(data.get('duration_minutes', default_duration))
+        except (TypeError, ValueError):
+            raise BookingError('duration_minutes must be a number', status=400)
+        if not 0 < session.duration_minutes <= MINUTES_PER_DAY:
+            raise BookingError('duration_minutes must be between 1 and 1440', status=400)
+
+        now = timezone.now()
+        start = ReminderQueueManager.session_start(session)
+        if start < now + timedelta(hours=settings.MIN_ADVANCE_NOTICE_HOURS):
+            raise BookingError(
+                f'Sessions must be booked at least {settings.MIN_ADVANCE_NOTICE_HOURS} hours in advance', status=400
+            )
+        if session.scheduled_date > timezone.localdate() + timedelta(days=settings.MAX_ADVANCE_BOOKING_DAYS):
+            raise BookingError(
+                f'Sessions can be booked at most {settings.MAX_ADVANCE_BOOKING_DAYS} days in advance', status=400
+            )
+
+    @staticmethod
+    def _lock_session(user, session_id):
+        """The session, locked, if ``user`` is its client or therapist and it can still change"""
+        session = TherapySession.objects.select_for_update(of=('self',)).select_related(
+            'client', 'therapist'
+        ).filter(
+            Q(client__user=user) | Q(therapist__user=user),
+            session_id=session_id
+        ).first()
+        if session is None:
+            raise BookingError('Session not found', status=404)
+        if session.status not in CANCELLABLE_STATUSES:
+            raise BookingError(f'Session is {session.get_status_display().lower()}', status=400)
+        return session
+
+    @staticmethod
+    def _lock(therapist_id, client_id, days):
+        """Hold the therapist's ``days`` and the client until the transaction ends"""
+        if connection.vendor == 'postgresql':
+            keys = {_lock_key('therapist', therapist_id, day.isoformat()) for day in days}
+            keys.add(_lock_key('client', client_id))
+            with connection.cursor() as cursor:
+                for key in sorted(keys):
+                    cursor.execute('SELECT pg_advisory_xact_lock(%s)', [key])
+        else:
+            list(TherapistProfile.objects.select_for_update().filter(pk=therapist_id).values_list('id', flat=True))
+            list(ClientProfile.objects.select_for_update().filter(pk=client_id).values_list('id', flat=True))
+
+    @staticmethod
+    def _reserve(session):
+        """
+        Lock the session's time and check that it is free. Returns the
+        matching AvailabilitySlot occurrence, or None when the time falls
+        in the therapist's regular availability instead.
+        """
+        buffer = timedelta(minutes=TherapistCalendar.objects.filter(
+            therapist_id=session.therapist_id
+        ).values_list('buffer_time_between_sessions', flat=True).first() or 0)
+        start = datetime.combine(session.scheduled_date, session.scheduled_time)
+        end = start + timedelta(minutes=session.duration_minutes)
+        BookingEngine._lock(session.therapist_id, session.client_id, day_span(start - buffer, end + buffer))
+
+        booked = TherapySession.objects.filter(
+            Q(therapist_id=session.therapist_id) | Q(client_id=session.client_id),
+            # Up to the day the buffer reaches, for early bookings that only clash through it
+            scheduled_date__range=[start.date() - timedelta(days=1), (end + buffer).date()],
+            status__in=BOOKED_STATUSES
+        ).exclude(pk=session.pk).values_list(
+            'therapist_id', 'scheduled_date', 'scheduled_time', 'duration_minutes'
+        )
+        for therapist_id, booked_date, booked_time, duration in booked:
+            booked_start = datetime.combine(booked_date, booked_time)
+            booked_end = booked_start + timedelta(minutes=duration)
+            if therapist_id == session.therapist_id:
+                if booked_start - buffer < end and start < booked_end + buffer:
+                    raise BookingError('The therapist is already booked at this time')
+            elif booked_start < end and start < booked_end:
+                raise BookingError('The client already has a session at this time')
+
+        occurrences = RecurringAvailability.load(
+            [session.therapist_id], session.scheduled_date, session.scheduled_date
+        ).get(session.therapist_id, [])
+        for occurrence in occurrences:
+            if occurrence['start_time'] != session.scheduled_time:
+                continue
+            if occurrence['status'] != 'available':
+                raise BookingError('This slot is not available')
+            if end > datetime.combine(session.scheduled_date, occurrence['end_time']):
+                raise BookingError('The session is longer than the slot')
+            return occurrence
+
+        # No slot at this time; it has to fit the regular availability
+        free = AvailabilityEngine.get_free_intervals(
+            [session.therapist_id], start.date(), (end - timedelta(microseconds=1)).date(),
+            exclude_session_ids=[session.pk] if session.pk else ()
+        ).get(session.therapist_id, {})
+        for day in day_span(start, end):
+            day_start = datetime.combine(day, datetime.min.time())
+            needed_start = max(0, int((start - day_start).total_seconds() // 60))
+            needed_end = min(MINUTES_PER_DAY, int((end - day_start).total_seconds() // 60))
+            if not any(free_start <= needed_start and needed_end <= free_end for free_start, free_end in free.get(day, [])):
+                raise BookingError("This time is outside the therapist's availability")
+        return None
+
+    @staticmethod
+    def _claim_slot(session, occurrence):
+        """Mark the slot ``session`` was booked into as booked"""
+        if occurrence is None:
+            return
+        if occurrence['occurrence_of'] is None:
+            slot = AvailabilitySlot.objects.select_for_update().filter(
+                pk=occurrence['id'], status='available', session__isnull=True
+            ).first()
+            if slot is None:
+                raise BookingError('This slot is no longer available')
+        else:
+            slot = BookingEngine._detach_occurrence(occurrence)
+        slot.status = 'booked'
+        slot.session = session
+        slot.save()
+
+    @staticmethod
+    def _detach_occurrence(occurrence):
+        """
+        A single slot standing for one occurrence of a recurring rule, which
+        then overrides that occurrence. The rule's own first date can't have
+        a second slot (therapist, date and start time are unique), so the
+        rule moves on to its next occurrence without a slot of its own and
+        the old row is reused.
+        """
+        rule = AvailabilitySlot.objects.select_for_update().get(pk=occurrence['occurrence_of'])
+        if occurrence['date'] != rule.date:
+            return AvailabilitySlot(
+                therapist_id=rule.therapist_id,
+                date=occurrence['date'],
+                start_time=rule.start_time,
+                end_time=rule.end_time,
+                duration_minutes=rule.duration_minutes,
+                status='available',
+                notes=rule.notes
+            )
+
+        horizon = rule.recurrence_end_date or rule.date + timedelta(days=366)
+        overridden = set(AvailabilitySlot.objects.filter(
+            therapist_id=rule.therapist_id,
+            start_time=rule.start_time,
+            date__range=[rule.date, horizon]
+        ).values_list('date', flat=True))
+        following = next((
+            day for day in occurrence_dates(
+                rule.date, rule.recurrence_type, rule.recurrence_end_date, rule.date + timedelta(days=1), horizon
+            ) if day not in overridden
+        ), None)
+        if following is not None:
+            AvailabilitySlot.objects.create(
+                therapist_id=rule.therapist_id,
+                date=following,
+                start_time=rule.start_time,
+                end_time=rule.end_time,
+                duration_minutes=rule.duration_minutes,
+                status=rule.status,
+                is_recurring=True,
+                recurrence_type=rule.recurrence_type,
+                recurrence_end_date=rule.recurrence_end_date,
+                notes=rule.notes
+            )
+        rule.is_recurring = False
+        rule.recurrence_type = 'none'
+        rule.recurrence_end_date = None
+        return rule
+
+    @staticmethod
+    def _release_slot(session):
+        """Make the slot ``session`` was booked into available again"""
+        slot = AvailabilitySlot.objects.select_for_update().filter(session=session).first()
+        if slot is not None:
+            slot.status = 'available'
+            slot.session = None
+            slot.save()
+
+    @staticmethod
+    def _session_data(session):
+        return {
+            'session_id': str(session.session_id),
+            'therapist_id': session.therapist_id,
+            'client_id': session.client_id,
+            'session_type': session.session_type,
+            'scheduled_date': session.scheduled_date.isoformat(),
+            'scheduled_time': session.scheduled_time.strftime('%H:%M'),
+            'duration_minutes': session.duration_minutes,
+            'status': session.status,
+        }
+
+
+# Celery tasks
+@shared_task
+def purge_booking_idempotency_keys():
+    """
+    Forget idempotency keys old enough that no client will retry them
+    """
+    return BookingEngine.purge_idempotency_keys()
@@ -0,0 +1,43 @@
+# Cache Version Stamps
+from django.core.cache import cache
+from django.db import transaction
+
+
+class VersionStamp:
+    """
+    Integer version stamps in the default cache.
+
+    Cached entries carry the stamp they were built under in their key (or
+    value), so bumping the stamp orphans every one of them at once without
+    finding or deleting them. A missing stamp reads as version 1. Stamps
+    never expire: an expired stamp would bring old entries back.
+    """
+
+    @staticmethod
+    def get(key):
+        return cache.get_or_set(key, 1, None)
+
+    @staticmethod
+    def bump(key):
+        """Move ``key`` to a new version and return it"""
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Never set (or evicted); add is a no-op if another process got there first
+            cache.add(key, 1, None)
+            return cache.incr(key)
+
+    @staticmethod
+    def bump_on_commit(keys):
+        """
+        Bump ``keys`` once the current transaction commits, so nobody
+        re-caches the old data under the new version
+        """
+        keys = set(keys)
+
+        def bump():
+            for key in keys:
+                VersionStamp.bump(key)
+
+        if keys:
+            transaction.on_commit(bump)
@@ -5,6 +5,7 @@ from django.db.models import Q, Count
 from sessions.models import TherapySession
 from therapists.models import TherapistProfile, TherapistAvailability
 from clients.models import ClientProfile
+from .availability import AvailabilityEngine
 
 
 class CalendarManager:
@@ -213,44 +214,16 @@ class CalendarManager:
     @staticmethod
     def get_available_time_slots(therapist_id, target_date, session_duration=60):
         """
-        Get available time slots for a therapist on a specific date
-        """
-        availability = CalendarManager.get_therapist_availability(therapist_id, target_date)
-        if not availability:
-            return []
-        
-        # Get existing bookings for the date
-        existing_sessions = TherapySession.objects.filter(
-            therapist_id=therapist_id,
-            scheduled_date=target_date,
-            status__in=['scheduled', 'confirmed', 'in_progress']
-        ).values_list('scheduled_time', 'duration_minutes')
-        
-        # Generate time slots
-        available_slots = []
-        current_time = availability.start_time
-        end_time = availability.end_time
-        
-        while current_time < end_time:
-            # Check if this slot conflicts with existing sessions
-            slot_end_time = (datetime.combine(target_date, current_time) + 
-                           timedelta(minutes=session_duration)).time()
-            
-            is_available = True
-            for session_time, session_duration in existing_sessions:
-                session_end_time = (datetime.combine(target_date, session_time) + 
-                                  timedelta(minutes=session_duration)).time()
-                
-                # Check for overlap
-                if (current_time < session_end_time and slot_end_time > session_time):
-                    is_available = False
-                    break
-            
-            if is_available and slot_end_time <= end_time:
-                available_slots.append(current_time)
-            
-            # Move to next slot (30-minute intervals)
-            current_time = (datetime.combine(target_date, current_time) + 
-                          timedelta(minutes=30)).time()
-        
-        return available_slots
\ No newline at end of file
+        Get available time slots for a therapist on a specific date.
+
+        Delegates to AvailabilityEngine, which merges all availability windows
+        and subtracts bookings (plus the calendar's buffer time), blocking
+        calendar events and blocked slots.
+        """
+        free_slots = AvailabilityEngine.get_free_slots(
+            therapist_ids=[therapist_id],
+            date_from=target_date,
+            date_to=target_date,
+            session_duration=session_duration
+        )
+        return free_slots.get(therapist_id, {}).get(target_date, [])
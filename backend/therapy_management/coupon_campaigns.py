@@ -0,0 +1,333 @@
+# Bulk Coupon Email Campaigns
+import time
+from datetime import timedelta
+from celery import group, shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework import permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+
+from coupons.models import CouponSystem, IndividualCoupon, CouponEmailLog
+from communications.models import EmailTemplate
+from .email_automation import EmailAutomationManager
+
+
+RATE_LIMIT_KEY_PREFIX = 'coupon_campaign_rate'
+
+
+class CouponCampaignManager:
+    """
+    Send every pending coupon of a CouponSystem as one campaign.
+
+    Pending coupons are split into chunks and fanned out as a Celery group.
+    Each chunk task claims its coupons in a short transaction, sends over a
+    single mail connection with no transaction open, throttled by a
+    messages-per-second limit shared by all workers (a per-second counter
+    in the default cache), and records the outcome with bulk writes.
+
+    Progress lives in the database: a coupon is done once email_sent_at is
+    set, and CouponEmailLog rows hold queued/sending/sent/failed state. Starting a
+    campaign again only picks up coupons that have not been sent yet, so an
+    interrupted campaign can simply be resumed.
+    """
+
+    @staticmethod
+    def chunk_size():
+        return getattr(settings, 'COUPON_CAMPAIGN_CHUNK_SIZE', 200)
+
+    @staticmethod
+    def rate_limit():
+        """Messages per second across all workers; 0 disables throttling"""
+        return getattr(settings, 'COUPON_CAMPAIGN_RATE_LIMIT', 10)
+
+    @staticmethod
+    def claim_timeout():
+        """Seconds after which a chunk's in-flight claim is considered abandoned"""
+        return getattr(settings, 'COUPON_CAMPAIGN_CLAIM_TIMEOUT', 600)
+
+    @staticmethod
+    def pending_coupons(coupon_system_id):
+        return IndividualCoupon.objects.filter(
+            coupon_system_id=coupon_system_id,
+            status='generated',
+            email_sent_at__isnull=True
+        ).exclude(recipient_email='')
+
+    @staticmethod
+    def start_campaign(coupon_system_id):
+        """
+        Queue every pending coupon of the coupon system and fan the sends
+        out to Celery. Returns a summary of what was queued.
+        """
+        template = EmailTemplate.objects.filter(
+            template_type='coupon_delivery',
+            is_active=True
+        ).first()
+        if not template:
+            return {'coupon_system_id': coupon_system_id, 'queued': 0, 'chunks': 0}
+
+        coupon_ids = list(
+            CouponCampaignManager.pending_coupons(coupon_system_id).order_by('id').values_list('id', flat=True)
+        )
+
+        # One queued log per coupon; coupons left queued or in flight by an earlier run keep theirs
+        already_queued = set(CouponEmailLog.objects.filter(
+            coupon_id__in=coupon_ids,
+            status__in=['queued', 'sending']
+        ).values_list('coupon_id', flat=True))
+        CouponEmailLog.objects.bulk_create([
+            CouponEmailLog(
+                coupon_id=coupon_id,
+                recipient_email=recipient_email,
+                subject=template.subject,
+                email_content='',
+                status='queued'
+            )
+            for coupon_id, recipient_email in IndividualCoupon.objects.filter(
+                id__in=coupon_ids
+            ).exclude(id__in=already_queued).values_list('id', 'recipient_email')
+        ], batch_size=1000)
+
+        size = CouponCampaignManager.chunk_size()
+        chunks = [coupon_ids[i:i + size] for i in range(0, len(coupon_ids), size)]
+        if chunks:
+            group(send_coupon_chunk_task.s(chunk) for chunk in chunks).apply_async()
+
+        return {
+            'coupon_system_id': coupon_system_id,
+            'queued': len(coupon_ids),
+            'chunks': len(chunks),
+        }
+
+    @staticmethod
+    def _throttle():
+        """Block until sending one more message stays within the rate limit"""
+        limit = CouponCampaignManager.rate_limit()
+        if not limit:
+            return
+        while True:
+            second = int(time.time())
+            key = f"{RATE_LIMIT_KEY_PREFIX}:{second}"
+            cache.add(key, 0, timeout=5)
+            try:
+                if cache.incr(key) <= limit:
+                    return
+            except ValueError:
+                # Key expired between add and incr; retry in the same second
+                continue
+            time.sleep(max(0, second + 1 - time.time()))
+
+    @staticmethod
+    def send_chunk(coupon_ids):
+        """
+        Send one chunk of coupons. Rows are claimed in a short transaction,
+        sent with no transaction open, and the outcomes written in a second
+        short transaction, so no lock is held across SMTP round trips and
+        throttle waits. Returns the number of emails sent.
+        """
+        template = EmailTemplate.objects.filter(
+            template_type='coupon_delivery',
+            is_active=True
+        ).first()
+        if not template:
+            return 0
+
+        claimed = CouponCampaignManager._claim(coupon_ids)
+        if not claimed:
+            return 0
+
+        sent_count = 0
+        with get_connection() as connection:
+            for coupon, log in claimed:
+                context = EmailAutomationManager.coupon_email_context(coupon)
+                try:
+                    subject = template.subject.format(**context)
+                    html_content = template.html_content.format(**context)
+                    text_content = template.text_content.format(**context) if template.text_content else ""
+
+                    msg = EmailMultiAlternatives(
+                        subject=subject,
+                        body=text_content,
+                        from_email=settings.EMAIL_HOST_USER,
+                        to=[coupon.recipient_email]
+                    )
+                    if html_content:
+                        msg.attach_alternative(html_content, "text/html")
+
+                    CouponCampaignManager._throttle()
+                    connection.send_messages([msg])
+
+                    now = timezone.now()
+                    coupon.status = 'sent'
+                    coupon.email_sent_at = now
+                    coupon.updated_at = now
+                    log.subject = subject
+                    log.email_content = html_content
+                    log.status = 'sent'
+                    log.sent_at = now
+                    sent_count += 1
+
+                except Exception as e:
+                    log.subject = template.subject
+                    log.email_content = template.html_content
+                    log.status = 'failed'
+                    log.failed_at = timezone.now()
+                    log.error_message = str(e)
+                    # The server may have dropped us; reconnect for the rest of the chunk
+                    connection.close()
+                    try:
+                        connection.open()
+                    except Exception:
+                        pass
+
+                log.updated_at = timezone.now()
+
+        with transaction.atomic():
+            IndividualCoupon.objects.bulk_update(
+                [coupon for coupon, log in claimed if log.status == 'sent'],
+                ['status', 'email_sent_at', 'updated_at']
+            )
+            CouponEmailLog.objects.bulk_update(
+                [log for coupon, log in claimed],
+                ['subject', 'email_content', 'status', 'sent_at', 'failed_at', 'error_message', 'updated_at']
+            )
+
+        return sent_count
+
+    @staticmethod
+    def _claim(coupon_ids):
+        """
+        Mark the unsent coupons of a chunk as in flight and return them as
+        (coupon, log) pairs. Coupons are locked with SKIP LOCKED only for the
+        length of this transaction; a coupon whose log is already 'sending'
+        belongs to another worker, unless that claim is older than the claim
+        timeout (the worker died mid-chunk), in which case it is taken over.
+        """
+        stale = timezone.now() - timedelta(seconds=CouponCampaignManager.claim_timeout())
+        with transaction.atomic():
+            coupons = list(
+                IndividualCoupon.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                    id__in=coupon_ids,
+                    status='generated',
+                    email_sent_at__isnull=True
+                ).exclude(
+                    Exists(CouponEmailLog.objects.filter(
+                        coupon=OuterRef('pk'),
+                        status='sending',
+                        updated_at__gt=stale
+                    ))
+                ).select_related('coupon_system__company')
+            )
+            if not coupons:
+                return []
+
+            logs = {
+                log.coupon_id: log
+                for log in CouponEmailLog.objects.filter(
+                    coupon__in=coupons,
+                    status__in=['queued', 'sending']
+                )
+            }
+            now = timezone.now()
+            new_logs = []
+            for coupon in coupons:
+                log = logs.get(coupon.id)
+                if log is None:
+                    log = logs[coupon.id] = CouponEmailLog(coupon=coupon, recipient_email=coupon.recipient_email)
+                    new_logs.append(log)
+                log.status = 'sending'
+                log.updated_at = now
+
+            CouponEmailLog.objects.filter(
+                id__in=[log.id for log in logs.values() if log.pk]
+            ).update(status='sending', updated_at=now)
+            CouponEmailLog.objects.bulk_create(new_logs)
+
+        return [(coupon, logs[coupon.id]) for coupon in coupons]
+
+    @staticmethod
+    def get_progress(coupon_system_id):
+        """Campaign progress for a coupon system, computed from coupons and email logs"""
+        coupons = IndividualCoupon.objects.filter(
+            coupon_system_id=coupon_system_id
+        ).exclude(recipient_email='').aggregate(
+            total=Count('id'),
+            sent=Count('id', filter=Q(email_sent_at__isnull=False)),
+        )
+        logs = CouponEmailLog.objects.filter(
+            coupon__coupon_system_id=coupon_system_id,
+            coupon__email_sent_at__isnull=True
+        ).aggregate(
+            queued=Count('coupon', distinct=True, filter=Q(status='queued')),
+            sending=Count('coupon', distinct=True, filter=Q(status='sending')),
+            failed=Count('coupon', distinct=True, filter=Q(status='failed')),
+        )
+        return {
+            'coupon_system_id': coupon_system_id,
+            'total': coupons['total'],
+            'sent': coupons['sent'],
+            'queued': logs['queued'],
+            'sending': logs['sending'],
+            'failed': logs['failed'],
+            'remaining': coupons['total'] - coupons['sent'],
+            'is_complete': coupons['total'] == coupons['sent'],
+        }
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def start_coupon_campaign(request, coupon_system_id):
+    """
+    Send (or resume sending) every pending coupon of a coupon system (admin only)
+    """
+    if not request.user.is_staff:
+        return Response({'error': 'Admin access required'}, status=403)
+
+    coupon_system = get_object_or_404(CouponSystem, pk=coupon_system_id)
+    if not coupon_system.is_valid():
+        return Response({'error': 'Coupon system is not active'}, status=status.HTTP_400_BAD_REQUEST)
+    if not EmailTemplate.objects.filter(template_type='coupon_delivery', is_active=True).exists():
+        return Response(
+            {'error': 'No active coupon delivery email template'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    summary = CouponCampaignManager.start_campaign(coupon_system.id)
+    summary['progress'] = CouponCampaignManager.get_progress(coupon_system.id)
+    return Response(summary, status=status.HTTP_202_ACCEPTED if summary['chunks'] else status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def coupon_campaign_progress(request, coupon_system_id):
+    """
+    Progress of a coupon system's email campaign (admin only)
+    """
+    if not request.user.is_staff:
+        return Response({'error': 'Admin access required'}, status=403)
+
+    coupon_system = get_object_or_404(CouponSystem, pk=coupon_system_id)
+    return Response(CouponCampaignManager.get_progress(coupon_system.id))
+
+
+# Celery tasks
+@shared_task
+def start_coupon_campaign_task(coupon_system_id):
+    """
+    Task to queue and fan out a coupon email campaign
+    """
+    return CouponCampaignManager.start_campaign(coupon_system_id)
+
+
+@shared_task
+def send_coupon_chunk_task(coupon_ids):
+    """
+    Task to send one chunk of a coupon email campaign
+    """
+    return CouponCampaignManager.send_chunk(coupon_ids)
@@ -7,10 +7,11 @@ from django.conf import settings
 from django.db.models import Q
 from celery import shared_task
 
-from sessions.models import TherapySession, SessionReminder
+from sessions.models import TherapySession
 from communications.models import EmailTemplate, EmailLog
 from coupons.models import IndividualCoupon, CouponEmailLog
 from accounts.models import User
+from .reminder_queue import ReminderQueueManager
 
 
 class EmailAutomationManager:
@@ -113,119 +114,14 @@ class EmailAutomationManager:
     @staticmethod
     def send_session_reminders():
         """
-        Send session reminders (24 hours and 1 hour before)
+        Send session reminders (24 hours and 1 hour before).
+
+        Reminders are queued with their due time when a session is booked
+        (see ReminderQueueManager); this queues any upcoming session that is
+        missing them and then sends everything that is due.
         """
-        now = timezone.now()
-        
-        # 24-hour reminders
-        reminder_24h_time = now + timedelta(hours=24)
-        sessions_24h = TherapySession.objects.filter(
-            scheduled_date=reminder_24h_time.date(),
-            scheduled_time__hour=reminder_24h_time.hour,
-            status__in=['scheduled', 'confirmed'],
-            reminder_sent_24h=False
-        )
-        
-        for session in sessions_24h:
-            EmailAutomationManager._send_reminder(session, '24_hour')
-            session.reminder_sent_24h = True
-            session.save()
-        
-        # 1-hour reminders
-        reminder_1h_time = now + timedelta(hours=1)
-        sessions_1h = TherapySession.objects.filter(
-            scheduled_date=reminder_1h_time.date(),
-            scheduled_time__hour=reminder_1h_time.hour,
-            status__in=['scheduled', 'confirmed'],
-            reminder_sent_1h=False
-        )
-        
-        for session in sessions_1h:
-            EmailAutomationManager._send_reminder(session, '1_hour')
-            session.reminder_sent_1h = True
-            session.save()
-    
-    @staticmethod
-    def _send_reminder(session, reminder_type):
-        """
-        Send a specific type of reminder
-        """
-        template_type = f'session_reminder_{reminder_type}'
-        template = EmailTemplate.objects.filter(
-            template_type=template_type,
-            is_active=True
-        ).first()
-        
-        if not template:
-            return False
-        
-        context = {
-            'session': session,
-            'client_name': session.client.user.get_full_name(),
-            'therapist_name': session.therapist.user.get_full_name(),
-            'session_date': session.scheduled_date,
-            'session_time': session.scheduled_time,
-            'meeting_link': session.meeting_link,
-            'reminder_type': reminder_type,
-        }
-        
-        recipients = [
-            ('client', session.client.user),
-            ('therapist', session.therapist.user),
-        ]
-        
-        # Add admin recipients for emergency intervention
-        admin_users = User.objects.filter(
-            user_type='admin',
-            is_active=True
-        )
-        for admin in admin_users:
-            recipients.append(('admin', admin))
-        
-        for recipient_type, user in recipients:
-            try:
-                subject = template.subject.format(**context)
-                html_content = template.html_content.format(**context)
-                text_content = template.text_content.format(**context) if template.text_content else ""
-                
-                # Send email
-                msg = EmailMultiAlternatives(
-                    subject=subject,
-                    body=text_content,
-                    from_email=settings.EMAIL_HOST_USER,
-                    to=[user.email]
-                )
-                if html_content:
-                    msg.attach_alternative(html_content, "text/html")
-                
-                msg.send()
-                
-                # Create reminder record
-                SessionReminder.objects.create(
-                    session=session,
-                    reminder_type=reminder_type,
-                    recipient_type=recipient_type,
-                    recipient=user,
-                    subject=subject,
-                    message=text_content,
-                    scheduled_for=timezone.now(),
-                    sent_at=timezone.now(),
-                    email_sent=True,
-                    email_delivered=True
-                )
-                
-            except Exception as e:
-                # Log failed reminder
-                SessionReminder.objects.create(
-                    session=session,
-                    reminder_type=reminder_type,
-                    recipient_type=recipient_type,
-                    recipient=user,
-                    subject=template.subject,
-                    message=str(e),
-                    scheduled_for=timezone.now(),
-                    email_sent=False
-                )
+        ReminderQueueManager.enqueue_upcoming()
+        return ReminderQueueManager.dispatch_due()
     
     @staticmethod
     def send_coupon_email(coupon):
@@ -240,15 +136,7 @@ class EmailAutomationManager:
         if not template:
             return False
         
-        context = {
-            'coupon': coupon,
-            'recipient_name': coupon.recipient_name,
-            'coupon_code': coupon.code,
-            'company_name': coupon.coupon_system.company.name if coupon.coupon_system.company else 'AmitaCare',
-            'discount_value': coupon.coupon_system.discount_value,
-            'discount_type': coupon.coupon_system.discount_type,
-            'valid_until': coupon.coupon_system.valid_until,
-        }
+        context = EmailAutomationManager.coupon_email_context(coupon)
         
         try:
             subject = template.subject.format(**context)
@@ -296,6 +184,21 @@ class EmailAutomationManager:
             )
             return False
     
+    @staticmethod
+    def coupon_email_context(coupon):
+        """
+        Template context for a coupon delivery email
+        """
+        return {
+            'coupon': coupon,
+            'recipient_name': coupon.recipient_name,
+            'coupon_code': coupon.code,
+            'company_name': coupon.coupon_system.company.name if coupon.coupon_system.company else 'AmitaCare',
+            'discount_value': coupon.coupon_system.discount_value,
+            'discount_type': coupon.coupon_system.discount_type,
+            'valid_until': coupon.coupon_system.valid_until,
+        }
+    
     @staticmethod
     def send_payment_confirmation(payment):
         """
@@ -0,0 +1,72 @@
+# Geohash Encoding
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Precision stored on located rows; prefixes of it give every coarser cell
+GEOHASH_PRECISION = 9
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Geohash of a point, ``precision`` characters long"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        value_range, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            value_range[0] = mid
+        else:
+            bits <<= 1
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(latitude_degrees, longitude_degrees) spanned by one cell"""
+    total_bits = 5 * precision
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def covering_precision(lat_span, lon_span, max_cells_per_axis=3):
+    """
+    Finest precision whose cells cover a lat_span x lon_span box with at
+    most ``max_cells_per_axis`` cells along each axis. Returns 0 when even
+    single-character cells are too small.
+    """
+    precision = 0
+    for candidate in range(1, GEOHASH_PRECISION + 1):
+        lat_size, lon_size = cell_size(candidate)
+        if lat_span > lat_size * (max_cells_per_axis - 1) or lon_span > lon_size * (max_cells_per_axis - 1):
+            break
+        precision = candidate
+    return precision
+
+
+def covering_cells(min_lat, min_lon, max_lat, max_lon, precision):
+    """Geohash cells of ``precision`` that together cover the bounding box"""
+    lat_size, lon_size = cell_size(precision)
+    cells = set()
+    lat = min_lat
+    while True:
+        lon = min_lon
+        while True:
+            cells.add(encode(lat, lon, precision))
+            if lon >= max_lon:
+                break
+            lon = min(lon + lon_size, max_lon)
+        if lat >= max_lat:
+            break
+        lat = min(lat + lat_size, max_lat)
+    return cells
@@ -1,44 +1,163 @@
 # Geotagging and Location Services
+import csv
+import hashlib
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import requests
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import Q, Count
+from django.utils import timezone
 from geopy.geocoders import Nominatim
-from geopy.distance import geodesic
 import json
 
-from accounts.models import User
+from accounts.models import User, GeocodeCache
 from clients.models import ClientProfile
 from therapists.models import TherapistProfile
 from companies.models import Company
+from . import geohash
+from .spatial_index import SpatialIndex
+from .map_tiles import MapTileManager
+from .location_rollup import LocationRollupManager
+
+logger = logging.getLogger(__name__)
+
+
+GEOCODE_BATCH_SIZE = 500
+
+
+def normalize_address(address, pincode=None):
+    """Lower-cased address with punctuation and repeated whitespace collapsed, and a bare pincode"""
+    address = re.sub(r'[^a-z0-9]+', ' ', (address or '').lower()).strip()
+    pincode = re.sub(r'\s+', '', pincode or '')
+    return address, pincode
+
+
+def address_key(address, pincode=None):
+    """GeocodeCache key for an address and pincode"""
+    address, pincode = normalize_address(address, pincode)
+    return hashlib.sha1(f"{address}|{pincode}".encode('utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def load_pincode_centroids(path=None):
+    """
+    {pincode: (latitude, longitude)} from the offline centroid CSV
+    (columns: pincode, latitude, longitude). Empty if the file is missing.
+    """
+    path = path or getattr(settings, 'PINCODE_CENTROIDS_CSV', '')
+    centroids = {}
+    try:
+        with open(path, newline='', encoding='utf-8') as csv_file:
+            for row in csv.DictReader(csv_file):
+                try:
+                    centroids[row['pincode'].strip()] = (float(row['latitude']), float(row['longitude']))
+                except (KeyError, TypeError, ValueError, AttributeError):
+                    continue
+    except OSError:
+        pass
+    return centroids
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter spacing calls at least 1/rate seconds apart,
+    shared by every worker of a bulk run
+    """
+    
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_call = 0.0
+    
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            call_at = max(time.monotonic(), self.next_call)
+            self.next_call = call_at + self.interval
+        delay = call_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
 
 
 class GeotaggingManager:
     """
     Manage geotagging and location-based services
+
+    Geocoding results are cached per normalized address and pincode in
+    GeocodeCache. When the geocoder finds nothing, the pincode centroid from
+    the offline CSV (PINCODE_CENTROIDS_CSV) is used instead. ``geolocator``
+    can be any object with a geopy-style geocode(query) method, e.g. a
+    local stand-in in tests.
     """
     
-    def __init__(self):
-        self.geolocator = Nominatim(user_agent="amitacare_therapy_platform")
+    def __init__(self, geolocator=None, rate_limit=None, max_workers=None):
+        self.geolocator = geolocator or Nominatim(user_agent="amitacare_therapy_platform")
+        self.rate_limiter = RateLimiter(
+            getattr(settings, 'GEOCODER_RATE_LIMIT', 1) if rate_limit is None else rate_limit
+        )
+        self.max_workers = max_workers or getattr(settings, 'GEOCODER_MAX_WORKERS', 4)
     
     def geocode_address(self, address, pincode=None):
         """
         Convert address to latitude and longitude
         """
-        try:
-            # Combine address with pincode for better accuracy
-            full_address = f"{address}, {pincode}" if pincode else address
-            
-            location = self.geolocator.geocode(full_address)
-            if location:
-                return {
-                    'latitude': location.latitude,
-                    'longitude': location.longitude,
-                    'formatted_address': location.address
-                }
-            return None
-        except Exception as e:
-            print(f"Geocoding error: {e}")
+        key = address_key(address, pincode)
+        entry = GeocodeCache.objects.filter(address_key=key).first()
+        if entry is None:
+            try:
+                location = self._geocode_remote(address, pincode)
+            except Exception as e:
+                logger.warning("Geocoding error for %s: %s", key, e)
+                # Don't cache transient failures; fall back to the centroid for now
+                return self._cache_result(self._build_entry(key, address, pincode, None))
+            entry = self._build_entry(key, address, pincode, location)
+            GeocodeCache.objects.bulk_create([entry], ignore_conflicts=True)
+        return self._cache_result(entry)
+    
+    def _geocode_remote(self, address, pincode=None):
+        """Query the geocoder, respecting the rate limit. Raises on network errors."""
+        # Combine address with pincode for better accuracy
+        full_address = f"{address}, {pincode}" if pincode else address
+        self.rate_limiter.wait()
+        location = self.geolocator.geocode(full_address)
+        if location:
+            return {
+                'latitude': location.latitude,
+                'longitude': location.longitude,
+                'formatted_address': location.address
+            }
+        return None
+    
+    def _build_entry(self, key, address, pincode, location):
+        """Unsaved GeocodeCache row for a geocoder result, falling back to the pincode centroid"""
+        _, normalized_pincode = normalize_address(address, pincode)
+        entry = GeocodeCache(address_key=key, address=address or '', pincode=normalized_pincode)
+        centroid = load_pincode_centroids().get(normalized_pincode)
+        if location:
+            entry.latitude = round(location['latitude'], 6)
+            entry.longitude = round(location['longitude'], 6)
+            entry.formatted_address = location['formatted_address'] or ''
+            entry.source = 'geocoder'
+        elif centroid:
+            entry.latitude, entry.longitude = round(centroid[0], 6), round(centroid[1], 6)
+            entry.source = 'pincode_centroid'
+        else:
+            entry.source = 'not_found'
+        return entry
+    
+    def _cache_result(self, entry):
+        if entry.latitude is None or entry.longitude is None:
             return None
+        return {
+            'latitude': float(entry.latitude),
+            'longitude': float(entry.longitude),
+            'formatted_address': entry.formatted_address
+        }
     
     def reverse_geocode(self, latitude, longitude):
         """
@@ -53,7 +172,7 @@ class GeotaggingManager:
                 }
             return None
         except Exception as e:
-            print(f"Reverse geocoding error: {e}")
+            logger.warning("Reverse geocoding error: %s", e)
             return None
     
     def update_user_location(self, user_id):
@@ -68,6 +187,7 @@ class GeotaggingManager:
                     user.latitude = location_data['latitude']
                     user.longitude = location_data['longitude']
                     user.save()
+                    MapTileManager.invalidate()
                     return True
             return False
         except User.DoesNotExist:
@@ -85,132 +205,86 @@ class GeotaggingManager:
                     company.latitude = location_data['latitude']
                     company.longitude = location_data['longitude']
                     company.save()
+                    MapTileManager.invalidate()
                     return True
             return False
         except Company.DoesNotExist:
             return False
     
-    def find_nearby_therapists(self, latitude, longitude, radius_km=50):
+    def find_nearby_therapists(self, latitude, longitude, radius_km=50, limit=None, offset=0):
         """
-        Find therapists within specified radius
+        Find therapists within specified radius, nearest first.
+        ``limit`` and ``offset`` page through the sorted results.
         """
         therapists = TherapistProfile.objects.filter(
             user__latitude__isnull=False,
             user__longitude__isnull=False,
             is_available=True,
             approval_status='approved'
-        ).select_related('user')
-        
-        nearby_therapists = []
-        user_location = (latitude, longitude)
-        
-        for therapist in therapists:
-            therapist_location = (therapist.user.latitude, therapist.user.longitude)
-            distance = geodesic(user_location, therapist_location).kilometers
-            
-            if distance <= radius_km:
-                nearby_therapists.append({
-                    'therapist': therapist,
-                    'distance_km': round(distance, 2),
-                    'location': {
-                        'latitude': float(therapist.user.latitude),
-                        'longitude': float(therapist.user.longitude)
-                    }
-                })
-        
-        # Sort by distance
-        nearby_therapists.sort(key=lambda x: x['distance_km'])
-        return nearby_therapists
+        )
+        _, matches = SpatialIndex.search(therapists, latitude, longitude, radius_km, limit, offset)
+        return self._located_results(therapists, matches, 'therapist')
     
-    def find_nearby_clients(self, latitude, longitude, radius_km=50):
+    def find_nearest_therapists(self, latitude, longitude, k=10, max_radius_km=500):
         """
-        Find clients within specified radius (for admin purposes)
+        Find the k nearest available therapists
+        """
+        therapists = TherapistProfile.objects.filter(
+            user__latitude__isnull=False,
+            user__longitude__isnull=False,
+            is_available=True,
+            approval_status='approved'
+        )
+        matches = SpatialIndex.nearest(therapists, latitude, longitude, k, max_radius_km)
+        return self._located_results(therapists, matches, 'therapist')
+    
+    def find_nearby_clients(self, latitude, longitude, radius_km=50, limit=None, offset=0):
+        """
+        Find clients within specified radius (for admin purposes), nearest first
         """
         clients = ClientProfile.objects.filter(
             user__latitude__isnull=False,
             user__longitude__isnull=False,
             is_active=True
-        ).select_related('user')
-        
-        nearby_clients = []
-        center_location = (latitude, longitude)
-        
-        for client in clients:
-            client_location = (client.user.latitude, client.user.longitude)
-            distance = geodesic(center_location, client_location).kilometers
-            
-            if distance <= radius_km:
-                nearby_clients.append({
-                    'client': client,
-                    'distance_km': round(distance, 2),
-                    'location': {
-                        'latitude': float(client.user.latitude),
-                        'longitude': float(client.user.longitude)
-                    }
-                })
-        
-        # Sort by distance
-        nearby_clients.sort(key=lambda x: x['distance_km'])
-        return nearby_clients
+        )
+        _, matches = SpatialIndex.search(clients, latitude, longitude, radius_km, limit, offset)
+        return self._located_results(clients, matches, 'client')
+    
+    def find_nearest_clients(self, latitude, longitude, k=10, max_radius_km=500):
+        """
+        Find the k nearest active clients (for admin purposes)
+        """
+        clients = ClientProfile.objects.filter(
+            user__latitude__isnull=False,
+            user__longitude__isnull=False,
+            is_active=True
+        )
+        matches = SpatialIndex.nearest(clients, latitude, longitude, k, max_radius_km)
+        return self._located_results(clients, matches, 'client')
+    
+    def _located_results(self, queryset, matches, key):
+        """
+        Load the profiles for [(pk, distance_km)] matches, keeping their order
+        """
+        profiles = queryset.select_related('user').in_bulk([pk for pk, _ in matches])
+        results = []
+        for pk, distance in matches:
+            profile = profiles[pk]
+            results.append({
+                key: profile,
+                'distance_km': round(distance, 2),
+                'location': {
+                    'latitude': float(profile.user.latitude),
+                    'longitude': float(profile.user.longitude)
+                }
+            })
+        return results
     
     def get_location_statistics(self):
         """
         Get location-based statistics for admin dashboard
         """
-        # Count users by location availability
-        users_with_location = User.objects.filter(
-            latitude__isnull=False,
-            longitude__isnull=False
-        ).count()
-        
-        total_users = User.objects.count()
-        
-        # Count clients by location
-        clients_with_location = ClientProfile.objects.filter(
-            user__latitude__isnull=False,
-            user__longitude__isnull=False
-        ).count()
-        
-        total_clients = ClientProfile.objects.count()
-        
-        # Count therapists by location
-        therapists_with_location = TherapistProfile.objects.filter(
-            user__latitude__isnull=False,
-            user__longitude__isnull=False
-        ).count()
-        
-        total_therapists = TherapistProfile.objects.count()
-        
-        # Count companies by location
-        companies_with_location = Company.objects.filter(
-            latitude__isnull=False,
-            longitude__isnull=False
-        ).count()
-        
-        total_companies = Company.objects.count()
-        
-        return {
-            'users': {
-                'with_location': users_with_location,
-                'total': total_users,
-                'percentage': (users_with_location / total_users * 100) if total_users > 0 else 0
-            },
-            'clients': {
-                'with_location': clients_with_location,
-                'total': total_clients,
-                'percentage': (clients_with_location / total_clients * 100) if total_clients > 0 else 0
-            },
-            'therapists': {
-                'with_location': therapists_with_location,
-                'total': total_therapists,
-                'percentage': (therapists_with_location / total_therapists * 100) if total_therapists > 0 else 0
-            },
-            'companies': {
-                'with_location': companies_with_location,
-                'total': total_companies,
-                'percentage': (companies_with_location / total_companies * 100) if total_companies > 0 else 0
-            }
-        }
+        return LocationRollupManager.location_statistics()
     
     def get_map_data_for_admin(self):
         """
@@ -242,7 +316,7 @@ class GeotaggingManager:
             user__latitude__isnull=False,
             user__longitude__isnull=False,
             approval_status='approved'
-        ).select_related('user')
+        ).select_related('user').prefetch_related('specializations')
         
         therapist_markers = []
         for therapist in therapists:
@@ -264,7 +338,7 @@ class GeotaggingManager:
             latitude__isnull=False,
             longitude__isnull=False,
             is_active=True
-        )
+        ).annotate(employee_count=Count('employees'))
         
         company_markers = []
         for company in companies:
@@ -275,7 +349,7 @@ class GeotaggingManager:
                 'latitude': float(company.latitude),
                 'longitude': float(company.longitude),
                 'pincode': company.pincode,
-                'employee_count': company.employees.count(),
+                'employee_count': company.employee_count,
                 'agreement_status': company.agreement_status,
             }
             company_markers.append(marker)
@@ -290,62 +364,100 @@ class GeotaggingManager:
         """
         Get statistics grouped by pincode
         """
-        # Client distribution by pincode
-        client_pincodes = ClientProfile.objects.filter(
-            user__pincode__isnull=False,
-            is_active=True
-        ).values('user__pincode').annotate(
-            count=Count('id')
-        ).order_by('-count')
+        return LocationRollupManager.pincode_statistics()
+    
+    def geocode_many(self, addresses, offline=False):
+        """
+        Geocode many (address, pincode) pairs at once.
+        Returns {address_key: GeocodeCache}.
+
+        Cached keys are read in batches; the rest are geocoded by a bounded
+        worker pool sharing one rate limiter and written back with
+        bulk_create. With ``offline`` the geocoder is skipped and misses are
+        resolved from pincode centroids only.
+        """
+        keys = {}
+        for address, pincode in addresses:
+            keys.setdefault(address_key(address, pincode), (address, pincode))
+        key_list = list(keys)
+        entries = {}
+        for i in range(0, len(key_list), GEOCODE_BATCH_SIZE):
+            entries.update({
+                entry.address_key: entry
+                for entry in GeocodeCache.objects.filter(address_key__in=key_list[i:i + GEOCODE_BATCH_SIZE])
+            })
+        missing = [key for key in key_list if key not in entries]
         
-        # Therapist distribution by pincode
-        therapist_pincodes = TherapistProfile.objects.filter(
-            user__pincode__isnull=False,
-            approval_status='approved'
-        ).values('user__pincode').annotate(
-            count=Count('id')
-        ).order_by('-count')
+        def geocode(key):
+            if offline:
+                return key, None, None
+            try:
+                return key, self._geocode_remote(*keys[key]), None
+            except Exception as e:
+                return key, None, e
         
-        # Company distribution by pincode
-        company_pincodes = Company.objects.filter(
-            pincode__isnull=False,
-            is_active=True
-        ).values('pincode').annotate(
-            count=Count('id')
-        ).order_by('-count')
+        # Workers only talk to the geocoder; all database access stays on this thread
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(pool.map(geocode, missing))
         
-        return {
-            'clients_by_pincode': list(client_pincodes),
-            'therapists_by_pincode': list(therapist_pincodes),
-            'companies_by_pincode': list(company_pincodes),
-        }
+        new_entries = []
+        for key, location, error in results:
+            entry = self._build_entry(key, *keys[key], location)
+            entries[key] = entry
+            # Cache only real geocoder answers; errors may be transient and
+            # offline centroids would hide a more precise result later
+            if error is None and not offline:
+                new_entries.append(entry)
+        GeocodeCache.objects.bulk_create(new_entries, batch_size=GEOCODE_BATCH_SIZE, ignore_conflicts=True)
+        
+        return entries
     
-    def bulk_update_locations(self):
+    def bulk_update_locations(self, offline=False):
         """
-        Bulk update locations for all users, therapists, and companies
+        Bulk update locations for all users and companies missing coordinates
         """
-        updated_count = 0
+        users = list(User.objects.filter(
+            Q(latitude__isnull=True) | Q(longitude__isnull=True)
+        ).exclude(address='').exclude(pincode='').only('id', 'address', 'pincode'))
+        
+        companies = list(Company.objects.filter(
+            Q(latitude__isnull=True) | Q(longitude__isnull=True)
+        ).exclude(address='').exclude(pincode='').only('id', 'address', 'pincode'))
         
-        # Update users without location data
-        users_without_location = User.objects.filter(
-            Q(latitude__isnull=True) | Q(longitude__isnull=True),
-            address__isnull=False,
-            pincode__isnull=False
+        entries = self.geocode_many(
+            [(record.address, record.pincode) for record in users + companies],
+            offline=offline
         )
+        now = timezone.now()
         
-        for user in users_without_location:
-            if self.update_user_location(user.id):
-                updated_count += 1
+        def apply(records):
+            located = []
+            for record in records:
+                entry = entries.get(address_key(record.address, record.pincode))
+                if entry is None or entry.latitude is None or entry.longitude is None:
+                    continue
+                record.latitude = entry.latitude
+                record.longitude = entry.longitude
+                record.updated_at = now
+                located.append(record)
+            return located
+        
+        located_users = apply(users)
+        for user in located_users:
+            # bulk_update skips User.save(), so keep the spatial index column in step here
+            user.geohash = geohash.encode(float(user.latitude), float(user.longitude))
+        User.objects.bulk_update(
+            located_users, ['latitude', 'longitude', 'geohash', 'updated_at'], batch_size=GEOCODE_BATCH_SIZE
+        )
         
-        # Update companies without location data
-        companies_without_location = Company.objects.filter(
-            Q(latitude__isnull=True) | Q(longitude__isnull=True),
-            address__isnull=False,
-            pincode__isnull=False
+        located_companies = apply(companies)
+        Company.objects.bulk_update(
+            located_companies, ['latitude', 'longitude', 'updated_at'], batch_size=GEOCODE_BATCH_SIZE
         )
         
-        for company in companies_without_location:
-            if self.update_company_location(company.id):
-                updated_count += 1
+        if located_users or located_companies:
+            MapTileManager.invalidate()
+            # bulk_update bypasses the rollup signals
+            LocationRollupManager.reconcile()
         
-        return updated_count
\ No newline at end of file
+        return len(located_users) + len(located_companies)
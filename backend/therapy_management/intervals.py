@@ -0,0 +1,29 @@
+# Datetime Interval Helpers
+from datetime import datetime, time, timedelta
+
+
+def day_span(start, end):
+    """Every date the datetime interval [start, end) touches"""
+    days = []
+    current = start.date()
+    while current <= (end - timedelta(microseconds=1)).date():
+        days.append(current)
+        current += timedelta(days=1)
+    return days
+
+
+def event_intervals(events):
+    """
+    [(start, end)] datetimes blocked by CalendarEvent rows given as
+    (start_date, end_date, is_all_day, start_time, end_time). All-day
+    events, and events without times, run from midnight to midnight
+    """
+    intervals = []
+    for start_date, end_date, is_all_day, start_time, end_time in events:
+        start = datetime.combine(start_date, time.min if is_all_day or start_time is None else start_time)
+        if is_all_day or end_time is None:
+            end = datetime.combine(end_date + timedelta(days=1), time.min)
+        else:
+            end = datetime.combine(end_date, end_time)
+        intervals.append((start, end))
+    return intervals
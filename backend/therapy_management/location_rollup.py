@@ -0,0 +1,181 @@
+# Geographic Rollups
+from collections import defaultdict
+from celery import shared_task
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from accounts.models import User, LocationRollup
+from clients.models import ClientProfile
+from therapists.models import TherapistProfile
+from companies.models import Company
+
+
+# entity_type -> (model, path to the pincode/latitude/longitude fields, what counts as active)
+ROLLUP_SOURCES = {
+    'user': (User, '', Q(is_active=True)),
+    'client': (ClientProfile, 'user__', Q(is_active=True)),
+    'therapist': (TherapistProfile, 'user__', Q(approval_status='approved')),
+    'company': (Company, '', Q(is_active=True)),
+}
+
+STATISTICS_KEYS = {
+    'user': 'users',
+    'client': 'clients',
+    'therapist': 'therapists',
+    'company': 'companies',
+}
+
+
+class LocationRollupManager:
+    """
+    Per-pincode counts behind the admin geographic statistics.
+
+    LocationRollup holds, for every entity type and pincode, the number of
+    rows, how many of them have coordinates and how many are active. The
+    signals in accounts/signals.py snapshot the counts an instance
+    contributes before and after each save or delete and apply the
+    difference with F() updates, so the dashboard reads a few hundred rows
+    instead of scanning users, profiles and companies. Writes that bypass
+    signals (queryset.update, bulk_update) are corrected by reconcile(),
+    which the reconcile_location_rollups task runs periodically.
+    """
+
+    @staticmethod
+    def counts(entity_type, **filters):
+        """{pincode: (total, with_location, active)} for the rows of ``entity_type`` matching ``filters``"""
+        model, prefix, active = ROLLUP_SOURCES[entity_type]
+        located = Q(**{f'{prefix}latitude__isnull': False, f'{prefix}longitude__isnull': False})
+        rows = model.objects.filter(**filters).values(
+            rollup_pincode=F(f'{prefix}pincode')
+        ).annotate(
+            total=Count('id'),
+            with_location=Count('id', filter=located),
+            active=Count('id', filter=active)
+        ).order_by()
+        return {
+            row['rollup_pincode']: (row['total'], row['with_location'], row['active'])
+            for row in rows
+        }
+
+    @staticmethod
+    def snapshot(scopes):
+        """Counts for each {entity_type: filters} scope, as {entity_type: counts}"""
+        return {
+            entity_type: LocationRollupManager.counts(entity_type, **filters)
+            for entity_type, filters in scopes.items()
+        }
+
+    @staticmethod
+    def apply_change(previous, current):
+        """Move the rollups from the ``previous`` snapshot to the ``current`` one"""
+        deltas = defaultdict(lambda: [0, 0, 0])
+        for sign, snapshot in ((-1, previous), (1, current)):
+            for entity_type, counts in snapshot.items():
+                for pincode, values in counts.items():
+                    delta = deltas[(entity_type, pincode)]
+                    for i, value in enumerate(values):
+                        delta[i] += sign * value
+
+        for (entity_type, pincode), (total, with_location, active) in deltas.items():
+            if not (total or with_location or active):
+                continue
+            row, _ = LocationRollup.objects.get_or_create(entity_type=entity_type, pincode=pincode)
+            LocationRollup.objects.filter(pk=row.pk).update(
+                total=F('total') + total,
+                with_location=F('with_location') + with_location,
+                active=F('active') + active
+            )
+
+    @staticmethod
+    def reconcile():
+        """
+        Recount every rollup from the source tables and correct the rows that
+        drifted. Rollup rows are locked first so concurrent signal updates
+        either land before the recount or are applied on top of it.
+        """
+        with transaction.atomic():
+            stored = {
+                (row.entity_type, row.pincode): row
+                for row in LocationRollup.objects.select_for_update()
+            }
+
+            now = timezone.now()
+            to_create = []
+            to_update = []
+            for entity_type in ROLLUP_SOURCES:
+                for pincode, (total, with_location, active) in LocationRollupManager.counts(entity_type).items():
+                    row = stored.pop((entity_type, pincode), None)
+                    if row is None:
+                        to_create.append(LocationRollup(
+                            entity_type=entity_type,
+                            pincode=pincode,
+                            total=total,
+                            with_location=with_location,
+                            active=active
+                        ))
+                    elif (row.total, row.with_location, row.active) != (total, with_location, active):
+                        row.total = total
+                        row.with_location = with_location
+                        row.active = active
+                        row.updated_at = now
+                        to_update.append(row)
+
+            LocationRollup.objects.bulk_create(to_create, batch_size=1000)
+            LocationRollup.objects.bulk_update(
+                to_update, ['total', 'with_location', 'active', 'updated_at'], batch_size=1000
+            )
+            # Whatever is left no longer has any rows behind it
+            deleted = LocationRollup.objects.filter(pk__in=[row.pk for row in stored.values()]).delete()[0]
+
+        return {'created': len(to_create), 'updated': len(to_update), 'deleted': deleted}
+
+    @staticmethod
+    def location_statistics():
+        """Location coverage per entity type, read from the rollups"""
+        totals = {
+            row['entity_type']: row
+            for row in LocationRollup.objects.values('entity_type').annotate(
+                total_count=Sum('total'),
+                with_location_count=Sum('with_location')
+            ).order_by()
+        }
+        statistics = {}
+        for entity_type, key in STATISTICS_KEYS.items():
+            row = totals.get(entity_type, {})
+            total = row.get('total_count') or 0
+            with_location = row.get('with_location_count') or 0
+            statistics[key] = {
+                'with_location': with_location,
+                'total': total,
+                'percentage': (with_location / total * 100) if total > 0 else 0
+            }
+        return statistics
+
+    @staticmethod
+    def pincode_statistics():
+        """Active clients, approved therapists and active companies per pincode, read from the rollups"""
+        statistics = {
+            'clients_by_pincode': [],
+            'therapists_by_pincode': [],
+            'companies_by_pincode': [],
+        }
+        rows = LocationRollup.objects.filter(
+            entity_type__in=['client', 'therapist', 'company'],
+            active__gt=0
+        ).values_list('entity_type', 'pincode', 'active').order_by('-active', 'pincode')
+        for entity_type, pincode, active in rows:
+            if entity_type == 'company':
+                statistics['companies_by_pincode'].append({'pincode': pincode, 'count': active})
+            else:
+                statistics[f'{entity_type}s_by_pincode'].append({'user__pincode': pincode, 'count': active})
+        return statistics
+
+
+# Celery tasks
+@shared_task
+def reconcile_location_rollups():
+    """
+    Periodic task to correct geographic rollups that drifted from the source tables
+    """
+    return LocationRollupManager.reconcile()
@@ -0,0 +1,177 @@
+"""
+Management command to benchmark monthly report generation on synthetic data
+"""
+
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import User
+from clients.models import ClientProfile
+from companies.models import Company
+from payments.models import Payment
+from sessions.models import TherapySession
+from therapists.models import TherapistProfile
+from therapy_management.reporting import MonthlyReportGenerator
+
+
+class BenchmarkRollback(Exception):
+    """Raised to roll back the synthetic data once the benchmark is done"""
+
+
+class Command(BaseCommand):
+    help = 'Benchmark MonthlyReportGenerator over a synthetic month (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=200000, help='Synthetic sessions in the month')
+        parser.add_argument('--therapists', type=int, default=500, help='Synthetic therapists')
+        parser.add_argument('--clients', type=int, default=20000, help='Synthetic clients')
+        parser.add_argument('--companies', type=int, default=50, help='Synthetic companies')
+        parser.add_argument('--year', type=int, default=2024)
+        parser.add_argument('--month', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        try:
+            with transaction.atomic():
+                self.populate(options)
+                self.run_benchmark(options)
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            self.stdout.write('Synthetic data rolled back')
+
+    def populate(self, options):
+        batch_size = options['batch_size']
+        run_id = uuid.uuid4().hex[:8]
+        password = make_password(None)
+        start = time.perf_counter()
+
+        companies = Company.objects.bulk_create([
+            Company(
+                name=f'Bench Company {run_id}-{i}',
+                registration_number=f'BENCH-{run_id}-{i}',
+                contact_person_name='Bench',
+                contact_person_designation='HR',
+                contact_email=f'hr{i}@bench.example',
+                contact_phone='+910000000000',
+                address='Bench Street',
+                city='Bengaluru',
+                state='Karnataka',
+                pincode='560001',
+            )
+            for i in range(options['companies'])
+        ], batch_size=batch_size)
+
+        therapist_users = User.objects.bulk_create([
+            User(
+                username=f'bench-t-{run_id}-{i}', password=password, user_type='therapist',
+                first_name='Therapist', last_name=str(i)
+            )
+            for i in range(options['therapists'])
+        ], batch_size=batch_size)
+        therapists = TherapistProfile.objects.bulk_create([
+            TherapistProfile(
+                user=user, license_number=f'BENCH-{run_id}-{i}', bio='Benchmark',
+                languages_spoken='English', approval_status='approved'
+            )
+            for i, user in enumerate(therapist_users)
+        ], batch_size=batch_size)
+
+        client_users = User.objects.bulk_create([
+            User(
+                username=f'bench-c-{run_id}-{i}', password=password, user_type='client',
+                first_name='Client', last_name=str(i)
+            )
+            for i in range(options['clients'])
+        ], batch_size=batch_size)
+        clients = ClientProfile.objects.bulk_create([
+            ClientProfile(
+                user=user,
+                company=random.choice(companies) if companies and random.random() < 0.4 else None
+            )
+            for user in client_users
+        ], batch_size=batch_size)
+
+        month_start = datetime(options['year'], options['month'], 1)
+        statuses = ['completed'] * 7 + ['cancelled', 'no_show', 'scheduled']
+        session_types = ['individual'] * 6 + ['group', 'family', 'supervision', 'training']
+        payment_types = ['single_session'] * 5 + ['package_6', 'package_12', 'subscription']
+        # Upcoming sessions can't share a therapist's slot
+        booked_slots = set()
+
+        created = 0
+        while created < options['sessions']:
+            count = min(batch_size, options['sessions'] - created)
+            payments = []
+            sessions = []
+            for i in range(count):
+                client = random.choice(clients)
+                therapist = random.choice(therapists)
+                day = month_start + timedelta(days=random.randrange(28))
+                hour = random.randrange(8, 20)
+                status = random.choice(statuses)
+                if status == 'scheduled':
+                    if (therapist.pk, day, hour) in booked_slots:
+                        status = 'completed'
+                    booked_slots.add((therapist.pk, day, hour))
+                amount = Decimal(random.choice([1500, 2000, 2500, 3000]))
+                discount = Decimal(random.choice([0, 0, 250, 500]))
+                payment = Payment(
+                    client=client,
+                    therapist=therapist,
+                    company=client.company,
+                    payment_type=random.choice(payment_types),
+                    base_amount=amount,
+                    discount_amount=discount,
+                    final_amount=amount - discount,
+                    status='completed',
+                    payment_date=timezone.make_aware(day),
+                    invoice_number=f'BENCH-{run_id}-{created + i}',
+                )
+                payments.append(payment)
+                sessions.append(TherapySession(
+                    client=client,
+                    therapist=therapist,
+                    payment=payment,
+                    session_type=random.choice(session_types),
+                    status=status,
+                    scheduled_date=day.date(),
+                    scheduled_time=datetime.min.time().replace(hour=hour),
+                ))
+            Payment.objects.bulk_create(payments, batch_size=batch_size)
+            TherapySession.objects.bulk_create(sessions, batch_size=batch_size)
+            created += count
+
+        self.stdout.write(
+            f'Populated {created} sessions, {len(therapists)} therapists, '
+            f'{len(clients)} clients, {len(companies)} companies '
+            f'in {time.perf_counter() - start:.1f}s'
+        )
+
+    def run_benchmark(self, options):
+        generator = MonthlyReportGenerator(options['year'], options['month'])
+
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            report_data = generator.generate_overall_report()
+            elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f'generate_overall_report: {elapsed * 1000:.0f} ms, {len(ctx.captured_queries)} queries'
+        ))
+        self.stdout.write(
+            f"  sessions={report_data['sessions_data']['total_sessions']} "
+            f"therapists={report_data['therapists_data']['active_therapists_count']} "
+            f"companies={report_data['companies_data']['active_companies_count']} "
+            f"revenue={report_data['financial_data']['total_revenue']}"
+        )
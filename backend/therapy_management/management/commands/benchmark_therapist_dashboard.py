@@ -0,0 +1,148 @@
+"""
+Management command to benchmark cold and warm therapist dashboard requests on synthetic data
+"""
+
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import User
+from clients.models import ClientProfile
+from sessions.models import TherapySession
+from therapists.models import TherapistProfile, TherapyCategory
+from therapists.views import TherapistDashboardView
+from therapy_management.therapist_dashboard import TherapistDashboard
+
+
+class BenchmarkRollback(Exception):
+    """Raised to roll back the synthetic data once the benchmark is done"""
+
+
+class Command(BaseCommand):
+    help = 'Benchmark cold and warm TherapistDashboardView requests (synthetic data rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions-today', type=int, default=12, help="Sessions on the therapist's schedule today")
+        parser.add_argument('--sessions-week', type=int, default=60, help='Other sessions this week')
+        parser.add_argument('--clients', type=int, default=40, help='Synthetic clients')
+        parser.add_argument('--specializations', type=int, default=5)
+        parser.add_argument('--requests', type=int, default=50, help='Requests timed in each mode')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        try:
+            with transaction.atomic():
+                therapist = self.populate(options)
+                self.run_benchmark(therapist, options)
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            self.stdout.write('Synthetic data rolled back')
+
+    def populate(self, options):
+        run_id = uuid.uuid4().hex[:8]
+        password = make_password(None)
+
+        therapist_user = User.objects.create(
+            username=f'bench-t-{run_id}', password=password, user_type='therapist',
+            first_name='Therapist', last_name='Bench'
+        )
+        therapist = TherapistProfile.objects.create(
+            user=therapist_user, license_number=f'BENCH-{run_id}', bio='Benchmark',
+            languages_spoken='English', approval_status='approved'
+        )
+        therapist.specializations.set(TherapyCategory.objects.bulk_create([
+            TherapyCategory(name=f'Bench {run_id} {i}') for i in range(options['specializations'])
+        ]))
+
+        client_users = User.objects.bulk_create([
+            User(
+                username=f'bench-c-{run_id}-{i}', password=password, user_type='client',
+                first_name='Client', last_name=str(i)
+            )
+            for i in range(options['clients'])
+        ])
+        clients = ClientProfile.objects.bulk_create([ClientProfile(user=user) for user in client_users])
+
+        today = timezone.now().date()
+        week_start = today - timedelta(days=today.weekday())
+        statuses = ['completed'] * 5 + ['scheduled', 'confirmed', 'no_show', 'cancelled']
+        sessions = [
+            TherapySession(
+                client=random.choice(clients),
+                therapist=therapist,
+                status=random.choice(['scheduled', 'confirmed']),
+                scheduled_date=today,
+                scheduled_time=datetime.min.time().replace(hour=8 + i % 12, minute=i // 12 % 60),
+            )
+            for i in range(options['sessions_today'])
+        ]
+        # Upcoming sessions can't share a slot
+        booked_slots = {(session.scheduled_date, session.scheduled_time) for session in sessions}
+        for _ in range(options['sessions_week']):
+            session = TherapySession(
+                client=random.choice(clients),
+                therapist=therapist,
+                status=random.choice(statuses),
+                scheduled_date=week_start + timedelta(days=random.randrange(7)),
+                scheduled_time=datetime.min.time().replace(hour=random.randrange(8, 20)),
+            )
+            if session.status in ('scheduled', 'confirmed'):
+                if (session.scheduled_date, session.scheduled_time) in booked_slots:
+                    session.status = 'completed'
+                booked_slots.add((session.scheduled_date, session.scheduled_time))
+            sessions.append(session)
+        TherapySession.objects.bulk_create(sessions)
+
+        self.stdout.write(
+            f"Populated {len(sessions)} sessions for one therapist, {len(clients)} clients"
+        )
+        return therapist
+
+    def run_benchmark(self, therapist, options):
+        factory = APIRequestFactory()
+        view = TherapistDashboardView.as_view()
+        user = User.objects.select_related('therapist_profile').get(pk=therapist.user_id)
+
+        def request():
+            http_request = factory.get('/api/therapists/dashboard/')
+            http_request.user = user
+            force_authenticate(http_request, user=user)
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                response = view(http_request)
+                elapsed = time.perf_counter() - start
+            assert response.status_code == 200, response.data
+            return elapsed, len(ctx.captured_queries)
+
+        results = {}
+        for mode in ('cold', 'warm'):
+            if mode == 'warm':
+                # Prime the cache
+                request()
+            timings = []
+            queries = []
+            for _ in range(options['requests']):
+                if mode == 'cold':
+                    # The signals only invalidate on commit, which never comes here
+                    TherapistDashboard.bump([therapist.pk])
+                elapsed, count = request()
+                timings.append(elapsed)
+                queries.append(count)
+            results[mode] = statistics.median(timings)
+            self.stdout.write(self.style.SUCCESS(
+                f'{mode}: median {results[mode] * 1000:.2f} ms, max {max(timings) * 1000:.2f} ms, '
+                f'{max(queries)} queries'
+            ))
+
+        if results['warm']:
+            self.stdout.write(f"  warm requests are {results['cold'] / results['warm']:.1f}x faster")
@@ -0,0 +1,284 @@
+# Tiled and Clustered Admin Map
+import math
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count
+from django.db.models.functions import Substr
+from rest_framework import permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+
+from clients.models import ClientProfile
+from therapists.models import TherapistProfile
+from companies.models import Company
+from . import geohash
+from .cache_versions import VersionStamp
+
+
+TILE_KEY_PREFIX = 'map_tile'
+TILE_VERSION_KEY = 'map_tile_version'
+MAX_MERCATOR_LAT = 85.05112878
+MAX_TILES_PER_REQUEST = 64
+MAX_MARKERS_PER_TILE = 500
+MAX_ZOOM = 20
+
+
+def tile_for(latitude, longitude, zoom):
+    """(x, y) of the Web Mercator tile containing a point"""
+    n = 2 ** zoom
+    latitude = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, latitude))
+    x = int((longitude + 180.0) / 360.0 * n)
+    lat_rad = math.radians(latitude)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(x, y, zoom):
+    """(min_lat, min_lon, max_lat, max_lon) of a Web Mercator tile"""
+    n = 2 ** zoom
+    min_lon = x / n * 360.0 - 180.0
+    max_lon = (x + 1) / n * 360.0 - 180.0
+    max_lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    min_lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return min_lat, min_lon, max_lat, max_lon
+
+
+def tiles_for_bbox(min_lat, min_lon, max_lat, max_lon, zoom):
+    """Every (x, y) tile at ``zoom`` overlapping the bounding box"""
+    min_x, min_y = tile_for(max_lat, min_lon, zoom)
+    max_x, max_y = tile_for(min_lat, max_lon, zoom)
+    return [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+
+def cluster_precision(zoom):
+    """Geohash precision whose cells split a tile at ``zoom`` into a handful per side"""
+    tile_span = 360.0 / (2 ** zoom)
+    for precision in range(1, geohash.GEOHASH_PRECISION + 1):
+        if geohash.cell_size(precision)[1] <= tile_span / 4:
+            return precision
+    return geohash.GEOHASH_PRECISION
+
+
+class MapTileManager:
+    """
+    Tiled admin map.
+
+    The map is cut into Web Mercator tiles. Below MAP_MARKER_MIN_ZOOM a tile
+    holds clusters: counts and centroids per geohash cell, computed with one
+    GROUP BY per layer on the indexed geohash column. From that zoom on it
+    holds individual markers, unless a tile is too dense, in which case it
+    falls back to finer clusters. Tiles are cached under a version stamp
+    that is bumped when locations change, so a viewport costs a bounded
+    number of cache reads whatever the number of located users.
+    """
+
+    @staticmethod
+    def marker_min_zoom():
+        return getattr(settings, 'MAP_MARKER_MIN_ZOOM', 14)
+
+    @staticmethod
+    def timeout():
+        return getattr(settings, 'MAP_TILE_TIMEOUT', 10 * 60)
+
+    @staticmethod
+    def version():
+        return VersionStamp.get(TILE_VERSION_KEY)
+
+    @staticmethod
+    def invalidate():
+        """Drop every cached tile by moving to a new version"""
+        VersionStamp.bump(TILE_VERSION_KEY)
+
+    @staticmethod
+    def key(version, zoom, x, y):
+        return f"{TILE_KEY_PREFIX}:{version}:{zoom}:{x}:{y}"
+
+    @staticmethod
+    def get_tiles(zoom, min_lat, min_lon, max_lat, max_lon):
+        """Cached tiles covering the bounding box at ``zoom``"""
+        tiles = tiles_for_bbox(min_lat, min_lon, max_lat, max_lon, zoom)
+        version = MapTileManager.version()
+        keys = {MapTileManager.key(version, zoom, x, y): (x, y) for x, y in tiles}
+
+        cached = cache.get_many(list(keys))
+        missing = {}
+        for key, (x, y) in keys.items():
+            if key not in cached:
+                missing[key] = MapTileManager.build_tile(zoom, x, y)
+        if missing:
+            cache.set_many(missing, MapTileManager.timeout())
+        cached.update(missing)
+
+        return [cached[key] for key in keys]
+
+    @staticmethod
+    def build_tile(zoom, x, y):
+        bounds = tile_bounds(x, y, zoom)
+        tile = {'zoom': zoom, 'x': x, 'y': y, 'clusters': [], 'markers': []}
+
+        if zoom >= MapTileManager.marker_min_zoom():
+            markers = MapTileManager._markers(bounds)
+            if len(markers) <= MAX_MARKERS_PER_TILE:
+                tile['markers'] = markers
+                return tile
+            # Too dense to draw individually; cluster finely instead
+            tile['clusters'] = MapTileManager._clusters(bounds, min(cluster_precision(zoom) + 1, geohash.GEOHASH_PRECISION))
+            return tile
+
+        tile['clusters'] = MapTileManager._clusters(bounds, cluster_precision(zoom))
+        return tile
+
+    @staticmethod
+    def _in_bounds(bounds, prefix):
+        min_lat, min_lon, max_lat, max_lon = bounds
+        # Half-open ranges so a point on a tile edge lands in exactly one tile
+        return {
+            f'{prefix}latitude__gte': min_lat,
+            f'{prefix}latitude__lt': max_lat,
+            f'{prefix}longitude__gte': min_lon,
+            f'{prefix}longitude__lt': max_lon,
+        }
+
+    @staticmethod
+    def _clusters(bounds, precision):
+        clusters = []
+        layers = [
+            ('client', ClientProfile.objects.filter(is_active=True)),
+            ('therapist', TherapistProfile.objects.filter(approval_status='approved')),
+        ]
+        for marker_type, queryset in layers:
+            rows = queryset.filter(**MapTileManager._in_bounds(bounds, 'user__')).annotate(
+                cell=Substr('user__geohash', 1, precision)
+            ).values('cell').annotate(
+                count=Count('id'),
+                latitude=Avg('user__latitude'),
+                longitude=Avg('user__longitude')
+            ).order_by()
+            for row in rows:
+                clusters.append({
+                    'type': marker_type,
+                    'cell': row['cell'],
+                    'count': row['count'],
+                    'latitude': round(float(row['latitude']), 6),
+                    'longitude': round(float(row['longitude']), 6),
+                })
+
+        # Companies have no geohash column and are few; bucket them in Python
+        company_cells = defaultdict(list)
+        for latitude, longitude in Company.objects.filter(
+            is_active=True, **MapTileManager._in_bounds(bounds, '')
+        ).values_list('latitude', 'longitude'):
+            cell = geohash.encode(float(latitude), float(longitude), precision)
+            company_cells[cell].append((float(latitude), float(longitude)))
+        for cell, points in company_cells.items():
+            clusters.append({
+                'type': 'company',
+                'cell': cell,
+                'count': len(points),
+                'latitude': round(sum(p[0] for p in points) / len(points), 6),
+                'longitude': round(sum(p[1] for p in points) / len(points), 6),
+            })
+        return clusters
+
+    @staticmethod
+    def _markers(bounds):
+        limit = MAX_MARKERS_PER_TILE + 1
+        markers = []
+
+        clients = ClientProfile.objects.filter(
+            is_active=True, **MapTileManager._in_bounds(bounds, 'user__')
+        ).values(
+            'id', 'user__first_name', 'user__last_name', 'user__latitude', 'user__longitude',
+            'user__pincode', 'company__name', 'total_sessions'
+        )[:limit]
+        for client in clients:
+            markers.append({
+                'type': 'client',
+                'id': client['id'],
+                'name': f"{client['user__first_name']} {client['user__last_name']}".strip(),
+                'latitude': float(client['user__latitude']),
+                'longitude': float(client['user__longitude']),
+                'pincode': client['user__pincode'],
+                'company': client['company__name'] or 'Direct Client',
+                'total_sessions': client['total_sessions'],
+            })
+
+        therapists = TherapistProfile.objects.filter(
+            approval_status='approved', **MapTileManager._in_bounds(bounds, 'user__')
+        ).select_related('user').prefetch_related('specializations')[:limit]
+        for therapist in therapists:
+            markers.append({
+                'type': 'therapist',
+                'id': therapist.id,
+                'name': therapist.user.get_full_name(),
+                'latitude': float(therapist.user.latitude),
+                'longitude': float(therapist.user.longitude),
+                'pincode': therapist.user.pincode,
+                'specializations': therapist.get_specialization_names(),
+                'total_sessions': therapist.total_sessions,
+                'is_available': therapist.is_available,
+            })
+
+        companies = Company.objects.filter(
+            is_active=True, **MapTileManager._in_bounds(bounds, '')
+        ).annotate(employee_count=Count('employees'))[:limit]
+        for company in companies:
+            markers.append({
+                'type': 'company',
+                'id': company.id,
+                'name': company.name,
+                'latitude': float(company.latitude),
+                'longitude': float(company.longitude),
+                'pincode': company.pincode,
+                'employee_count': company.employee_count,
+                'agreement_status': company.agreement_status,
+            })
+
+        return markers
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def admin_map_tiles(request):
+    """
+    Clustered or individual map markers for a viewport (admin only).
+
+    Query params: zoom (0-20) and the viewport bounds min_lat, min_lon,
+    max_lat, max_lon.
+    """
+    if not request.user.is_staff:
+        return Response({'error': 'Admin access required'}, status=403)
+
+    try:
+        zoom = int(request.query_params.get('zoom', 5))
+        min_lat = float(request.query_params['min_lat'])
+        min_lon = float(request.query_params['min_lon'])
+        max_lat = float(request.query_params['max_lat'])
+        max_lon = float(request.query_params['max_lon'])
+    except (KeyError, ValueError):
+        return Response(
+            {'error': 'zoom, min_lat, min_lon, max_lat and max_lon are required numbers'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if not 0 <= zoom <= MAX_ZOOM:
+        return Response({'error': f'zoom must be between 0 and {MAX_ZOOM}'}, status=status.HTTP_400_BAD_REQUEST)
+    if min_lat > max_lat or min_lon > max_lon:
+        return Response({'error': 'Invalid bounding box'}, status=status.HTTP_400_BAD_REQUEST)
+
+    min_lon, max_lon = max(min_lon, -180.0), min(max_lon, 180.0)
+    if len(tiles_for_bbox(min_lat, min_lon, max_lat, max_lon, zoom)) > MAX_TILES_PER_REQUEST:
+        return Response(
+            {'error': 'Bounding box covers too many tiles for this zoom level'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    tiles = MapTileManager.get_tiles(zoom, min_lat, min_lon, max_lat, max_lon)
+    return Response({
+        'zoom': zoom,
+        'mode': 'markers' if zoom >= MapTileManager.marker_min_zoom() else 'clusters',
+        'tile_count': len(tiles),
+        'clusters': [cluster for tile in tiles for cluster in tile['clusters']],
+        'markers': [marker for tile in tiles for marker in tile['markers']],
+    })
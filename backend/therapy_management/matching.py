@@ -0,0 +1,363 @@
+# Therapist-Client Matching
+import re
+import threading
+import time
+import numpy as np
+from datetime import timedelta
+from django.conf import settings
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework import permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+
+from clients.models import ClientProfile, ClientConcern
+from therapists.models import TherapistProfile, TherapyCategory
+from .slot_index import FreeSlotIndex
+from .therapist_search import TherapistSearchIndex
+
+
+# (name, start minute, end minute) of the day parts clients can prefer
+TIME_BUCKETS = [
+    ('morning', 6 * 60, 12 * 60),
+    ('afternoon', 12 * 60, 17 * 60),
+    ('evening', 17 * 60, 21 * 60),
+    ('night', 21 * 60, 24 * 60),
+]
+PRIORITY_WEIGHTS = {'low': 0.5, 'medium': 1.0, 'high': 1.5, 'urgent': 2.0}
+PROFICIENCY_WEIGHTS = {'basic': 0.25, 'intermediate': 0.5, 'advanced': 0.75, 'expert': 1.0}
+SCORE_WEIGHTS = {
+    'concerns': 0.4,
+    'language': 0.2,
+    'availability': 0.2,
+    'rating': 0.15,
+    'fee': 0.05,
+}
+# Ratings are shrunk towards this prior until a therapist has a few reviews
+RATING_PRIOR = 3.5
+RATING_PRIOR_REVIEWS = 5
+# Free minutes in the preferred day parts at which availability scores ~0.63
+AVAILABILITY_SCALE_MINUTES = 600
+
+
+def time_preferences(*values):
+    """Weights over TIME_BUCKETS from free-text times ("morning", "18:00-20:00") or lists of them"""
+    weights = np.zeros(len(TIME_BUCKETS), dtype=np.float32)
+    texts = []
+    for value in values:
+        if isinstance(value, (list, tuple)):
+            texts.extend(str(item) for item in value)
+        elif value:
+            texts.append(str(value))
+
+    for text in texts:
+        text = text.lower()
+        for i, (name, _, _) in enumerate(TIME_BUCKETS):
+            if name in text:
+                weights[i] += 1
+        for start_hour, start_minute, end_hour, end_minute in re.findall(
+            r'(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})', text
+        ):
+            start = int(start_hour) * 60 + int(start_minute)
+            end = int(end_hour) * 60 + int(end_minute)
+            for i, (_, bucket_start, bucket_end) in enumerate(TIME_BUCKETS):
+                overlap = min(end, bucket_end) - max(start, bucket_start)
+                if overlap > 0:
+                    weights[i] += overlap / (bucket_end - bucket_start)
+
+    if not weights.any():
+        weights[:] = 1
+    return weights / weights.sum()
+
+
+class TherapistFeatures:
+    """
+    Feature arrays for every approved, available therapist, one row each:
+    specialization and competency strength per therapy category, languages,
+    prior-adjusted rating, fee, and free minutes per day part over the next
+    MATCHING_CAPACITY_DAYS days.
+    """
+
+    def __init__(self, therapists, categories):
+        self.categories = [category.id for category in categories]
+        self.category_column = {category_id: i for i, category_id in enumerate(self.categories)}
+        self.concern_columns = TherapistFeatures.concern_columns(categories)
+
+        languages = sorted({
+            language for therapist in therapists for language in TherapistFeatures.languages(therapist)
+        })
+        self.language_column = {language: i for i, language in enumerate(languages)}
+
+        count = len(therapists)
+        self.ids = np.zeros(count, dtype=np.int64)
+        self.row = {}
+        self.active = np.zeros(count, dtype=bool)
+        self.specialization = np.zeros((count, len(self.categories)), dtype=np.float32)
+        self.competency = np.zeros((count, len(self.categories)), dtype=np.float32)
+        self.language = np.zeros((count, len(languages)), dtype=np.float32)
+        self.rating = np.zeros(count, dtype=np.float32)
+        self.fee = np.zeros(count, dtype=np.float32)
+        self.capacity = np.zeros((count, len(TIME_BUCKETS)), dtype=np.float32)
+        self.capacity_loaded_at = None
+
+        for i, therapist in enumerate(therapists):
+            self.ids[i] = therapist.id
+            self.row[therapist.id] = i
+            self.fill(i, therapist)
+
+    @staticmethod
+    def languages(therapist):
+        return {language.strip().lower() for language in therapist.languages_spoken.split(',') if language.strip()}
+
+    @staticmethod
+    def concern_columns(categories):
+        """Category columns relevant to each ClientConcern category, matched on category and competency names"""
+        columns = {}
+        for key, label in ClientConcern.CONCERN_CATEGORIES:
+            words = {word for word in re.findall(r'\w+', f"{key} {label}".lower()) if len(word) > 3}
+            words -= {'issues', 'management', 'related', 'disorders', 'other'}
+            matched = []
+            for i, category in enumerate(categories):
+                names = ' '.join([category.name] + [competency.name for competency in category.competencies.all()]).lower()
+                if any(word in names for word in words):
+                    matched.append(i)
+            columns[key] = matched
+        return columns
+
+    def fits(self, therapist):
+        """Whether a therapist can be written into the existing columns"""
+        return (
+            all(spec.id in self.category_column or not spec.is_active for spec in therapist.specializations.all())
+            and all(language in self.language_column for language in TherapistFeatures.languages(therapist))
+        )
+
+    def fill(self, i, therapist):
+        self.active[i] = True
+        self.specialization[i] = 0
+        for spec in therapist.specializations.all():
+            column = self.category_column.get(spec.id)
+            if column is not None:
+                self.specialization[i, column] = 1
+        self.competency[i] = 0
+        for link in therapist.therapistcompetency_set.all():
+            column = self.category_column.get(link.competency.category_id)
+            if column is not None:
+                weight = PROFICIENCY_WEIGHTS.get(link.proficiency_level, 0.25)
+                self.competency[i, column] = max(self.competency[i, column], weight)
+        self.language[i] = 0
+        for language in TherapistFeatures.languages(therapist):
+            self.language[i, self.language_column[language]] = 1
+        reviews = therapist.total_reviews
+        self.rating[i] = (
+            float(therapist.average_rating) * reviews + RATING_PRIOR * RATING_PRIOR_REVIEWS
+        ) / (reviews + RATING_PRIOR_REVIEWS) / 5
+        self.fee[i] = float(therapist.consultation_fee)
+
+    def load_capacity(self, days):
+        """Free minutes per day part over the next ``days`` days, from the free-slot index"""
+        today = timezone.localdate()
+        free = FreeSlotIndex.get_free_intervals(
+            [int(therapist_id) for therapist_id in self.ids[self.active]],
+            today, today + timedelta(days=days - 1)
+        )
+        self.capacity[:] = 0
+        for therapist_id, therapist_days in free.items():
+            i = self.row.get(therapist_id)
+            if i is None:
+                continue
+            for intervals in therapist_days.values():
+                for start, end in intervals:
+                    for b, (_, bucket_start, bucket_end) in enumerate(TIME_BUCKETS):
+                        overlap = min(end, bucket_end) - max(start, bucket_start)
+                        if overlap > 0:
+                            self.capacity[i, b] += overlap
+        self.capacity_loaded_at = time.monotonic()
+
+
+class MatchingEngine:
+    """
+    Ranks therapists for a client.
+
+    Therapist features live in NumPy arrays kept per process. They follow
+    the therapist search index's change log (TherapistSearchIndex.changes_since),
+    so profile edits only rewrite the affected rows; free capacity is
+    reloaded from the free-slot index every MATCHING_CAPACITY_TTL seconds.
+    A client is encoded as a concern vector over therapy categories, a
+    language and day-part preferences, and every therapist is scored in one
+    vectorized pass; the top k come from argpartition.
+    """
+
+    _features = None
+    _version = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def capacity_days():
+        return getattr(settings, 'MATCHING_CAPACITY_DAYS', 7)
+
+    @staticmethod
+    def capacity_ttl():
+        return getattr(settings, 'MATCHING_CAPACITY_TTL', 5 * 60)
+
+    @staticmethod
+    def load_therapists(therapist_ids=None):
+        therapists = TherapistSearchIndex.searchable().prefetch_related(
+            'specializations', 'therapistcompetency_set__competency'
+        ).order_by('id')
+        if therapist_ids is not None:
+            therapists = therapists.filter(id__in=therapist_ids)
+        return list(therapists)
+
+    @staticmethod
+    def _rebuild():
+        categories = list(TherapyCategory.objects.filter(is_active=True).prefetch_related('competencies'))
+        return TherapistFeatures(MatchingEngine.load_therapists(), categories)
+
+    @staticmethod
+    def _sync():
+        """Bring this process's features up to date. Call with the lock held."""
+        features = MatchingEngine._features
+        version, changed = TherapistSearchIndex.changes_since(
+            MatchingEngine._version if features is not None else None
+        )
+
+        if changed is None:
+            features = MatchingEngine._rebuild()
+        elif changed:
+            therapists = MatchingEngine.load_therapists(changed)
+            if all(therapist.id in features.row and features.fits(therapist) for therapist in therapists):
+                for therapist_id in changed - {therapist.id for therapist in therapists}:
+                    # No longer approved/available, or deleted
+                    if therapist_id in features.row:
+                        features.active[features.row[therapist_id]] = False
+                for therapist in therapists:
+                    features.fill(features.row[therapist.id], therapist)
+            else:
+                # New therapists, categories or languages need new rows or columns
+                features = MatchingEngine._rebuild()
+
+        if features.capacity_loaded_at is None or (
+            time.monotonic() - features.capacity_loaded_at > MatchingEngine.capacity_ttl()
+        ):
+            features.load_capacity(MatchingEngine.capacity_days())
+
+        MatchingEngine._features = features
+        MatchingEngine._version = version
+        return features
+
+    @staticmethod
+    def client_vector(client, features):
+        concerns = np.zeros(len(features.categories), dtype=np.float32)
+        for concern in client.concerns.all():
+            if concern.is_resolved:
+                continue
+            for column in features.concern_columns.get(concern.category, []):
+                concerns[column] += PRIORITY_WEIGHTS.get(concern.priority, 1.0)
+
+        preferences = getattr(client, 'preferences', None)
+        time_slots = preferences.preferred_time_slots if preferences is not None else []
+        language = (client.preferred_language or '').strip().lower()
+        return {
+            'concerns': concerns,
+            'language_column': features.language_column.get(language),
+            'has_language': bool(language),
+            'time_weights': time_preferences(client.preferred_session_time, time_slots),
+        }
+
+    @staticmethod
+    def score(features, client_vector):
+        """Per-therapist component scores in [0, 1] and their weighted total"""
+        concerns = client_vector['concerns']
+        if concerns.any():
+            concern_score = (features.specialization @ concerns + 0.5 * (features.competency @ concerns)) / (
+                1.5 * concerns.sum()
+            )
+        else:
+            concern_score = np.full(len(features.ids), 0.5, dtype=np.float32)
+
+        if client_vector['language_column'] is not None:
+            language_score = features.language[:, client_vector['language_column']]
+        elif client_vector['has_language']:
+            # Nobody lists the client's language
+            language_score = np.zeros(len(features.ids), dtype=np.float32)
+        else:
+            language_score = np.full(len(features.ids), 0.5, dtype=np.float32)
+
+        preferred_minutes = features.capacity @ client_vector['time_weights']
+        availability_score = 1 - np.exp(-preferred_minutes / AVAILABILITY_SCALE_MINUTES)
+
+        highest_fee = features.fee.max() if len(features.fee) else 0
+        fee_score = 1 - features.fee / highest_fee if highest_fee > 0 else np.ones(len(features.ids), dtype=np.float32)
+
+        components = {
+            'concerns': concern_score,
+            'language': language_score,
+            'availability': availability_score,
+            'rating': features.rating,
+            'fee': fee_score,
+        }
+        total = sum(SCORE_WEIGHTS[name] * values for name, values in components.items())
+        total = np.where(features.active, total, -np.inf)
+        return total, components
+
+    @staticmethod
+    def top_matches(client, k=10):
+        """The ``k`` best therapists for ``client``, best first, with score breakdowns"""
+        with MatchingEngine._lock:
+            features = MatchingEngine._sync()
+            vector = MatchingEngine.client_vector(client, features)
+            total, components = MatchingEngine.score(features, vector)
+
+            k = min(k, int(features.active.sum()))
+            if k <= 0:
+                return []
+            top = np.argpartition(-total, k - 1)[:k]
+            top = top[np.argsort(-total[top], kind='stable')]
+            therapist_ids = [int(features.ids[i]) for i in top]
+            matches = [
+                {
+                    'therapist_id': int(features.ids[i]),
+                    'score': round(float(total[i]), 4),
+                    'breakdown': {name: round(float(values[i]), 4) for name, values in components.items()},
+                }
+                for i in top
+            ]
+
+        therapists = TherapistProfile.objects.select_related('user').in_bulk(therapist_ids)
+        for match in matches:
+            therapist = therapists.get(match['therapist_id'])
+            if therapist is not None:
+                match['name'] = therapist.user.get_full_name()
+                match['consultation_fee'] = float(therapist.consultation_fee)
+                match['average_rating'] = float(therapist.average_rating)
+                match['languages_spoken'] = therapist.languages_spoken
+        return matches
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def therapist_matches(request):
+    """
+    Best-matching therapists for the requesting client, or for ``client_id``
+    (staff only). Query params: client_id, k (default 10, max 50).
+    """
+    try:
+        k = min(max(int(request.query_params.get('k', 10)), 1), 50)
+    except ValueError:
+        return Response({'error': 'k must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+
+    client_id = request.query_params.get('client_id')
+    clients = ClientProfile.objects.select_related('preferences').prefetch_related('concerns')
+    if client_id:
+        if not request.user.is_staff:
+            return Response({'error': 'Admin access required'}, status=403)
+        client = get_object_or_404(clients, pk=client_id)
+    else:
+        client = clients.filter(user=request.user).first()
+        if client is None:
+            return Response({'error': 'Client profile not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response({
+        'client_id': client.id,
+        'matches': MatchingEngine.top_matches(client, k),
+    })
@@ -0,0 +1,214 @@
+# Therapist Rating Aggregates
+from collections import defaultdict
+from decimal import Decimal
+from celery import shared_task
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from therapists.models import TherapistProfile, TherapistReview, TherapistRatingAggregate
+from sessions.models import SessionFeedback
+from therapy_management.therapist_dashboard import TherapistDashboard
+from therapy_management.therapist_search import TherapistSearchIndex
+
+# SessionFeedback field -> TherapistRatingAggregate dimension
+FEEDBACK_DIMENSIONS = {
+    'overall_rating': 'overall',
+    'session_quality': 'session_quality',
+    'technical_quality': 'technical_quality',
+}
+
+AGGREGATE_FIELDS = ['review_count', 'review_sum'] + [
+    f'{dimension}_{kind}'
+    for dimension in FEEDBACK_DIMENSIONS.values()
+    for kind in ('count', 'sum')
+]
+
+
+class RatingAggregateManager:
+    """
+    Therapist ratings maintained as running sums and counts.
+
+    Every approved review and every client feedback contributes a count and
+    a rating sum to its therapist's TherapistRatingAggregate. The signals
+    take the contribution an instance made before and after each save or
+    delete and apply the difference with F() updates, so approving a review
+    costs two small UPDATEs however many reviews the therapist has.
+    TherapistProfile.average_rating and total_reviews are rewritten from
+    the aggregate row in the same transaction, while it is still locked.
+    reconcile() recounts everything from the source tables and corrects
+    drift left by writes that bypass signals; reconcile_rating_aggregates
+    runs it nightly.
+    """
+
+    @staticmethod
+    def review_contribution(therapist_id, rating, is_approved):
+        """{therapist_id: {field: value}} added by a review"""
+        if not is_approved or therapist_id is None:
+            return {}
+        return {therapist_id: {'review_count': 1, 'review_sum': int(rating)}}
+
+    @staticmethod
+    def feedback_contribution(therapist_id, feedback_type, **ratings):
+        """{therapist_id: {field: value}} added by a session feedback"""
+        if feedback_type != 'client' or therapist_id is None:
+            return {}
+        values = {}
+        for field, dimension in FEEDBACK_DIMENSIONS.items():
+            rating = ratings.get(field)
+            if rating is not None:
+                values[f'{dimension}_count'] = 1
+                values[f'{dimension}_sum'] = int(rating)
+        return {therapist_id: values} if values else {}
+
+    @staticmethod
+    def apply_change(previous, current):
+        """Move the aggregates from the ``previous`` contribution to the ``current`` one"""
+        deltas = defaultdict(lambda: defaultdict(int))
+        for sign, contribution in ((-1, previous), (1, current)):
+            for therapist_id, values in contribution.items():
+                for field, value in values.items():
+                    deltas[therapist_id][field] += sign * value
+
+        with transaction.atomic():
+            reviewed = []
+            for therapist_id, values in deltas.items():
+                values = {field: delta for field, delta in values.items() if delta}
+                if not values:
+                    continue
+                updates = {field: F(field) + delta for field, delta in values.items()}
+                if not TherapistRatingAggregate.objects.filter(therapist_id=therapist_id).update(**updates):
+                    if min(values.values()) < 0:
+                        # Nothing to subtract from: the therapist is being deleted,
+                        # or the row was never created and reconcile() will recount
+                        continue
+                    TherapistRatingAggregate.objects.get_or_create(therapist_id=therapist_id)
+                    TherapistRatingAggregate.objects.filter(therapist_id=therapist_id).update(**updates)
+                if 'review_count' in values or 'review_sum' in values:
+                    reviewed.append(therapist_id)
+            RatingAggregateManager._sync_profiles(reviewed)
+
+    @staticmethod
+    def set_review_approval(queryset, is_approved):
+        """
+        queryset.update(is_approved=...) that keeps the aggregates current.
+        Returns the number of reviews that changed.
+        """
+        with transaction.atomic():
+            changing = list(
+                queryset.exclude(is_approved=is_approved).select_for_update().values_list(
+                    'id', 'therapist_id', 'rating'
+                )
+            )
+            TherapistReview.objects.filter(id__in=[row[0] for row in changing]).update(is_approved=is_approved)
+
+            sign = 1 if is_approved else -1
+            deltas = defaultdict(lambda: {'review_count': 0, 'review_sum': 0})
+            for _, therapist_id, rating in changing:
+                deltas[therapist_id]['review_count'] += sign
+                deltas[therapist_id]['review_sum'] += sign * rating
+            RatingAggregateManager.apply_change({}, deltas)
+        return len(changing)
+
+    @staticmethod
+    def _sync_profiles(therapist_ids):
+        """Copy review averages onto the profiles. Call inside the transaction that moved them."""
+        if not therapist_ids:
+            return
+        for aggregate in TherapistRatingAggregate.objects.filter(therapist_id__in=therapist_ids):
+            TherapistProfile.objects.filter(pk=aggregate.therapist_id).update(
+                total_reviews=max(aggregate.review_count, 0),
+                average_rating=aggregate.average('review') or Decimal('0.00')
+            )
+        # queryset.update skips the profile signals, so reindex explicitly
+        ids = list(therapist_ids)
+        transaction.on_commit(lambda: TherapistSearchIndex.notify(ids))
+        TherapistDashboard.invalidate(ids)
+
+    @staticmethod
+    def counts():
+        """{therapist_id: {field: value}} recounted from reviews and feedback"""
+        counts = defaultdict(lambda: dict.fromkeys(AGGREGATE_FIELDS, 0))
+
+        reviews = TherapistReview.objects.filter(is_approved=True).values('therapist_id').annotate(
+            count=Count('id'),
+            total=Sum('rating')
+        ).order_by()
+        for row in reviews:
+            counts[row['therapist_id']].update(review_count=row['count'], review_sum=row['total'] or 0)
+
+        annotations = {}
+        for field, dimension in FEEDBACK_DIMENSIONS.items():
+            annotations[f'{dimension}_count'] = Count('id', filter=Q(**{f'{field}__isnull': False}))
+            annotations[f'{dimension}_sum'] = Sum(field)
+        feedback = SessionFeedback.objects.filter(feedback_type='client').values(
+            'session__therapist_id'
+        ).annotate(**annotations).order_by()
+        for row in feedback:
+            values = counts[row.pop('session__therapist_id')]
+            values.update({field: value or 0 for field, value in row.items()})
+
+        return counts
+
+    @staticmethod
+    def reconcile():
+        """
+        Recount every aggregate from the source tables and correct the rows
+        that drifted, along with the profile averages derived from them.
+        Aggregate rows are locked first so concurrent signal updates either
+        land before the recount or are applied on top of it.
+        """
+        with transaction.atomic():
+            stored = {
+                row.therapist_id: row
+                for row in TherapistRatingAggregate.objects.select_for_update()
+            }
+            counts = RatingAggregateManager.counts()
+
+            now = timezone.now()
+            to_create = []
+            to_update = []
+            for therapist_id in set(stored) | set(counts):
+                values = counts.get(therapist_id) or dict.fromkeys(AGGREGATE_FIELDS, 0)
+                row = stored.get(therapist_id)
+                if row is None:
+                    to_create.append(TherapistRatingAggregate(therapist_id=therapist_id, **values))
+                elif any(getattr(row, field) != value for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(row, field, value)
+                    row.updated_at = now
+                    to_update.append(row)
+
+            TherapistRatingAggregate.objects.bulk_create(to_create, batch_size=1000, ignore_conflicts=True)
+            TherapistRatingAggregate.objects.bulk_update(
+                to_update, AGGREGATE_FIELDS + ['updated_at'], batch_size=1000
+            )
+
+            aggregates = {
+                row.therapist_id: row for row in to_create + to_update + list(stored.values())
+            }
+            profiles = []
+            for profile in TherapistProfile.objects.only('id', 'total_reviews', 'average_rating'):
+                aggregate = aggregates.get(profile.id)
+                total_reviews = aggregate.review_count if aggregate else 0
+                average_rating = (aggregate.average('review') if aggregate else None) or Decimal('0.00')
+                if (profile.total_reviews, profile.average_rating) != (total_reviews, average_rating):
+                    profile.total_reviews = total_reviews
+                    profile.average_rating = average_rating
+                    profiles.append(profile)
+            TherapistProfile.objects.bulk_update(profiles, ['total_reviews', 'average_rating'], batch_size=1000)
+            if profiles:
+                ids = [profile.id for profile in profiles]
+                transaction.on_commit(lambda: TherapistSearchIndex.notify(ids))
+                TherapistDashboard.invalidate(ids)
+
+        return {'created': len(to_create), 'updated': len(to_update), 'profiles': len(profiles)}
+
+
+# Celery tasks
+@shared_task
+def reconcile_rating_aggregates():
+    """
+    Nightly task to correct rating aggregates that drifted from reviews and feedback
+    """
+    return RatingAggregateManager.reconcile()
@@ -0,0 +1,190 @@
+# Recurring Availability
+from calendar import monthrange
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from sessions.calendar_models import AvailabilitySlot, CalendarEvent
+from .cache_versions import VersionStamp
+from .intervals import event_intervals
+
+WINDOW_KEY_PREFIX = 'recurring_availability'
+VERSION_KEY_PREFIX = 'recurring_availability_version'
+
+SLOT_FIELDS = [
+    'id', 'therapist_id', 'date', 'start_time', 'end_time', 'duration_minutes', 'status',
+    'is_recurring', 'recurrence_type', 'recurrence_end_date', 'notes',
+]
+
+
+def is_rule(slot):
+    """Whether an AvailabilitySlot row (as a dict) stands for a series rather than one slot"""
+    return slot['is_recurring'] and slot['recurrence_type'] != 'none'
+
+
+def occurrence_dates(start, recurrence_type, until, date_from, date_to, interval=1):
+    """
+    Lazily yield the dates in [date_from, date_to] of a series starting on
+    ``start`` and ending on ``until`` (None for open-ended), repeating every
+    ``interval`` days, weeks or months. The first date is found
+    arithmetically rather than by stepping from ``start``, so a window far
+    from the start costs no more than one next to it. Monthly series skip
+    months without the start's day of the month.
+    """
+    last = min(date_to, until) if until else date_to
+    first = max(start, date_from)
+    if first > last:
+        return
+
+    if recurrence_type == 'daily':
+        days = -(-(first - start).days // interval) * interval  # round up to the next occurrence
+        current = start + timedelta(days=days)
+        while current <= last:
+            yield current
+            current += timedelta(days=interval)
+
+    elif recurrence_type == 'weekly':
+        weeks = -(-(first - start).days // (7 * interval)) * interval
+        current = start + timedelta(weeks=weeks)
+        while current <= last:
+            yield current
+            current += timedelta(weeks=interval)
+
+    elif recurrence_type == 'monthly':
+        months = (first.year - start.year) * 12 + first.month - start.month
+        months = -(-months // interval) * interval
+        while True:
+            year, month = divmod(start.month - 1 + months, 12)
+            year += start.year
+            month += 1
+            if date(year, month, 1) > last:
+                return
+            if start.day <= monthrange(year, month)[1]:
+                current = date(year, month, start.day)
+                if current >= first:
+                    yield current
+            months += interval
+
+    elif first == start:
+        yield start
+
+
+def expand(slots, date_from, date_to):
+    """
+    Lazily yield one occurrence dict per slot row and date in the window.
+    Single slots pass through; rules become one occurrence per date, tagged
+    with ``occurrence_of``.
+    """
+    for slot in slots:
+        if not is_rule(slot):
+            if date_from <= slot['date'] <= date_to:
+                yield {**slot, 'occurrence_of': None}
+            continue
+        for occurrence_date in occurrence_dates(
+            slot['date'], slot['recurrence_type'], slot['recurrence_end_date'], date_from, date_to
+        ):
+            yield {**slot, 'date': occurrence_date, 'occurrence_of': slot['id']}
+
+
+class RecurringAvailability:
+    """
+    Recurring AvailabilitySlot rules expanded on read.
+
+    A slot with ``is_recurring`` and a ``recurrence_type`` is stored once as
+    a rule starting on its ``date`` and running until
+    ``recurrence_end_date``. Reading a window loads the single slots inside
+    it plus the rules that overlap it in one query, so the rows read depend
+    on the number of rules and not on how long the window is. Occurrences
+    are then generated lazily. An occurrence is dropped when a calendar
+    event that blocks availability overlaps it, or when a single slot
+    starts at the same date and time, which is how one occurrence is
+    booked, blocked or moved without touching the rule. Expanded windows
+    are cached per therapist under a version that the AvailabilitySlot and
+    CalendarEvent signals bump.
+    """
+
+    @staticmethod
+    def timeout():
+        return getattr(settings, 'RECURRING_AVAILABILITY_TIMEOUT', 60 * 60)
+
+    @staticmethod
+    def version_key(therapist_id):
+        return f"{VERSION_KEY_PREFIX}:{therapist_id}"
+
+    @staticmethod
+    def bump(therapist_ids):
+        """Move ``therapist_ids`` to new versions, orphaning their cached windows"""
+        for therapist_id in therapist_ids:
+            VersionStamp.bump(RecurringAvailability.version_key(therapist_id))
+
+    @staticmethod
+    def invalidate(therapist_ids):
+        """Drop the cached windows of ``therapist_ids`` once the current transaction commits"""
+        VersionStamp.bump_on_commit(
+            RecurringAvailability.version_key(therapist_id)
+            for therapist_id in therapist_ids if therapist_id is not None
+        )
+
+    @staticmethod
+    def get(therapist_id, date_from, date_to):
+        """Occurrences for one therapist in [date_from, date_to], sorted by date and time, cached"""
+        version = VersionStamp.get(RecurringAvailability.version_key(therapist_id))
+        key = f"{WINDOW_KEY_PREFIX}:{therapist_id}:{version}:{date_from.isoformat()}:{date_to.isoformat()}"
+        occurrences = cache.get(key)
+        if occurrences is None:
+            occurrences = RecurringAvailability.load([therapist_id], date_from, date_to).get(therapist_id, [])
+            cache.set(key, occurrences, RecurringAvailability.timeout())
+        return occurrences
+
+    @staticmethod
+    def load(therapist_ids, date_from, date_to, exceptions=True):
+        """
+        {therapist_id: [occurrence, ...]} for the window, sorted by date and
+        time. ``exceptions=False`` skips the calendar event query for callers
+        that account for events themselves.
+        """
+        slots = AvailabilitySlot.objects.filter(therapist_id__in=therapist_ids).filter(
+            # Single slots inside the window
+            ((Q(is_recurring=False) | Q(recurrence_type='none')) & Q(date__range=[date_from, date_to])) |
+            # Rules whose series overlaps it
+            (Q(is_recurring=True, date__lte=date_to) & ~Q(recurrence_type='none') & (
+                Q(recurrence_end_date__isnull=True) | Q(recurrence_end_date__gte=date_from)
+            ))
+        )
+
+        by_therapist = defaultdict(list)
+        for slot in slots.values(*SLOT_FIELDS):
+            by_therapist[slot['therapist_id']].append(slot)
+
+        blocked = defaultdict(list)
+        if exceptions and by_therapist:
+            events = CalendarEvent.objects.filter(
+                therapist_id__in=list(by_therapist),
+                blocks_availability=True,
+                start_date__lte=date_to,
+                end_date__gte=date_from
+            ).values_list('therapist_id', 'start_date', 'end_date', 'is_all_day', 'start_time', 'end_time')
+            for therapist_id, *event in events:
+                blocked[therapist_id].extend(event_intervals([event]))
+
+        result = {}
+        for therapist_id, therapist_slots in by_therapist.items():
+            taken = {
+                (slot['date'], slot['start_time'])
+                for slot in therapist_slots if not is_rule(slot)
+            }
+            occurrences = []
+            for occurrence in expand(therapist_slots, date_from, date_to):
+                if occurrence['occurrence_of'] is not None:
+                    if (occurrence['date'], occurrence['start_time']) in taken:
+                        continue
+                    start = datetime.combine(occurrence['date'], occurrence['start_time'])
+                    end = datetime.combine(occurrence['date'], occurrence['end_time'])
+                    if any(event_start < end and start < event_end for event_start, event_end in blocked[therapist_id]):
+                        continue
+                occurrences.append(occurrence)
+            occurrences.sort(key=lambda occurrence: (occurrence['date'], occurrence['start_time']))
+            result[therapist_id] = occurrences
+        return result
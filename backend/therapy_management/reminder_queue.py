@@ -0,0 +1,284 @@
+# Session Reminder Queue
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+from celery import shared_task
+
+from sessions.models import TherapySession
+from sessions.calendar_models import AutomatedReminder
+from communications.models import EmailTemplate
+from accounts.models import User
+
+
+REMINDER_OFFSETS = {
+    '24_hour_reminder': timedelta(hours=24),
+    '1_hour_reminder': timedelta(hours=1),
+}
+REMINDER_TEMPLATES = {
+    '24_hour_reminder': 'session_reminder_24h',
+    '1_hour_reminder': 'session_reminder_1h',
+}
+REMINDER_SENT_FLAGS = {
+    '24_hour_reminder': 'reminder_sent_24h',
+    '1_hour_reminder': 'reminder_sent_1h',
+}
+ACTIVE_STATUSES = ['scheduled', 'confirmed']
+
+# How late a reminder may still be queued, e.g. for sessions booked at short notice
+REMINDER_LATE_GRACE = timedelta(hours=1)
+CLAIM_BATCH_SIZE = 200
+
+
+class ReminderQueueManager:
+    """
+    Queue of session reminders backed by AutomatedReminder rows.
+
+    Each reminder's due time is computed once, in the session's own
+    timezone, when the session is booked or rescheduled (see
+    sessions/signals.py) and stored in ``scheduled_for``. Workers claim due
+    rows with SELECT ... FOR UPDATE SKIP LOCKED, so any number of them can
+    drain the queue in parallel without sending a reminder twice, and a
+    late run still picks up everything that fell due in the meantime.
+
+    Rows are written with bulk_create and bulk_update, the admin list is
+    read once per enqueue and the reminder templates once per dispatch,
+    and a dispatch sends everything through a single mail connection.
+    """
+
+    @staticmethod
+    def session_start(session):
+        """Aware start datetime of a session in its own timezone"""
+        return session.get_session_datetime()
+
+    @staticmethod
+    def build_reminders(session, admin_ids, now=None):
+        """Unsaved AutomatedReminder rows for every reminder still worth sending"""
+        now = now or timezone.now()
+        if session.status not in ACTIVE_STATUSES:
+            return []
+
+        start = ReminderQueueManager.session_start(session)
+        if start <= now:
+            return []
+
+        recipients = [
+            ('client', session.client.user_id),
+            ('therapist', session.therapist.user_id),
+        ]
+        recipients.extend(('admin', admin_id) for admin_id in admin_ids)
+
+        reminders = []
+        for reminder_type, offset in REMINDER_OFFSETS.items():
+            due = start - offset
+            if due < now - REMINDER_LATE_GRACE:
+                continue
+            for recipient_type, recipient_id in recipients:
+                reminders.append(AutomatedReminder(
+                    session=session,
+                    reminder_type=reminder_type,
+                    recipient_type=recipient_type,
+                    recipient_id=recipient_id,
+                    delivery_method='email',
+                    scheduled_for=due,
+                ))
+        return reminders
+
+    @staticmethod
+    def enqueue_sessions(sessions, now=None):
+        """Queue reminders for ``sessions``; already queued reminders are left alone"""
+        admin_ids = list(User.objects.filter(
+            user_type='admin',
+            is_active=True
+        ).values_list('id', flat=True))
+
+        reminders = []
+        for session in sessions:
+            reminders.extend(ReminderQueueManager.build_reminders(session, admin_ids, now))
+
+        AutomatedReminder.objects.bulk_create(reminders, batch_size=1000, ignore_conflicts=True)
+        return len(reminders)
+
+    @staticmethod
+    def reschedule_session(session):
+        """Drop a session's reminders and queue them again for its new start time"""
+        AutomatedReminder.objects.filter(session=session).delete()
+        TherapySession.objects.filter(id=session.id).update(
+            reminder_sent_24h=False,
+            reminder_sent_1h=False
+        )
+        return ReminderQueueManager.enqueue_sessions([session])
+
+    @staticmethod
+    def enqueue_upcoming(now=None):
+        """
+        Queue reminders for upcoming sessions that have none yet, e.g. sessions
+        created with bulk_create, which bypasses the post_save signal
+        """
+        now = now or timezone.now()
+        horizon = now + max(REMINDER_OFFSETS.values()) + timedelta(days=1)
+        sessions = TherapySession.objects.filter(
+            scheduled_date__range=[(now - timedelta(days=1)).date(), horizon.date()],
+            status__in=ACTIVE_STATUSES,
+            automated_reminders__isnull=True
+        ).select_related('client', 'therapist')
+        return ReminderQueueManager.enqueue_sessions(sessions, now)
+
+    @staticmethod
+    def dispatch_due(batch_size=CLAIM_BATCH_SIZE):
+        """
+        Send every due reminder, claiming ``batch_size`` rows per short
+        transaction and sending each batch once its claim has committed.
+        Returns the number of emails sent.
+        """
+        due = AutomatedReminder.objects.filter(
+            is_sent=False,
+            delivery_status='',
+            delivery_method='email',
+            scheduled_for__lte=timezone.now()
+        )
+        if not due.exists():
+            return 0
+
+        templates = {
+            template.template_type: template
+            for template in EmailTemplate.objects.filter(
+                template_type__in=REMINDER_TEMPLATES.values(),
+                is_active=True
+            )
+        }
+
+        sent_count = 0
+        with get_connection() as connection:
+            while True:
+                with transaction.atomic():
+                    claimed = list(
+                        due.select_for_update(skip_locked=True, of=('self',)).select_related(
+                            'session__client__user', 'session__therapist__user', 'recipient'
+                        ).order_by('scheduled_for')[:batch_size]
+                    )
+                    if not claimed:
+                        break
+                    messages = ReminderQueueManager._claim(claimed, templates)
+                # Sent after the claim commits, so no row lock is held across SMTP round trips
+                sent_count += ReminderQueueManager._deliver(messages, connection)
+        return sent_count
+
+    @staticmethod
+    def _claim(reminders, templates):
+        """
+        Render claimed reminders and mark them sent, or skipped when they are
+        no longer worth sending. Returns (reminder, message) pairs to send.
+
+        Rows are marked sent before the mail goes out: a worker dying
+        mid-batch loses those reminders rather than sending them twice.
+        """
+        now = timezone.now()
+        messages = []
+
+        for reminder in reminders:
+            session = reminder.session
+            if session.status not in ACTIVE_STATUSES or ReminderQueueManager.session_start(session) <= now:
+                reminder.delivery_status = 'skipped'
+                continue
+
+            template = templates.get(REMINDER_TEMPLATES[reminder.reminder_type])
+            if not template:
+                reminder.delivery_status = 'skipped'
+                reminder.error_message = 'No active email template'
+                continue
+
+            context = {
+                'session': session,
+                'client_name': session.client.user.get_full_name(),
+                'therapist_name': session.therapist.user.get_full_name(),
+                'session_date': session.scheduled_date,
+                'session_time': session.scheduled_time,
+                'meeting_link': session.meeting_link,
+                'reminder_type': reminder.reminder_type,
+            }
+
+            try:
+                subject = template.subject.format(**context)
+                html_content = template.html_content.format(**context)
+                text_content = template.text_content.format(**context) if template.text_content else ""
+            except Exception as e:
+                reminder.delivery_status = 'failed'
+                reminder.error_message = str(e)
+                continue
+
+            msg = EmailMultiAlternatives(
+                subject=subject,
+                body=text_content,
+                from_email=settings.EMAIL_HOST_USER,
+                to=[reminder.recipient.email]
+            )
+            if html_content:
+                msg.attach_alternative(html_content, "text/html")
+
+            reminder.subject = subject
+            reminder.message = text_content
+            reminder.is_sent = True
+            reminder.sent_at = now
+            reminder.delivery_status = 'sent'
+            messages.append((reminder, msg))
+
+        AutomatedReminder.objects.bulk_update(
+            reminders,
+            ['subject', 'message', 'is_sent', 'sent_at', 'delivery_status', 'error_message']
+        )
+        return messages
+
+    @staticmethod
+    def _deliver(messages, connection):
+        """Send claimed reminders over ``connection``, then record failures and the session flags"""
+        failed = []
+        sent_sessions = {reminder_type: set() for reminder_type in REMINDER_OFFSETS}
+
+        for reminder, msg in messages:
+            try:
+                connection.send_messages([msg])
+                sent_sessions[reminder.reminder_type].add(reminder.session_id)
+
+            except Exception as e:
+                reminder.is_sent = False
+                reminder.sent_at = None
+                reminder.delivery_status = 'failed'
+                reminder.error_message = str(e)
+                failed.append(reminder)
+                # The server may have dropped us; reconnect for the rest of the batch
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    pass
+
+        with transaction.atomic():
+            AutomatedReminder.objects.bulk_update(
+                failed,
+                ['is_sent', 'sent_at', 'delivery_status', 'error_message']
+            )
+            for reminder_type, session_ids in sent_sessions.items():
+                if session_ids:
+                    TherapySession.objects.filter(id__in=session_ids).update(
+                        **{REMINDER_SENT_FLAGS[reminder_type]: True}
+                    )
+        return len(messages) - len(failed)
+
+
+# Celery tasks
+@shared_task
+def dispatch_due_reminders():
+    """
+    Drain the reminder queue. Safe to run on several workers at once.
+    """
+    return ReminderQueueManager.dispatch_due()
+
+
+@shared_task
+def enqueue_upcoming_reminders():
+    """
+    Queue reminders for upcoming sessions that were created without them
+    """
+    return ReminderQueueManager.enqueue_upcoming()
@@ -1,21 +1,30 @@
 # Monthly Reporting System
+import csv
+import json
+import tempfile
 from datetime import datetime, timedelta
 from django.utils import timezone
 from django.db.models import Count, Sum, Q, Avg
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import FileResponse, StreamingHttpResponse
+from rest_framework import permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
 import pandas as pd
 from io import BytesIO
 import openpyxl
 from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.pagesizes import letter, A4, landscape
+from reportlab.platypus import (
+    SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Frame, PageTemplate
+)
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib import colors
 
 from sessions.models import TherapySession
-from therapists.models import TherapistProfile
 from clients.models import ClientProfile
 from companies.models import Company, CompanyReport
 from payments.models import Payment
@@ -56,313 +65,298 @@ class MonthlyReportGenerator:
     
     def _get_clients_data(self):
         """Get client-related statistics"""
-        # Total clients seen
-        clients_seen = ClientProfile.objects.filter(
-            sessions__scheduled_date__range=[self.start_date, self.end_date],
-            sessions__status='completed'
-        ).distinct().count()
+        # Clients seen (completed session) and active (any session) in one pass
+        client_counts = TherapySession.objects.filter(
+            scheduled_date__range=[self.start_date, self.end_date]
+        ).aggregate(
+            clients_seen=Count('client', distinct=True, filter=Q(status='completed')),
+            active_clients=Count('client', distinct=True),
+        )
         
         # New clients registered
         new_clients = ClientProfile.objects.filter(
             created_at__date__range=[self.start_date, self.end_date]
         ).count()
         
-        # Active clients (had at least one session)
-        active_clients = ClientProfile.objects.filter(
-            sessions__scheduled_date__range=[self.start_date, self.end_date]
-        ).distinct().count()
-        
         return {
-            'clients_seen': clients_seen,
+            'clients_seen': client_counts['clients_seen'],
             'new_clients': new_clients,
-            'active_clients': active_clients,
+            'active_clients': client_counts['active_clients'],
         }
     
     def _get_therapists_data(self):
         """Get therapist-related statistics"""
-        # Active therapists (conducted at least one session)
-        active_therapists = TherapistProfile.objects.filter(
-            sessions__scheduled_date__range=[self.start_date, self.end_date],
-            sessions__status='completed'
-        ).distinct()
+        # Sessions and distinct clients per therapist, grouped in one query
+        therapist_rows = TherapySession.objects.filter(
+            scheduled_date__range=[self.start_date, self.end_date],
+            status='completed'
+        ).values(
+            'therapist_id', 'therapist__user__first_name', 'therapist__user__last_name'
+        ).annotate(
+            sessions_conducted=Count('id'),
+            clients_served=Count('client', distinct=True),
+        ).order_by('-sessions_conducted', 'therapist_id')
         
-        therapist_stats = []
-        for therapist in active_therapists:
-            sessions_count = therapist.sessions.filter(
-                scheduled_date__range=[self.start_date, self.end_date],
-                status='completed'
-            ).count()
-            
-            clients_count = therapist.sessions.filter(
-                scheduled_date__range=[self.start_date, self.end_date],
-                status='completed'
-            ).values('client').distinct().count()
-            
-            revenue = therapist.payments.filter(
+        # Revenue per therapist, grouped in one query
+        revenue_by_therapist = dict(
+            Payment.objects.filter(
                 payment_date__date__range=[self.start_date, self.end_date],
                 status='completed'
-            ).aggregate(total=Sum('final_amount'))['total'] or 0
-            
-            therapist_stats.append({
-                'therapist_name': therapist.user.get_full_name(),
-                'therapist_id': therapist.id,
-                'sessions_conducted': sessions_count,
-                'clients_served': clients_count,
-                'revenue_generated': revenue,
-            })
+            ).values('therapist_id').annotate(
+                total=Sum('final_amount')
+            ).values_list('therapist_id', 'total')
+        )
+        
+        therapist_stats = [{
+            'therapist_name': f"{row['therapist__user__first_name']} {row['therapist__user__last_name']}".strip(),
+            'therapist_id': row['therapist_id'],
+            'sessions_conducted': row['sessions_conducted'],
+            'clients_served': row['clients_served'],
+            'revenue_generated': revenue_by_therapist.get(row['therapist_id']) or 0,
+        } for row in therapist_rows]
         
         return {
-            'active_therapists_count': active_therapists.count(),
+            'active_therapists_count': len(therapist_stats),
             'therapist_details': therapist_stats,
         }
     
     def _get_sessions_data(self):
         """Get session-related statistics"""
-        sessions = TherapySession.objects.filter(
+        # One GROUP BY (session_type, status); totals are rolled up in Python
+        rows = TherapySession.objects.filter(
             scheduled_date__range=[self.start_date, self.end_date]
-        )
+        ).values('session_type', 'status').annotate(
+            count=Count('id')
+        ).order_by()
+        
+        status_counts = {}
+        type_counts = {}
+        for row in rows:
+            status_counts[row['status']] = status_counts.get(row['status'], 0) + row['count']
+            type_counts[row['session_type']] = type_counts.get(row['session_type'], 0) + row['count']
         
-        total_sessions = sessions.count()
-        completed_sessions = sessions.filter(status='completed').count()
-        cancelled_sessions = sessions.filter(status='cancelled').count()
-        no_show_sessions = sessions.filter(status='no_show').count()
+        total_sessions = sum(status_counts.values())
+        completed_sessions = status_counts.get('completed', 0)
         
         # Session types breakdown
-        session_types = sessions.values('session_type').annotate(
-            count=Count('id')
-        ).order_by('-count')
+        session_types = sorted(
+            ({'session_type': session_type, 'count': count} for session_type, count in type_counts.items()),
+            key=lambda item: -item['count']
+        )
         
         return {
             'total_sessions': total_sessions,
             'completed_sessions': completed_sessions,
-            'cancelled_sessions': cancelled_sessions,
-            'no_show_sessions': no_show_sessions,
+            'cancelled_sessions': status_counts.get('cancelled', 0),
+            'no_show_sessions': status_counts.get('no_show', 0),
             'completion_rate': (completed_sessions / total_sessions * 100) if total_sessions > 0 else 0,
-            'session_types': list(session_types),
+            'session_types': session_types,
         }
     
     def _get_financial_data(self):
         """Get financial statistics"""
-        payments = Payment.objects.filter(
-            payment_date__date__range=[self.start_date, self.end_date],
-            status='completed'
+        # One GROUP BY payment_type with conditional sums for company revenue
+        revenue_by_type = list(
+            Payment.objects.filter(
+                payment_date__date__range=[self.start_date, self.end_date],
+                status='completed'
+            ).values('payment_type').annotate(
+                total=Sum('final_amount'),
+                count=Count('id'),
+                discount=Sum('discount_amount'),
+                company_total=Sum('final_amount', filter=Q(company__isnull=False)),
+            ).order_by('-total')
         )
         
-        total_revenue = payments.aggregate(total=Sum('final_amount'))['total'] or 0
-        total_discount = payments.aggregate(total=Sum('discount_amount'))['total'] or 0
-        
-        # Revenue by payment type
-        revenue_by_type = payments.values('payment_type').annotate(
-            total=Sum('final_amount'),
-            count=Count('id')
-        ).order_by('-total')
-        
-        # Company vs direct client revenue
-        company_revenue = payments.filter(company__isnull=False).aggregate(
-            total=Sum('final_amount')
-        )['total'] or 0
-        
-        direct_revenue = payments.filter(company__isnull=True).aggregate(
-            total=Sum('final_amount')
-        )['total'] or 0
+        total_revenue = sum((row['total'] or 0) for row in revenue_by_type)
+        total_discount = sum((row['discount'] or 0) for row in revenue_by_type)
+        company_revenue = sum((row['company_total'] or 0) for row in revenue_by_type)
         
         return {
             'total_revenue': total_revenue,
             'total_discount': total_discount,
             'company_revenue': company_revenue,
-            'direct_revenue': direct_revenue,
-            'revenue_by_type': list(revenue_by_type),
+            'direct_revenue': total_revenue - company_revenue,
+            'revenue_by_type': [{
+                'payment_type': row['payment_type'],
+                'total': row['total'],
+                'count': row['count'],
+            } for row in revenue_by_type],
         }
     
     def _get_companies_data(self):
         """Get company-related statistics"""
-        companies_with_sessions = Company.objects.filter(
-            payments__payment_date__date__range=[self.start_date, self.end_date],
-            payments__status='completed'
-        ).distinct()
+        # Revenue and discount per company
+        company_rows = Payment.objects.filter(
+            payment_date__date__range=[self.start_date, self.end_date],
+            status='completed',
+            company__isnull=False
+        ).values('company_id', 'company__name').annotate(
+            revenue=Sum('final_amount'),
+            discount=Sum('discount_amount'),
+        ).order_by('company__name')
         
-        company_stats = []
-        for company in companies_with_sessions:
-            sessions_count = TherapySession.objects.filter(
-                payment__company=company,
+        # Completed sessions paid through each company
+        sessions_by_company = dict(
+            TherapySession.objects.filter(
                 scheduled_date__range=[self.start_date, self.end_date],
-                status='completed'
-            ).count()
-            
-            revenue = company.payments.filter(
-                payment_date__date__range=[self.start_date, self.end_date],
-                status='completed'
-            ).aggregate(total=Sum('final_amount'))['total'] or 0
-            
-            discount = company.payments.filter(
-                payment_date__date__range=[self.start_date, self.end_date],
-                status='completed'
-            ).aggregate(total=Sum('discount_amount'))['total'] or 0
-            
-            employees_served = ClientProfile.objects.filter(
-                company=company,
-                sessions__scheduled_date__range=[self.start_date, self.end_date],
-                sessions__status='completed'
-            ).distinct().count()
-            
-            company_stats.append({
-                'company_name': company.name,
-                'company_id': company.id,
-                'sessions_count': sessions_count,
-                'employees_served': employees_served,
-                'revenue': revenue,
-                'discount_given': discount,
-            })
+                status='completed',
+                payment__company__isnull=False
+            ).values('payment__company').annotate(
+                count=Count('id')
+            ).values_list('payment__company', 'count')
+        )
+        
+        # Distinct employees with a completed session, per company
+        employees_by_company = dict(
+            TherapySession.objects.filter(
+                scheduled_date__range=[self.start_date, self.end_date],
+                status='completed',
+                client__company__isnull=False
+            ).values('client__company').annotate(
+                count=Count('client', distinct=True)
+            ).values_list('client__company', 'count')
+        )
+        
+        company_stats = [{
+            'company_name': row['company__name'],
+            'company_id': row['company_id'],
+            'sessions_count': sessions_by_company.get(row['company_id'], 0),
+            'employees_served': employees_by_company.get(row['company_id'], 0),
+            'revenue': row['revenue'] or 0,
+            'discount_given': row['discount'] or 0,
+        } for row in company_rows]
         
         return {
-            'active_companies_count': companies_with_sessions.count(),
+            'active_companies_count': len(company_stats),
             'company_details': company_stats,
         }
     
     def _get_coupons_data(self):
         """Get coupon usage statistics"""
-        coupons_used = IndividualCoupon.objects.filter(
+        # Percentage discounts depend on the actual session cost, so only
+        # fixed-amount coupons contribute to the discount total
+        coupon_totals = IndividualCoupon.objects.filter(
             used_at__date__range=[self.start_date, self.end_date],
             status='used'
+        ).aggregate(
+            total_coupons_used=Count('id'),
+            total_discount_given=Sum(
+                'coupon_system__discount_value',
+                filter=Q(coupon_system__discount_type='fixed_amount')
+            ),
         )
         
-        total_coupons_used = coupons_used.count()
-        total_discount_given = 0
-        
-        # Calculate total discount from coupon usage
-        for coupon in coupons_used:
-            if coupon.coupon_system.discount_type == 'percentage':
-                # This would need to be calculated based on actual session cost
-                pass
-            elif coupon.coupon_system.discount_type == 'fixed_amount':
-                total_discount_given += coupon.coupon_system.discount_value
-        
         return {
-            'total_coupons_used': total_coupons_used,
-            'total_discount_given': total_discount_given,
+            'total_coupons_used': coupon_totals['total_coupons_used'],
+            'total_discount_given': coupon_totals['total_discount_given'] or 0,
         }
     
-    def generate_excel_report(self, report_data):
-        """Generate Excel report"""
-        output = BytesIO()
-        workbook = openpyxl.Workbook()
+    def generate_excel_report(self, report_data, output=None):
+        """Generate Excel report into ``output`` (a new BytesIO by default) with a write-only workbook"""
+        output = output or BytesIO()
+        workbook = openpyxl.Workbook(write_only=True)
         
         # Summary sheet
-        summary_sheet = workbook.active
-        summary_sheet.title = "Summary"
-        
-        # Add summary data
-        summary_sheet['A1'] = f"Monthly Report - {report_data['period']}"
-        summary_sheet['A3'] = "Clients Seen"
-        summary_sheet['B3'] = report_data['clients_data']['clients_seen']
-        summary_sheet['A4'] = "Total Sessions"
-        summary_sheet['B4'] = report_data['sessions_data']['total_sessions']
-        summary_sheet['A5'] = "Total Revenue"
-        summary_sheet['B5'] = report_data['financial_data']['total_revenue']
-        summary_sheet['A6'] = "Active Therapists"
-        summary_sheet['B6'] = report_data['therapists_data']['active_therapists_count']
+        summary_sheet = workbook.create_sheet("Summary")
+        summary_sheet.append([f"Monthly Report - {report_data['period']}"])
+        summary_sheet.append([])
+        summary_sheet.append(["Clients Seen", report_data['clients_data']['clients_seen']])
+        summary_sheet.append(["Total Sessions", report_data['sessions_data']['total_sessions']])
+        summary_sheet.append(["Total Revenue", report_data['financial_data']['total_revenue']])
+        summary_sheet.append(["Active Therapists", report_data['therapists_data']['active_therapists_count']])
         
         # Therapist details sheet
         therapist_sheet = workbook.create_sheet("Therapists")
-        therapist_sheet['A1'] = "Therapist Name"
-        therapist_sheet['B1'] = "Sessions Conducted"
-        therapist_sheet['C1'] = "Clients Served"
-        therapist_sheet['D1'] = "Revenue Generated"
-        
-        for idx, therapist in enumerate(report_data['therapists_data']['therapist_details'], 2):
-            therapist_sheet[f'A{idx}'] = therapist['therapist_name']
-            therapist_sheet[f'B{idx}'] = therapist['sessions_conducted']
-            therapist_sheet[f'C{idx}'] = therapist['clients_served']
-            therapist_sheet[f'D{idx}'] = therapist['revenue_generated']
+        therapist_sheet.append(["Therapist Name", "Sessions Conducted", "Clients Served", "Revenue Generated"])
+        for therapist in report_data['therapists_data']['therapist_details']:
+            therapist_sheet.append([
+                therapist['therapist_name'],
+                therapist['sessions_conducted'],
+                therapist['clients_served'],
+                therapist['revenue_generated'],
+            ])
         
         # Company details sheet
         if report_data['companies_data']['company_details']:
             company_sheet = workbook.create_sheet("Companies")
-            company_sheet['A1'] = "Company Name"
-            company_sheet['B1'] = "Sessions"
-            company_sheet['C1'] = "Employees Served"
-            company_sheet['D1'] = "Revenue"
-            company_sheet['E1'] = "Discount Given"
-            
-            for idx, company in enumerate(report_data['companies_data']['company_details'], 2):
-                company_sheet[f'A{idx}'] = company['company_name']
-                company_sheet[f'B{idx}'] = company['sessions_count']
-                company_sheet[f'C{idx}'] = company['employees_served']
-                company_sheet[f'D{idx}'] = company['revenue']
-                company_sheet[f'E{idx}'] = company['discount_given']
+            company_sheet.append(["Company Name", "Sessions", "Employees Served", "Revenue", "Discount Given"])
+            for company in report_data['companies_data']['company_details']:
+                company_sheet.append([
+                    company['company_name'],
+                    company['sessions_count'],
+                    company['employees_served'],
+                    company['revenue'],
+                    company['discount_given'],
+                ])
         
         workbook.save(output)
         output.seek(0)
         return output
     
-    def generate_pdf_report(self, report_data):
-        """Generate PDF report"""
-        output = BytesIO()
-        doc = SimpleDocTemplate(output, pagesize=A4)
+    def generate_pdf_report(self, report_data, output=None):
+        """Generate PDF report into ``output`` (a new BytesIO by default), one section at a time"""
+        output = output or BytesIO()
+        doc = ChunkedDocTemplate(output, pagesize=A4)
         styles = getSampleStyleSheet()
-        story = []
-        
-        # Title
-        title = Paragraph(f"Monthly Report - {report_data['period']}", styles['Title'])
-        story.append(title)
-        story.append(Spacer(1, 20))
-        
-        # Summary section
-        summary_data = [
-            ['Metric', 'Value'],
-            ['Clients Seen', str(report_data['clients_data']['clients_seen'])],
-            ['Total Sessions', str(report_data['sessions_data']['total_sessions'])],
-            ['Completed Sessions', str(report_data['sessions_data']['completed_sessions'])],
-            ['Total Revenue', f"₹{report_data['financial_data']['total_revenue']:,.2f}"],
-            ['Active Therapists', str(report_data['therapists_data']['active_therapists_count'])],
-            ['Active Companies', str(report_data['companies_data']['active_companies_count'])],
-        ]
         
-        summary_table = Table(summary_data)
-        summary_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 14),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        
-        story.append(summary_table)
-        story.append(Spacer(1, 30))
-        
-        # Therapist performance section
-        if report_data['therapists_data']['therapist_details']:
-            therapist_title = Paragraph("Therapist Performance", styles['Heading2'])
-            story.append(therapist_title)
-            story.append(Spacer(1, 10))
-            
-            therapist_data = [['Therapist', 'Sessions', 'Clients', 'Revenue']]
-            for therapist in report_data['therapists_data']['therapist_details'][:10]:  # Top 10
-                therapist_data.append([
-                    therapist['therapist_name'],
-                    str(therapist['sessions_conducted']),
-                    str(therapist['clients_served']),
-                    f"₹{therapist['revenue_generated']:,.2f}"
-                ])
+        def story():
+            yield [
+                Paragraph(f"Monthly Report - {report_data['period']}", styles['Title']),
+                Spacer(1, 20),
+            ]
             
-            therapist_table = Table(therapist_data)
-            therapist_table.setStyle(TableStyle([
+            # Summary section
+            summary_data = [
+                ['Metric', 'Value'],
+                ['Clients Seen', str(report_data['clients_data']['clients_seen'])],
+                ['Total Sessions', str(report_data['sessions_data']['total_sessions'])],
+                ['Completed Sessions', str(report_data['sessions_data']['completed_sessions'])],
+                ['Total Revenue', f"₹{report_data['financial_data']['total_revenue']:,.2f}"],
+                ['Active Therapists', str(report_data['therapists_data']['active_therapists_count'])],
+                ['Active Companies', str(report_data['companies_data']['active_companies_count'])],
+            ]
+            summary_table = Table(summary_data)
+            summary_table.setStyle(TableStyle([
                 ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
                 ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
                 ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
                 ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
+                ('FONTSIZE', (0, 0), (-1, 0), 14),
                 ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
                 ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
                 ('GRID', (0, 0), (-1, -1), 1, colors.black)
             ]))
+            yield [summary_table, Spacer(1, 30)]
             
-            story.append(therapist_table)
+            # Therapist performance section
+            if report_data['therapists_data']['therapist_details']:
+                therapist_data = [['Therapist', 'Sessions', 'Clients', 'Revenue']]
+                for therapist in report_data['therapists_data']['therapist_details'][:10]:  # Top 10
+                    therapist_data.append([
+                        therapist['therapist_name'],
+                        str(therapist['sessions_conducted']),
+                        str(therapist['clients_served']),
+                        f"₹{therapist['revenue_generated']:,.2f}"
+                    ])
+                therapist_table = Table(therapist_data)
+                therapist_table.setStyle(TableStyle([
+                    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                    ('FONTSIZE', (0, 0), (-1, 0), 12),
+                    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+                    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+                    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+                ]))
+                yield [
+                    Paragraph("Therapist Performance", styles['Heading2']),
+                    Spacer(1, 10),
+                    therapist_table,
+                ]
         
-        doc.build(story)
+        doc.build_chunks(story())
         output.seek(0)
         return output
     
@@ -395,4 +389,275 @@ class MonthlyReportGenerator:
                 report.total_discount_given = company_data['discount_given']
                 report.is_generated = True
                 report.generated_at = timezone.now()
-                report.save()
\ No newline at end of file
+                report.save()
+
+# Streaming exports
+
+EXPORT_CHUNK_SIZE = 2000
+EXCEL_MAX_ROWS = 1048576
+PDF_ROWS_PER_TABLE = 200
+
+
+class _Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output"""
+
+    def write(self, value):
+        return value
+
+
+class ChunkedDocTemplate(SimpleDocTemplate):
+    """
+    SimpleDocTemplate that lays out flowables chunk by chunk, so only the
+    current chunk is held in memory instead of the whole story.
+    """
+
+    def build_chunks(self, chunks):
+        self._calc()
+        frame = Frame(self.leftMargin, self.bottomMargin, self.width, self.height, id='normal')
+        self.addPageTemplates([
+            PageTemplate(id='First', frames=frame, pagesize=self.pagesize),
+            PageTemplate(id='Later', frames=frame, pagesize=self.pagesize),
+        ])
+        self._startBuild()
+        self.canv._doctemplate = self
+        try:
+            for flowables in chunks:
+                flowables = list(flowables)
+                while flowables:
+                    self.clean_hanging()
+                    self.handle_flowable(flowables)
+        finally:
+            del self.canv._doctemplate
+        self._endBuild()
+
+
+class StreamingReportExporter:
+    """
+    Export session-level report rows for any date range without loading
+    them into memory.
+
+    Rows come off a server-side cursor (QuerySet.iterator) in chunks. CSV
+    and NDJSON are written straight to the HTTP response; Excel uses
+    openpyxl's write-only mode and PDF is laid out one table chunk at a
+    time, both into a temporary file that is then streamed back.
+    """
+
+    FORMATS = {
+        'csv': ('text/csv', 'csv'),
+        'ndjson': ('application/x-ndjson', 'ndjson'),
+        'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+        'pdf': ('application/pdf', 'pdf'),
+    }
+
+    COLUMNS = [
+        ('session_id', 'Session ID'),
+        ('scheduled_date', 'Date'),
+        ('scheduled_time', 'Time'),
+        ('therapist_name', 'Therapist'),
+        ('client_name', 'Client'),
+        ('company_name', 'Company'),
+        ('session_type', 'Session Type'),
+        ('status', 'Status'),
+        ('duration_minutes', 'Duration (min)'),
+        ('amount', 'Amount'),
+        ('discount', 'Discount'),
+    ]
+
+    def __init__(self, start_date, end_date, therapist_ids=None, chunk_size=EXPORT_CHUNK_SIZE):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.therapist_ids = therapist_ids
+        self.chunk_size = chunk_size
+
+    @property
+    def period(self):
+        return f"{self.start_date.isoformat()} to {self.end_date.isoformat()}"
+
+    def get_queryset(self):
+        sessions = TherapySession.objects.filter(
+            scheduled_date__range=[self.start_date, self.end_date]
+        )
+        if self.therapist_ids:
+            sessions = sessions.filter(therapist_id__in=self.therapist_ids)
+        return sessions.order_by('scheduled_date', 'scheduled_time', 'id').values_list(
+            'session_id', 'scheduled_date', 'scheduled_time',
+            'therapist__user__first_name', 'therapist__user__last_name',
+            'client__user__first_name', 'client__user__last_name',
+            'payment__company__name', 'session_type', 'status', 'duration_minutes',
+            'payment__final_amount', 'payment__discount_amount',
+        )
+
+    def rows(self):
+        """Yield one tuple per session, in COLUMNS order"""
+        for (session_id, scheduled_date, scheduled_time,
+             therapist_first, therapist_last, client_first, client_last,
+             company_name, session_type, session_status, duration,
+             amount, discount) in self.get_queryset().iterator(chunk_size=self.chunk_size):
+            yield (
+                str(session_id),
+                scheduled_date,
+                scheduled_time,
+                f"{therapist_first} {therapist_last}".strip(),
+                f"{client_first} {client_last}".strip(),
+                company_name or '',
+                session_type,
+                session_status,
+                duration,
+                amount or 0,
+                discount or 0,
+            )
+
+    def chunks(self, size=None):
+        """Group rows() into lists of at most ``size`` rows"""
+        size = size or self.chunk_size
+        chunk = []
+        for row in self.rows():
+            chunk.append(row)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def stream_csv(self):
+        writer = csv.writer(_Echo())
+        yield writer.writerow([label for _, label in self.COLUMNS])
+        for row in self.rows():
+            yield writer.writerow(row)
+
+    def stream_ndjson(self):
+        keys = [key for key, _ in self.COLUMNS]
+        for row in self.rows():
+            yield json.dumps(dict(zip(keys, row)), cls=DjangoJSONEncoder) + '\n'
+
+    def write_excel(self, output):
+        """Write the export to ``output`` with a write-only workbook"""
+        workbook = openpyxl.Workbook(write_only=True)
+        summary_sheet = workbook.create_sheet("Summary")
+        headers = [label for _, label in self.COLUMNS]
+
+        sheet = None
+        sheet_rows = EXCEL_MAX_ROWS
+        total_sessions = 0
+        total_amount = 0
+        for row in self.rows():
+            if sheet_rows >= EXCEL_MAX_ROWS:
+                # Roll over to a new sheet once Excel's row limit is reached
+                sheet_number = len(workbook.worksheets)
+                sheet = workbook.create_sheet("Sessions" if sheet_number == 1 else f"Sessions {sheet_number}")
+                sheet.append(headers)
+                sheet_rows = 1
+            sheet.append(row)
+            sheet_rows += 1
+            total_sessions += 1
+            total_amount += row[9]
+
+        summary_sheet.append([f"Session Report - {self.period}"])
+        summary_sheet.append([])
+        summary_sheet.append(["Total Sessions", total_sessions])
+        summary_sheet.append(["Total Amount", total_amount])
+
+        workbook.save(output)
+        return output
+
+    def write_pdf(self, output):
+        """Write the export to ``output``, laying out one table chunk at a time"""
+        doc = ChunkedDocTemplate(output, pagesize=landscape(A4))
+        styles = getSampleStyleSheet()
+        headers = [label for _, label in self.COLUMNS]
+        table_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 7),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.black)
+        ])
+        totals = {'sessions': 0, 'amount': 0}
+
+        def story():
+            yield [
+                Paragraph(f"Session Report - {self.period}", styles['Title']),
+                Spacer(1, 20),
+            ]
+            for chunk in self.chunks(PDF_ROWS_PER_TABLE):
+                totals['sessions'] += len(chunk)
+                totals['amount'] += sum(row[9] for row in chunk)
+                table = Table(
+                    [headers] + [[str(value) for value in row] for row in chunk],
+                    repeatRows=1
+                )
+                table.setStyle(table_style)
+                yield [table]
+            yield [
+                Spacer(1, 20),
+                Paragraph(
+                    f"Total Sessions: {totals['sessions']} &nbsp; "
+                    f"Total Amount: ₹{totals['amount']:,.2f}",
+                    styles['Heading2']
+                ),
+            ]
+
+        doc.build_chunks(story())
+        return output
+
+    def response(self, file_format):
+        """Build a streaming HTTP response for ``file_format``"""
+        content_type, extension = self.FORMATS[file_format]
+        filename = f"session_report_{self.start_date.isoformat()}_{self.end_date.isoformat()}.{extension}"
+
+        if file_format in ('csv', 'ndjson'):
+            stream = self.stream_csv() if file_format == 'csv' else self.stream_ndjson()
+            response = StreamingHttpResponse(stream, content_type=content_type)
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+            return response
+
+        output = tempfile.TemporaryFile()
+        if file_format == 'xlsx':
+            self.write_excel(output)
+        else:
+            self.write_pdf(output)
+        output.seek(0)
+        return FileResponse(output, as_attachment=True, filename=filename, content_type=content_type)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_report(request):
+    """
+    Stream a session report (admin only).
+
+    Query params: file_format (csv, ndjson, xlsx or pdf), date_from and
+    date_to (YYYY-MM-DD, default the current month) and optional
+    comma-separated therapist_ids.
+    """
+    if not request.user.is_staff:
+        return Response({'error': 'Admin access required'}, status=403)
+
+    file_format = request.query_params.get('file_format', 'csv')
+    if file_format not in StreamingReportExporter.FORMATS:
+        return Response(
+            {'error': f"file_format must be one of {', '.join(StreamingReportExporter.FORMATS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    today = timezone.localdate()
+    try:
+        date_from = datetime.strptime(
+            request.query_params.get('date_from', today.replace(day=1).isoformat()), '%Y-%m-%d'
+        ).date()
+        date_to = datetime.strptime(
+            request.query_params.get('date_to', today.isoformat()), '%Y-%m-%d'
+        ).date()
+        therapist_ids = [
+            int(therapist_id)
+            for therapist_id in request.query_params.get('therapist_ids', '').split(',')
+            if therapist_id.strip()
+        ]
+    except ValueError:
+        return Response({'error': 'Invalid date or therapist id'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if date_from > date_to:
+        return Response({'error': 'date_from must not be after date_to'}, status=status.HTTP_400_BAD_REQUEST)
+
+    exporter = StreamingReportExporter(date_from, date_to, therapist_ids or None)
+    return exporter.response(file_format)
@@ -0,0 +1,260 @@
+# Recurring Session Generation
+from collections import defaultdict
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from celery import shared_task
+
+from sessions.models import SessionTemplate, TherapySession
+from sessions.calendar_models import TherapistCalendar, CalendarEvent
+from .availability import BOOKED_STATUSES
+from .intervals import day_span, event_intervals
+from .recurrence import occurrence_dates
+from .reminder_queue import ReminderQueueManager
+from .slot_index import FreeSlotIndex
+from .therapist_dashboard import TherapistDashboard
+
+# SessionTemplate.recurrence_type -> (occurrence_dates recurrence type, interval multiplier)
+TEMPLATE_RECURRENCES = {
+    'weekly': ('weekly', 1),
+    'biweekly': ('weekly', 2),
+    'monthly': ('monthly', 1),
+}
+
+
+class _BusyMap:
+    """(start, end) datetime intervals per owner and day, for overlap checks"""
+
+    def __init__(self):
+        self.intervals = defaultdict(list)
+
+    def add(self, owner_id, start, end):
+        for day in day_span(start, end):
+            self.intervals[(owner_id, day)].append((start, end))
+
+    def overlaps(self, owner_id, start, end):
+        return any(
+            busy_start < end and start < busy_end
+            for day in day_span(start, end)
+            for busy_start, busy_end in self.intervals[(owner_id, day)]
+        )
+
+
+class SessionTemplateScheduler:
+    """
+    Turns active SessionTemplate rows into TherapySession rows.
+
+    One run covers every active template up to the horizon. The templates
+    are locked (skipping rows another run already holds), and the bookings,
+    buffers and blocking calendar events of every therapist and client
+    involved are loaded with one query each. Occurrences are then checked
+    in memory, against those bookings and against the sessions created
+    earlier in the same run, and the survivors go in with a single
+    bulk_create. ``generated_until`` on each template records how far it has
+    been expanded, so the next run picks up where this one stopped, and is
+    written together with ``sessions_created`` while the rows are still
+    locked. An occurrence that conflicts is reported and not retried.
+    """
+
+    @staticmethod
+    def horizon_days():
+        return getattr(settings, 'SESSION_TEMPLATE_HORIZON_DAYS', 90)
+
+    @staticmethod
+    def occurrences(template, date_from, date_to):
+        """Lazily yield the template's dates in [date_from, date_to]"""
+        recurrence_type, multiplier = TEMPLATE_RECURRENCES[template.recurrence_type]
+        start = template.start_date
+        if recurrence_type == 'weekly' and template.preferred_day_of_week is not None:
+            # Anchor the series on the first preferred weekday
+            start += timedelta(days=(template.preferred_day_of_week - start.weekday()) % 7)
+        yield from occurrence_dates(
+            start, recurrence_type, template.end_date, date_from, date_to,
+            interval=max(template.recurrence_interval, 1) * multiplier
+        )
+
+    @staticmethod
+    def generate(horizon_days=None, template_ids=None, today=None):
+        """
+        Create the sessions of every active template up to ``horizon_days``
+        from today. Returns one report per template:
+        {'template_id', 'created', 'conflicts': [{'date', 'time', 'reason'}], 'skipped'}
+        """
+        today = today or timezone.now().date()
+        # Sessions start tomorrow at the earliest, so nobody is booked into the past
+        date_from = today + timedelta(days=1)
+        date_to = today + timedelta(days=horizon_days or SessionTemplateScheduler.horizon_days())
+
+        with transaction.atomic():
+            templates = SessionTemplate.objects.select_for_update(
+                skip_locked=True, of=('self',)
+            ).select_related('therapist', 'client').filter(
+                Q(generated_until__isnull=True) | Q(generated_until__lt=date_to),
+                Q(end_date__isnull=True) | Q(end_date__gte=date_from),
+                is_active=True,
+                start_date__lte=date_to
+            ).order_by('id')
+            if template_ids is not None:
+                templates = templates.filter(id__in=template_ids)
+            templates = list(templates)
+            if not templates:
+                return []
+
+            therapist_ids = {template.therapist_id for template in templates}
+            client_ids = {template.client_id for template in templates}
+            buffers, therapist_busy, client_busy, blocked = SessionTemplateScheduler._load(
+                therapist_ids, client_ids, date_from, date_to
+            )
+
+            reports = []
+            sessions = []
+            for template in templates:
+                report = {'template_id': template.id, 'created': 0, 'conflicts': [], 'skipped': None}
+                reports.append(report)
+                if template.recurrence_type not in TEMPLATE_RECURRENCES:
+                    report['skipped'] = f"Unsupported recurrence type '{template.recurrence_type}'"
+                    continue
+                remaining = None
+                if template.max_sessions:
+                    remaining = template.max_sessions - template.sessions_created
+                    if remaining <= 0:
+                        report['skipped'] = 'Maximum number of sessions reached'
+                        continue
+
+                window_start = date_from
+                if template.generated_until:
+                    window_start = max(window_start, template.generated_until + timedelta(days=1))
+                generated_until = date_to
+                duration = timedelta(minutes=template.duration_minutes)
+
+                for occurrence in SessionTemplateScheduler.occurrences(template, window_start, date_to):
+                    start = datetime.combine(occurrence, template.preferred_time)
+                    end = start + duration
+                    reason = SessionTemplateScheduler._conflict(
+                        template, start, end, therapist_busy, client_busy, blocked
+                    )
+                    if reason:
+                        report['conflicts'].append({
+                            'date': occurrence, 'time': template.preferred_time, 'reason': reason
+                        })
+                        continue
+
+                    sessions.append(TherapySession(
+                        therapist=template.therapist,
+                        client=template.client,
+                        session_type=template.session_type,
+                        title=template.title,
+                        description=template.description,
+                        scheduled_date=occurrence,
+                        scheduled_time=template.preferred_time,
+                        duration_minutes=template.duration_minutes,
+                        status='scheduled'
+                    ))
+                    buffer = buffers.get(template.therapist_id, timedelta())
+                    therapist_busy.add(template.therapist_id, start - buffer, end + buffer)
+                    client_busy.add(template.client_id, start, end)
+                    report['created'] += 1
+                    if remaining is not None and report['created'] >= remaining:
+                        # Stop here so raising max_sessions later resumes after this date
+                        generated_until = occurrence
+                        break
+
+                template.sessions_created += report['created']
+                template.generated_until = generated_until
+
+            TherapySession.objects.bulk_create(sessions, batch_size=1000)
+            SessionTemplate.objects.bulk_update(
+                templates, ['sessions_created', 'generated_until'], batch_size=1000
+            )
+
+            # bulk_create skips the TherapySession signals
+            days_by_therapist = defaultdict(set)
+            for session in sessions:
+                start = datetime.combine(session.scheduled_date, session.scheduled_time)
+                days_by_therapist[session.therapist_id].update(
+                    day_span(start, start + timedelta(minutes=session.duration_minutes))
+                )
+            TherapistDashboard.invalidate(list(days_by_therapist))
+
+            def after_commit():
+                for therapist_id, days in days_by_therapist.items():
+                    FreeSlotIndex.refresh(therapist_id, days)
+                ReminderQueueManager.enqueue_sessions(sessions)
+
+            if sessions:
+                transaction.on_commit(after_commit)
+
+        return reports
+
+    @staticmethod
+    def _load(therapist_ids, client_ids, date_from, date_to):
+        """Buffers per therapist, busy maps for therapists and clients, and blocking events"""
+        buffers = {
+            therapist_id: timedelta(minutes=buffer or 0)
+            for therapist_id, buffer in TherapistCalendar.objects.filter(
+                therapist_id__in=therapist_ids
+            ).values_list('therapist_id', 'buffer_time_between_sessions')
+        }
+
+        therapist_busy = _BusyMap()
+        client_busy = _BusyMap()
+        # The day before catches sessions running past midnight
+        booked = TherapySession.objects.filter(
+            Q(therapist_id__in=therapist_ids) | Q(client_id__in=client_ids),
+            scheduled_date__range=[date_from - timedelta(days=1), date_to],
+            status__in=BOOKED_STATUSES
+        ).values_list('therapist_id', 'client_id', 'scheduled_date', 'scheduled_time', 'duration_minutes')
+        for therapist_id, client_id, session_date, session_time, duration in booked:
+            start = datetime.combine(session_date, session_time)
+            end = start + timedelta(minutes=duration)
+            if therapist_id in therapist_ids:
+                buffer = buffers.get(therapist_id, timedelta())
+                therapist_busy.add(therapist_id, start - buffer, end + buffer)
+            if client_id in client_ids:
+                client_busy.add(client_id, start, end)
+
+        blocked = _BusyMap()
+        events = CalendarEvent.objects.filter(
+            therapist_id__in=therapist_ids,
+            blocks_availability=True,
+            start_date__lte=date_to,
+            end_date__gte=date_from
+        ).values_list('therapist_id', 'start_date', 'end_date', 'is_all_day', 'start_time', 'end_time')
+        for therapist_id, *event in events:
+            for start, end in event_intervals([event]):
+                blocked.add(therapist_id, start, end)
+
+        return buffers, therapist_busy, client_busy, blocked
+
+    @staticmethod
+    def _conflict(template, start, end, therapist_busy, client_busy, blocked):
+        """Why an occurrence can't be booked, or None"""
+        if therapist_busy.overlaps(template.therapist_id, start, end):
+            return 'therapist_busy'
+        if client_busy.overlaps(template.client_id, start, end):
+            return 'client_busy'
+        if blocked.overlaps(template.therapist_id, start, end):
+            return 'calendar_event'
+        return None
+
+
+# Celery tasks
+@shared_task
+def generate_template_sessions(horizon_days=None):
+    """
+    Expand every active session template up to the horizon
+    """
+    reports = SessionTemplateScheduler.generate(horizon_days)
+    return {
+        'templates': len(reports),
+        'created': sum(report['created'] for report in reports),
+        'conflicts': [
+            {**report, 'conflicts': [
+                {**conflict, 'date': conflict['date'].isoformat(), 'time': conflict['time'].isoformat()}
+                for conflict in report['conflicts']
+            ]}
+            for report in reports if report['conflicts'] or report['skipped']
+        ],
+    }
@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'rest_framework.authtoken',
     'rest_framework_simplejwt',
     'drf_yasg',
     'corsheaders',
@@ -52,6 +53,7 @@ INSTALLED_APPS = [
     'coupons',
     'communications',
     'grievances',
+    'therapy_management',
 ]
 
 MIDDLEWARE = [
@@ -63,6 +65,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'therapy_management.activity_tracking.ActivityTrackingMiddleware',
 ]
 
 ROOT_URLCONF = 'therapy_management.urls'
@@ -149,7 +152,7 @@ AUTH_USER_MODEL = 'accounts.User'
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
@@ -299,6 +302,39 @@ SESSION_JOIN_WINDOW = config('SESSION_JOIN_WINDOW', default=5, cast=int)
 
 MIN_ADVANCE_NOTICE_HOURS = config('MIN_ADVANCE_NOTICE_HOURS', default=48, cast=int)
 MAX_ADVANCE_BOOKING_DAYS = config('MAX_ADVANCE_BOOKING_DAYS', default=30, cast=int)
+FREE_SLOT_INDEX_TIMEOUT = config('FREE_SLOT_INDEX_TIMEOUT', default=21600, cast=int)  # 6 hours
+RECURRING_AVAILABILITY_TIMEOUT = config('RECURRING_AVAILABILITY_TIMEOUT', default=3600, cast=int)  # seconds per expanded window
+SESSION_TEMPLATE_HORIZON_DAYS = config('SESSION_TEMPLATE_HORIZON_DAYS', default=90, cast=int)  # how far ahead recurring sessions are generated
+BOOKING_IDEMPOTENCY_KEY_TTL_HOURS = config('BOOKING_IDEMPOTENCY_KEY_TTL_HOURS', default=24, cast=int)  # how long booking retries are recognised
+COUPON_CAMPAIGN_CHUNK_SIZE = config('COUPON_CAMPAIGN_CHUNK_SIZE', default=200, cast=int)
+COUPON_CAMPAIGN_RATE_LIMIT = config('COUPON_CAMPAIGN_RATE_LIMIT', default=10, cast=int)  # emails per second, 0 = unlimited
+COUPON_CAMPAIGN_CLAIM_TIMEOUT = config('COUPON_CAMPAIGN_CLAIM_TIMEOUT', default=600, cast=int)  # seconds before an in-flight chunk is retried
+
+# Geocoding
+GEOCODER_RATE_LIMIT = config('GEOCODER_RATE_LIMIT', default=1.0, cast=float)  # requests per second
+GEOCODER_MAX_WORKERS = config('GEOCODER_MAX_WORKERS', default=4, cast=int)
+PINCODE_CENTROIDS_CSV = config('PINCODE_CENTROIDS_CSV', default=str(BASE_DIR / 'data' / 'pincode_centroids.csv'))
+MAP_MARKER_MIN_ZOOM = config('MAP_MARKER_MIN_ZOOM', default=14, cast=int)  # below this, map tiles hold clusters
+MAP_TILE_TIMEOUT = config('MAP_TILE_TIMEOUT', default=600, cast=int)  # seconds
+
+# Therapist search
+THERAPIST_SEARCH_CHANGES_TIMEOUT = config('THERAPIST_SEARCH_CHANGES_TIMEOUT', default=3600, cast=int)  # seconds
+THERAPIST_SEARCH_MAX_REPLAY = config('THERAPIST_SEARCH_MAX_REPLAY', default=200, cast=int)  # versions before a full rebuild
+MATCHING_CAPACITY_DAYS = config('MATCHING_CAPACITY_DAYS', default=7, cast=int)  # days of free time counted when matching
+MATCHING_CAPACITY_TTL = config('MATCHING_CAPACITY_TTL', default=300, cast=int)  # seconds
+
+# Therapist dashboard
+THERAPIST_DASHBOARD_TIMEOUT = config('THERAPIST_DASHBOARD_TIMEOUT', default=900, cast=int)  # seconds, snapshots are also invalidated on change
+
+# Permissions
+PERMISSION_CACHE_TIMEOUT = config('PERMISSION_CACHE_TIMEOUT', default=900, cast=int)  # seconds, per user
+AUTH_PRINCIPAL_CACHE_TIMEOUT = config('AUTH_PRINCIPAL_CACHE_TIMEOUT', default=300, cast=int)  # seconds, in Redis
+AUTH_PRINCIPAL_LOCAL_SIZE = config('AUTH_PRINCIPAL_LOCAL_SIZE', default=1024, cast=int)  # principals per process
+AUTH_PRINCIPAL_LOCAL_TTL = config('AUTH_PRINCIPAL_LOCAL_TTL', default=5, cast=int)  # seconds, bounds revocation lag
+
+# Activity tracking
+ACTIVITY_TRACKING_RESOLUTION = config('ACTIVITY_TRACKING_RESOLUTION', default=60, cast=int)  # seconds per user and session
+ACTIVITY_FLUSH_BATCH_SIZE = config('ACTIVITY_FLUSH_BATCH_SIZE', default=1000, cast=int)
 
 MIN_CONSULTATION_FEE = config('MIN_CONSULTATION_FEE', default=500, cast=int)
 MAX_CONSULTATION_FEE = config('MAX_CONSULTATION_FEE', default=50000, cast=int)
@@ -0,0 +1,171 @@
+# Cached Free-slot Index
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from therapists.models import TherapistProfile
+from .availability import AvailabilityEngine
+
+
+KEY_PREFIX = 'free_slot_index'
+
+
+class FreeSlotIndex:
+    """
+    Materialized free-time index per therapist and day, kept in the default
+    (Redis) cache.
+
+    Each entry holds the free intervals for one therapist on one day, so slots
+    of any duration can be derived on read without touching the database.
+    Only days between today and MAX_ADVANCE_BOOKING_DAYS ahead are indexed;
+    other days are computed directly. Entries are refreshed by the model
+    signals in sessions/signals.py whenever a booking, availability rule or
+    calendar event changes, and expire after FREE_SLOT_INDEX_TIMEOUT as a
+    safety net for writes that bypass signals (queryset.update, bulk_create).
+    """
+
+    @staticmethod
+    def key(therapist_id, day):
+        return f"{KEY_PREFIX}:{therapist_id}:{day.isoformat()}"
+
+    @staticmethod
+    def window():
+        """First and last day covered by the index"""
+        today = timezone.localdate()
+        return today, today + timedelta(days=getattr(settings, 'MAX_ADVANCE_BOOKING_DAYS', 30))
+
+    @staticmethod
+    def timeout():
+        return getattr(settings, 'FREE_SLOT_INDEX_TIMEOUT', 6 * 60 * 60)
+
+    @staticmethod
+    def get_free_slots(therapist_ids=None, date_from=None, date_to=None,
+                       session_duration=60, step_minutes=30, not_before=None):
+        """Cached equivalent of AvailabilityEngine.get_free_slots"""
+        free_intervals = FreeSlotIndex.get_free_intervals(therapist_ids, date_from, date_to)
+        return AvailabilityEngine.slots_from_intervals(
+            free_intervals, session_duration, step_minutes, not_before
+        )
+
+    @staticmethod
+    def get_free_intervals(therapist_ids=None, date_from=None, date_to=None):
+        """
+        Cached equivalent of AvailabilityEngine.get_free_intervals. Indexed
+        days are read with a single get_many; misses are computed in one
+        engine call and written back.
+        """
+        if date_to is None:
+            date_to = date_from
+        if therapist_ids is None:
+            therapist_ids = list(TherapistProfile.objects.filter(
+                approval_status='approved',
+                is_available=True
+            ).values_list('id', flat=True))
+        if not therapist_ids:
+            return {}
+
+        window_start, window_end = FreeSlotIndex.window()
+        days = []
+        current_date = date_from
+        while current_date <= date_to:
+            days.append(current_date)
+            current_date += timedelta(days=1)
+
+        keys = {
+            FreeSlotIndex.key(therapist_id, d): (therapist_id, d)
+            for therapist_id in therapist_ids for d in days
+            if window_start <= d <= window_end
+        }
+        cached = cache.get_many(list(keys))
+
+        result = {therapist_id: {} for therapist_id in therapist_ids}
+        needed = set()
+        for therapist_id in therapist_ids:
+            for d in days:
+                key = FreeSlotIndex.key(therapist_id, d)
+                if key in cached:
+                    result[therapist_id][d] = [tuple(interval) for interval in cached[key]]
+                else:
+                    needed.add((therapist_id, d))
+
+        if needed:
+            needed_days = [d for _, d in needed]
+            computed = AvailabilityEngine.get_free_intervals(
+                list({therapist_id for therapist_id, _ in needed}),
+                min(needed_days), max(needed_days)
+            )
+            to_cache = {}
+            for therapist_id, d in needed:
+                free = computed.get(therapist_id, {}).get(d)
+                if free is None:
+                    continue
+                result[therapist_id][d] = free
+                key = FreeSlotIndex.key(therapist_id, d)
+                if key in keys:
+                    to_cache[key] = free
+            if to_cache:
+                cache.set_many(to_cache, FreeSlotIndex.timeout())
+
+        # Therapists the engine no longer knows about have no days at all
+        return {
+            therapist_id: dict(sorted(therapist_days.items()))
+            for therapist_id, therapist_days in result.items()
+            if therapist_days
+        }
+
+    @staticmethod
+    def refresh(therapist_id, days=None):
+        """
+        Recompute and store the index entries for one therapist. ``days``
+        limits the refresh to specific dates; days outside the index window
+        are ignored. Refreshes the whole window when ``days`` is None.
+        """
+        window_start, window_end = FreeSlotIndex.window()
+        if days is None:
+            days = {window_start + timedelta(days=i) for i in range((window_end - window_start).days + 1)}
+        days = {d for d in days if window_start <= d <= window_end}
+        if not days:
+            return 0
+
+        computed = AvailabilityEngine.get_free_intervals([therapist_id], min(days), max(days))
+        therapist_days = computed.get(therapist_id)
+        if therapist_days is None:
+            cache.delete_many([FreeSlotIndex.key(therapist_id, d) for d in days])
+            return 0
+
+        cache.set_many(
+            {FreeSlotIndex.key(therapist_id, d): therapist_days[d] for d in days},
+            FreeSlotIndex.timeout()
+        )
+        return len(days)
+
+    @staticmethod
+    def rebuild(therapist_ids=None):
+        """
+        Compute the full index from scratch without touching the cache.
+        Returns {cache_key: free_intervals}.
+        """
+        window_start, window_end = FreeSlotIndex.window()
+        computed = AvailabilityEngine.get_free_intervals(therapist_ids, window_start, window_end)
+        return {
+            FreeSlotIndex.key(therapist_id, d): free
+            for therapist_id, therapist_days in computed.items()
+            for d, free in therapist_days.items()
+        }
+
+    @staticmethod
+    def diff(therapist_ids=None):
+        """
+        Compare a from-scratch rebuild with the live index.
+        Returns (rebuilt, missing_keys, stale_keys).
+        """
+        rebuilt = FreeSlotIndex.rebuild(therapist_ids)
+        live = cache.get_many(list(rebuilt))
+
+        missing = sorted(key for key in rebuilt if key not in live)
+        stale = sorted(
+            key for key, free in rebuilt.items()
+            if key in live and [tuple(interval) for interval in live[key]] != list(free)
+        )
+        return rebuilt, missing, stale
@@ -0,0 +1,105 @@
+# Spatial Index for Location Search
+import math
+import numpy as np
+from django.db.models import Q
+
+from . import geohash
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """(min_lat, min_lon, max_lat, max_lon) enclosing the circle; longitudes may leave [-180, 180]"""
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = max(-90.0, latitude - lat_delta)
+    max_lat = min(90.0, latitude + lat_delta)
+    # A degree of longitude shrinks towards the poles; size the box for the widest latitude
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat < 1e-9:
+        lon_delta = 180.0
+    else:
+        lon_delta = min(180.0, math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat)))
+    return min_lat, longitude - lon_delta, max_lat, longitude + lon_delta
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """Great-circle distances in km from one point to arrays of points"""
+    lat1 = np.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlon = np.radians(longitudes - longitude)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class SpatialIndex:
+    """
+    Radius and nearest-neighbour search over located users.
+
+    Candidates are narrowed in SQL with the indexed User.geohash column
+    (prefix match on the cells covering the search box) plus a
+    latitude/longitude bounding box, then only their coordinates are
+    fetched and refined with a vectorized haversine in NumPy. Model
+    instances are loaded for the requested page only.
+
+    ``prefix`` is the path from the queried model to the User fields, e.g.
+    'user__' for profiles and '' for User itself.
+    """
+
+    @staticmethod
+    def prefilter(queryset, latitude, longitude, radius_km, prefix='user__'):
+        min_lat, min_lon, max_lat, max_lon = bounding_box(latitude, longitude, radius_km)
+        filters = Q(**{f'{prefix}latitude__range': (min_lat, max_lat)})
+
+        if min_lon >= -180.0 and max_lon <= 180.0:
+            filters &= Q(**{f'{prefix}longitude__range': (min_lon, max_lon)})
+            precision = geohash.covering_precision(max_lat - min_lat, max_lon - min_lon)
+            if precision:
+                cells = Q()
+                for cell in geohash.covering_cells(min_lat, min_lon, max_lat, max_lon, precision):
+                    cells |= Q(**{f'{prefix}geohash__startswith': cell})
+                filters &= cells
+        # Otherwise the box crosses the antimeridian; the latitude band alone is still correct
+
+        return queryset.filter(filters)
+
+    @staticmethod
+    def search(queryset, latitude, longitude, radius_km, limit=None, offset=0, prefix='user__'):
+        """
+        Rows of ``queryset`` within ``radius_km``, nearest first.
+        Returns (total_matches, [(pk, distance_km), ...]) for the requested page.
+        """
+        rows = list(
+            SpatialIndex.prefilter(queryset, latitude, longitude, radius_km, prefix).values_list(
+                'pk', f'{prefix}latitude', f'{prefix}longitude'
+            )
+        )
+        if not rows:
+            return 0, []
+
+        ids, latitudes, longitudes = zip(*rows)
+        distances = haversine_km(
+            latitude, longitude,
+            np.array(latitudes, dtype=float),
+            np.array(longitudes, dtype=float)
+        )
+        within = np.nonzero(distances <= radius_km)[0]
+        ordered = within[np.argsort(distances[within], kind='stable')]
+
+        end = None if limit is None else offset + limit
+        return len(ordered), [(ids[i], float(distances[i])) for i in ordered[offset:end]]
+
+    @staticmethod
+    def nearest(queryset, latitude, longitude, k=10, max_radius_km=500, initial_radius_km=5, prefix='user__'):
+        """
+        The ``k`` nearest rows within ``max_radius_km``, as [(pk, distance_km), ...].
+        The search radius grows until it holds k matches; anything outside
+        it is farther than every match inside, so the result is exact.
+        """
+        radius_km = min(initial_radius_km, max_radius_km)
+        while True:
+            total, matches = SpatialIndex.search(queryset, latitude, longitude, radius_km, limit=k, prefix=prefix)
+            if total >= k or radius_km >= max_radius_km:
+                return matches
+            radius_km = min(radius_km * 4, max_radius_km)
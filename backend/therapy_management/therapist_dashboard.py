@@ -0,0 +1,136 @@
+# Therapist Dashboard Snapshots
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from therapists.models import TherapistProfile
+from sessions.models import TherapySession
+from therapy_management.reminder_queue import ReminderQueueManager
+from .cache_versions import VersionStamp
+
+SNAPSHOT_KEY_PREFIX = 'therapist_dashboard'
+VERSION_KEY_PREFIX = 'therapist_dashboard_version'
+
+TODAY_STATUSES = ['scheduled', 'confirmed', 'in_progress']
+JOINABLE_STATUSES = ['scheduled', 'confirmed']
+
+
+class TherapistDashboard:
+    """
+    Cached payload of TherapistDashboardView.
+
+    A snapshot is built with three queries whatever the therapist's
+    workload: the profile with its user and this week's session counts as
+    conditional aggregates, its specializations, and today's sessions with
+    their clients. It is cached per therapist and day under a per-therapist
+    version that the session, review and profile signals bump once their
+    transaction commits, so a polling dashboard is served from the cache
+    until something it shows actually changes. ``can_join`` depends on the
+    clock rather than the data and is worked out on every request from the
+    cached start times.
+    """
+
+    @staticmethod
+    def timeout():
+        return getattr(settings, 'THERAPIST_DASHBOARD_TIMEOUT', 15 * 60)
+
+    @staticmethod
+    def version_key(therapist_id):
+        return f"{VERSION_KEY_PREFIX}:{therapist_id}"
+
+    @staticmethod
+    def version(therapist_id):
+        return VersionStamp.get(TherapistDashboard.version_key(therapist_id))
+
+    @staticmethod
+    def bump(therapist_ids):
+        """Move ``therapist_ids`` to new versions, orphaning their snapshots"""
+        for therapist_id in therapist_ids:
+            VersionStamp.bump(TherapistDashboard.version_key(therapist_id))
+
+    @staticmethod
+    def invalidate(therapist_ids):
+        """Drop the snapshots of ``therapist_ids`` once the current transaction commits"""
+        VersionStamp.bump_on_commit(
+            TherapistDashboard.version_key(therapist_id)
+            for therapist_id in therapist_ids if therapist_id is not None
+        )
+
+    @staticmethod
+    def get(therapist_id, now=None):
+        """Dashboard payload for a therapist, or None if the profile doesn't exist"""
+        now = now or timezone.now()
+        today = now.date()
+        key = f"{SNAPSHOT_KEY_PREFIX}:{therapist_id}:{TherapistDashboard.version(therapist_id)}:{today.isoformat()}"
+
+        snapshot = cache.get(key)
+        if snapshot is None:
+            snapshot = TherapistDashboard.build(therapist_id, today)
+            if snapshot is None:
+                return None
+            cache.set(key, snapshot, TherapistDashboard.timeout())
+        return TherapistDashboard.render(snapshot, now)
+
+    @staticmethod
+    def build(therapist_id, today):
+        week_start = today - timedelta(days=today.weekday())
+        week_end = week_start + timedelta(days=6)
+        this_week = Q(sessions__scheduled_date__range=[week_start, week_end])
+
+        therapist = TherapistProfile.objects.select_related('user').annotate(
+            sessions_completed=Count('sessions', filter=this_week & Q(sessions__status='completed')),
+            sessions_scheduled=Count('sessions', filter=this_week & Q(sessions__status__in=JOINABLE_STATUSES)),
+            no_shows=Count('sessions', filter=this_week & Q(sessions__status='no_show')),
+            clients_seen=Count('sessions__client', filter=this_week, distinct=True)
+        ).filter(pk=therapist_id).first()
+        if therapist is None:
+            return None
+
+        today_sessions = TherapySession.objects.filter(
+            therapist_id=therapist_id,
+            scheduled_date=today,
+            status__in=TODAY_STATUSES
+        ).select_related('client__user').order_by('scheduled_time')
+
+        return {
+            'profile': {
+                'name': therapist.user.get_full_name(),
+                'license_number': therapist.license_number,
+                'approval_status': therapist.approval_status,
+                'specializations': list(therapist.specializations.values_list('name', flat=True)),
+                'average_rating': float(therapist.average_rating),
+                'total_reviews': therapist.total_reviews,
+                'total_sessions': therapist.total_sessions,
+            },
+            'today_schedule': [{
+                'id': session.session_id,
+                'client_name': session.client.user.get_full_name(),
+                'time': session.scheduled_time.strftime('%H:%M'),
+                'duration': session.duration_minutes,
+                'type': session.session_type,
+                'status': session.status,
+                'meeting_link': session.meeting_link,
+                'starts_at': ReminderQueueManager.session_start(session).isoformat(),
+            } for session in today_sessions],
+            'weekly_stats': {
+                'sessions_completed': therapist.sessions_completed,
+                'sessions_scheduled': therapist.sessions_scheduled,
+                'average_rating': float(therapist.average_rating),
+                'clients_seen': therapist.clients_seen,
+                'no_shows': therapist.no_shows,
+            }
+        }
+
+    @staticmethod
+    def render(snapshot, now):
+        """The response payload for a snapshot at ``now``"""
+        join_window = timedelta(minutes=getattr(settings, 'SESSION_JOIN_WINDOW', 5))
+        today_schedule = []
+        for entry in snapshot['today_schedule']:
+            entry = dict(entry)
+            starts_at = datetime.fromisoformat(entry.pop('starts_at'))
+            entry['can_join'] = now >= starts_at - join_window and entry['status'] in JOINABLE_STATUSES
+            today_schedule.append(entry)
+        return {**snapshot, 'today_schedule': today_schedule}
@@ -0,0 +1,427 @@
+# Therapist Search Index
+import bisect
+import re
+import threading
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from therapists.models import TherapistProfile
+from .cache_versions import VersionStamp
+
+
+VERSION_KEY = 'therapist_search_version'
+CHANGES_KEY_PREFIX = 'therapist_search_changes'
+FULL_REBUILD = 'all'
+
+# Field weights for ranking; a therapist's weight for a token is the best field it appears in
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'specialization': 3.0,
+    'competency': 2.0,
+    'language': 2.0,
+    'bio': 1.0,
+}
+PREFIX_FACTOR = 0.8
+TYPO_FACTOR = 0.5
+MAX_PREFIX_EXPANSIONS = 50
+RATING_BOOST = 0.1
+
+FEE_BANDS = [
+    (0, 500, '0-500'),
+    (500, 1000, '500-1000'),
+    (1000, 2000, '1000-2000'),
+    (2000, 5000, '2000-5000'),
+    (5000, None, '5000+'),
+]
+RATING_FACETS = [4, 3, 2, 1]
+
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """
+    Edit distance between a and b counting an adjacent transposition as one
+    edit, or limit + 1 once it exceeds ``limit``
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            cost = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            )
+            if before is not None and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def typo_limit(word):
+    """Edits tolerated for a query word; short words must match exactly"""
+    if len(word) < 4:
+        return 0
+    return 1 if len(word) < 8 else 2
+
+
+def fee_band(fee):
+    for low, high, label in FEE_BANDS:
+        if fee >= low and (high is None or fee < high):
+            return label
+    return FEE_BANDS[0][2]
+
+
+class InvertedIndex:
+    """
+    In-memory inverted index over therapist search documents, with a sorted
+    vocabulary for prefix lookups and a trigram map for typo tolerance.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.postings = defaultdict(dict)
+        self.vocabulary = []
+        self.vocabulary_trigrams = defaultdict(set)
+
+    def add(self, document):
+        self.remove(document['id'])
+        self.documents[document['id']] = document
+        for token, weight in document['tokens'].items():
+            if token not in self.postings:
+                bisect.insort(self.vocabulary, token)
+                for trigram in trigrams(token):
+                    self.vocabulary_trigrams[trigram].add(token)
+            self.postings[token][document['id']] = weight
+
+    def copy(self):
+        """An independent copy, for applying changes while readers use this one"""
+        index = InvertedIndex()
+        index.documents = dict(self.documents)
+        index.postings = defaultdict(dict, {token: dict(posting) for token, posting in self.postings.items()})
+        index.vocabulary = list(self.vocabulary)
+        index.vocabulary_trigrams = defaultdict(set, {
+            trigram: set(tokens) for trigram, tokens in self.vocabulary_trigrams.items()
+        })
+        return index
+
+    def remove(self, therapist_id):
+        document = self.documents.pop(therapist_id, None)
+        if document is None:
+            return
+        for token in document['tokens']:
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(therapist_id, None)
+            if not posting:
+                del self.postings[token]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+                for trigram in trigrams(token):
+                    self.vocabulary_trigrams[trigram].discard(token)
+                    if not self.vocabulary_trigrams[trigram]:
+                        del self.vocabulary_trigrams[trigram]
+
+    def match(self, word, prefix=False):
+        """{therapist_id: score} for one query word"""
+        candidates = {}
+        if word in self.postings:
+            candidates[word] = 1.0
+
+        if prefix:
+            start = bisect.bisect_left(self.vocabulary, word)
+            for token in self.vocabulary[start:start + MAX_PREFIX_EXPANSIONS]:
+                if not token.startswith(word):
+                    break
+                candidates.setdefault(token, PREFIX_FACTOR)
+
+        limit = typo_limit(word)
+        if limit:
+            word_trigrams = trigrams(word)
+            overlaps = defaultdict(int)
+            for trigram in word_trigrams:
+                for token in self.vocabulary_trigrams.get(trigram, ()):
+                    overlaps[token] += 1
+            # An edit changes at most four of a word's trigrams (three, or four for a transposition)
+            needed = max(1, len(word_trigrams) - 4 * limit)
+            for token, overlap in overlaps.items():
+                if overlap >= needed and token not in candidates and edit_distance(word, token, limit) <= limit:
+                    candidates[token] = TYPO_FACTOR
+
+        scores = {}
+        for token, factor in candidates.items():
+            for therapist_id, weight in self.postings[token].items():
+                score = weight * factor
+                if score > scores.get(therapist_id, 0):
+                    scores[therapist_id] = score
+        return scores
+
+    def search(self, query, category_id=None, language=None, min_fee=None, max_fee=None, min_rating=None):
+        """
+        (ranked documents, facets) for documents matching every query word
+        (the last one as a prefix) and the filters
+        """
+        words = tokenize(query)
+        if words:
+            scores = None
+            for i, word in enumerate(words):
+                matches = self.match(word, prefix=(i == len(words) - 1))
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {
+                        therapist_id: score + matches[therapist_id]
+                        for therapist_id, score in scores.items()
+                        if therapist_id in matches
+                    }
+                if not scores:
+                    break
+        else:
+            scores = dict.fromkeys(self.documents, 0.0)
+
+        results = []
+        for therapist_id, score in scores.items():
+            document = self.documents[therapist_id]
+            if category_id is not None and category_id not in document['category_ids']:
+                continue
+            if language and language.lower() not in document['language_keys']:
+                continue
+            if min_fee is not None and document['consultation_fee'] < min_fee:
+                continue
+            if max_fee is not None and document['consultation_fee'] > max_fee:
+                continue
+            if min_rating is not None and document['average_rating'] < min_rating:
+                continue
+            results.append((score + document['average_rating'] * RATING_BOOST, document))
+
+        results.sort(key=lambda item: (-item[0], -item[1]['total_reviews'], item[1]['id']))
+        return results, InvertedIndex.facets(document for _, document in results)
+
+    @staticmethod
+    def facets(documents):
+        categories = {}
+        languages = defaultdict(int)
+        fee_bands = defaultdict(int)
+        ratings = defaultdict(int)
+        for document in documents:
+            for category_id, name in document['specializations']:
+                entry = categories.setdefault(category_id, {'id': category_id, 'name': name, 'count': 0})
+                entry['count'] += 1
+            for language in document['languages']:
+                languages[language] += 1
+            fee_bands[fee_band(document['consultation_fee'])] += 1
+            for threshold in RATING_FACETS:
+                if document['average_rating'] >= threshold:
+                    ratings[threshold] += 1
+        return {
+            'categories': sorted(categories.values(), key=lambda entry: (-entry['count'], entry['name'])),
+            'languages': [
+                {'language': language, 'count': count}
+                for language, count in sorted(languages.items(), key=lambda item: (-item[1], item[0]))
+            ],
+            'fee_bands': [
+                {'band': label, 'count': fee_bands[label]}
+                for _, _, label in FEE_BANDS if fee_bands[label]
+            ],
+            'ratings': [
+                {'min_rating': threshold, 'count': ratings[threshold]}
+                for threshold in RATING_FACETS if ratings[threshold]
+            ],
+        }
+
+
+class TherapistSearchIndex:
+    """
+    Public therapist search over approved, available therapists.
+
+    Each process keeps an InvertedIndex of name, bio, specializations,
+    competencies, languages, fee and rating, so a keystroke costs one cache
+    read plus work proportional to the matching postings. Profile changes
+    (see therapists/signals.py) bump a version stamp in the cache and record
+    the changed therapist ids under it; processes replay the versions they
+    missed and reload just those therapists, falling back to a full rebuild
+    when a change record has expired or a global change (category or
+    competency renamed) was recorded. Queries run against an immutable
+    snapshot; updates build a new index and swap it in.
+    """
+
+    # (index, version), replaced as a whole so readers never see a half-applied change
+    _snapshot = (None, None)
+    _lock = threading.Lock()
+
+    @staticmethod
+    def changes_timeout():
+        return getattr(settings, 'THERAPIST_SEARCH_CHANGES_TIMEOUT', 60 * 60)
+
+    @staticmethod
+    def max_replay():
+        return getattr(settings, 'THERAPIST_SEARCH_MAX_REPLAY', 200)
+
+    @staticmethod
+    def changes_key(version):
+        return f"{CHANGES_KEY_PREFIX}:{version}"
+
+    @staticmethod
+    def notify(therapist_ids=None):
+        """
+        Record changed therapists once the surrounding transaction commits;
+        ``None`` means every document may have changed
+        """
+        changed = FULL_REBUILD if therapist_ids is None else sorted(set(therapist_ids))
+
+        def record():
+            version = VersionStamp.bump(VERSION_KEY)
+            cache.set(TherapistSearchIndex.changes_key(version), changed, TherapistSearchIndex.changes_timeout())
+
+        transaction.on_commit(record)
+
+    @staticmethod
+    def searchable():
+        return TherapistProfile.objects.filter(approval_status='approved', is_available=True)
+
+    @staticmethod
+    def build_document(therapist):
+        specializations = [(spec.id, spec.name) for spec in therapist.specializations.all()]
+        competencies = [competency.name for competency in therapist.competencies.all()]
+        languages = [language.strip().title() for language in therapist.languages_spoken.split(',') if language.strip()]
+        name = therapist.user.get_full_name()
+
+        tokens = {}
+        fields = [
+            ('name', name),
+            ('bio', therapist.bio),
+            ('specialization', ' '.join(spec_name for _, spec_name in specializations)),
+            ('competency', ' '.join(competencies)),
+            ('language', ' '.join(languages)),
+        ]
+        for field, text in fields:
+            weight = FIELD_WEIGHTS[field]
+            for token in tokenize(text):
+                if weight > tokens.get(token, 0):
+                    tokens[token] = weight
+
+        return {
+            'id': therapist.id,
+            'name': name,
+            'license_number': therapist.license_number,
+            'bio': therapist.bio,
+            'specializations': specializations,
+            'category_ids': {spec_id for spec_id, _ in specializations},
+            'competencies': competencies,
+            'languages': languages,
+            'language_keys': {language.lower() for language in languages},
+            'languages_spoken': therapist.languages_spoken,
+            'consultation_fee': float(therapist.consultation_fee),
+            'average_rating': float(therapist.average_rating),
+            'total_reviews': therapist.total_reviews,
+            'tokens': tokens,
+        }
+
+    @staticmethod
+    def load_documents(therapist_ids=None):
+        therapists = TherapistSearchIndex.searchable().select_related('user').prefetch_related(
+            'specializations', 'competencies'
+        )
+        if therapist_ids is not None:
+            therapists = therapists.filter(id__in=therapist_ids)
+        return [TherapistSearchIndex.build_document(therapist) for therapist in therapists]
+
+    @staticmethod
+    def changes_since(local_version):
+        """
+        (current_version, changed therapist ids) since ``local_version``.
+        The ids are None when the caller has to rebuild from scratch: it
+        has no version yet, fell too far behind, or a change record expired
+        or covered every therapist. Also used by the matching engine.
+        """
+        version = VersionStamp.get(VERSION_KEY)
+        if local_version is None or local_version > version:
+            return version, None
+        if version - local_version > TherapistSearchIndex.max_replay():
+            return version, None
+
+        keys = [TherapistSearchIndex.changes_key(v) for v in range(local_version + 1, version + 1)]
+        records = cache.get_many(keys) if keys else {}
+        if len(records) < len(keys) or FULL_REBUILD in records.values():
+            return version, None
+
+        changed = set()
+        for therapist_ids in records.values():
+            changed.update(therapist_ids)
+        return version, changed
+
+    @staticmethod
+    def _sync():
+        """
+        The index at the shared version. The published index is never
+        modified: changes are applied to a copy (or a fresh rebuild) built
+        without the lock, and only swapping the reference in takes it.
+        """
+        index, local_version = TherapistSearchIndex._snapshot
+        version, changed = TherapistSearchIndex.changes_since(
+            local_version if index is not None else None
+        )
+        if index is not None and version == local_version:
+            return index
+
+        if changed is None:
+            index = InvertedIndex()
+            for document in TherapistSearchIndex.load_documents():
+                index.add(document)
+        elif changed:
+            documents = TherapistSearchIndex.load_documents(changed)
+            index = index.copy()
+            for therapist_id in changed - {document['id'] for document in documents}:
+                # No longer approved/available, or deleted
+                index.remove(therapist_id)
+            for document in documents:
+                index.add(document)
+
+        with TherapistSearchIndex._lock:
+            published, published_version = TherapistSearchIndex._snapshot
+            # Another thread may have published a newer index meanwhile
+            if published is None or published_version <= version:
+                TherapistSearchIndex._snapshot = (index, version)
+        return index
+
+    @staticmethod
+    def search(query='', limit=20, offset=0, **filters):
+        """Ranked page of matching therapists with facet counts over all matches"""
+        index = TherapistSearchIndex._sync()
+        results, facets = index.search(query, **filters)
+
+        page = results[offset:offset + limit]
+        return {
+            'count': len(results),
+            'results': [
+                {
+                    'id': document['id'],
+                    'name': document['name'],
+                    'license_number': document['license_number'],
+                    'specializations': [name for _, name in document['specializations']],
+                    'bio': document['bio'],
+                    'average_rating': document['average_rating'],
+                    'total_reviews': document['total_reviews'],
+                    'consultation_fee': document['consultation_fee'],
+                    'languages_spoken': document['languages_spoken'],
+                    'score': round(score, 4),
+                }
+                for score, document in page
+            ],
+            'facets': facets,
+        }
@@ -23,7 +23,7 @@ from django.http import JsonResponse
 
 # Swagger imports
 from .swagger import schema_view
-from . import health
+from . import health, reporting, coupon_campaigns, map_tiles, matching
 
 urlpatterns = [
     # Admin
@@ -42,6 +42,19 @@ urlpatterns = [
     path('api/sessions/', include('sessions.urls')),
     path('api/companies/', include('companies.urls')),
     path('api/payments/', include('payments.urls')),
+    path('api/reports/export/', reporting.export_report, name='report-export'),
+    path(
+        'api/coupons/<int:coupon_system_id>/campaign/',
+        coupon_campaigns.start_coupon_campaign,
+        name='coupon-campaign-start'
+    ),
+    path(
+        'api/coupons/<int:coupon_system_id>/campaign/progress/',
+        coupon_campaigns.coupon_campaign_progress,
+        name='coupon-campaign-progress'
+    ),
+    path('api/admin/map/tiles/', map_tiles.admin_map_tiles, name='admin-map-tiles'),
+    path('api/matching/therapists/', matching.therapist_matches, name='therapist-matches'),
     
     # Health Check
     path('health/', health.health_check, name='health-check'),